@@ -1,17 +1,33 @@
-from typing import List
+from hashlib import sha256
+from threading import current_thread
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import nest_asyncio
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from phi.assistant import Assistant
-from phi.document import Document
-from phi.document.reader.pdf import PDFReader
-from phi.document.reader.website import WebsiteReader
 from phi.utils.log import logger
 
-from assistant import get_llm_os  # type: ignore
+from assistant import get_llm_os, get_ingestion_queue, get_session_store  # type: ignore
+from cache import TTLCache  # type: ignore
+from ingestion import IngestionJob  # type: ignore
+from resources import resource_pool  # type: ignore
+from sessions import IngestedSource, SessionDescriptor, SessionSettings  # type: ignore
+from shell_tools import ShellEvent, stream_shell_output  # type: ignore
+from storage import PgRunStorage  # type: ignore
+from streaming import MarkdownStreamRenderer, ShellOutputRenderer  # type: ignore
+from tracing import tracer  # type: ignore
+from vectordb import PgVectorStore  # type: ignore
 
 nest_asyncio.apply()
 
+# Number of chat messages rendered on each rerun, older messages are loaded on request
+MESSAGES_PAGE_SIZE = 20
+# Number of run_ids shown in the Run ID selector
+RUN_IDS_PAGE_SIZE = 20
+# Seconds the assistant waits for a parallel tool call or team delegation
+TOOL_CALL_TIMEOUT = 120
+
 st.set_page_config(
     page_title="Claude OS (by Phidata)",
     page_icon=":orange_heart:",
@@ -20,176 +36,104 @@ st.title("Claude OS (by Phidata)")
 st.markdown("##### :orange_heart: built using [phidata](https://github.com/phidatahq/phidata)")
 
 
+# get_llm_os flag -> (checkbox label, help, enabled in new sessions), in the order the checkboxes are shown
+tool_options: Dict[str, Tuple[str, str, bool]] = {
+    "calculator": ("Calculator", "Enable calculator.", True),
+    "file_tools": ("File Tools", "Enable file tools.", True),
+    "ddg_search": ("Web Search", "Enable web search using DuckDuckGo.", True),
+    "shell_tools": ("Shell Tools", "Enable shell tools.", False),
+    "parallel_tool_calls": (
+        "Parallel Tool Calls",
+        "Run the tool calls and team delegations of a response at the same time.",
+        False,
+    ),
+}
+team_options: Dict[str, Tuple[str, str, bool]] = {
+    "data_analyst": ("Data Analyst", "Enable the Data Analyst assistant for data related queries.", False),
+    "python_assistant": ("Python Assistant", "Enable the Python Assistant for writing and running python code.", False),
+    "research_assistant": ("Research Assistant", "Enable the research assistant (uses Exa).", False),
+    "investment_assistant": (
+        "Investment Assistant",
+        "Enable the investment assistant. NOTE: This is not financial advice.",
+        False,
+    ),
+}
+
+
 def main() -> None:
+    # Get the session, its descriptor is stored in postgres and its id in the URL
+    session = get_session()
+    if session is None:
+        st.warning("Could not load the Claude OS (by Phidata) session, is the database running?")
+        return
+
     # Get LLM Model
     llm_id = "claude-3-5-sonnet-20240620"
-    # Set llm_id in session state
-    if "llm_id" not in st.session_state:
-        st.session_state["llm_id"] = llm_id
     # Restart the assistant if llm_id changes
-    elif st.session_state["llm_id"] != llm_id:
-        st.session_state["llm_id"] = llm_id
-        restart_assistant()
+    if session.llm_id != llm_id:
+        get_session_assistants().pop(session.assistant_key())
+        session.llm_id = llm_id
+        restart_assistant(session)
 
     # Sidebar checkboxes for selecting tools
     st.sidebar.markdown("### Select Tools")
-
-    # Enable Calculator
-    if "calculator_enabled" not in st.session_state:
-        st.session_state["calculator_enabled"] = True
-    # Get calculator_enabled from session state if set
-    calculator_enabled = st.session_state["calculator_enabled"]
-    # Checkbox for enabling calculator
-    calculator = st.sidebar.checkbox("Calculator", value=calculator_enabled, help="Enable calculator.")
-    if calculator_enabled != calculator:
-        st.session_state["calculator_enabled"] = calculator
-        calculator_enabled = calculator
-        restart_assistant()
-
-    # Enable file tools
-    if "file_tools_enabled" not in st.session_state:
-        st.session_state["file_tools_enabled"] = True
-    # Get file_tools_enabled from session state if set
-    file_tools_enabled = st.session_state["file_tools_enabled"]
-    # Checkbox for enabling shell tools
-    file_tools = st.sidebar.checkbox("File Tools", value=file_tools_enabled, help="Enable file tools.")
-    if file_tools_enabled != file_tools:
-        st.session_state["file_tools_enabled"] = file_tools
-        file_tools_enabled = file_tools
-        restart_assistant()
-
-    # Enable Web Search via DuckDuckGo
-    if "ddg_search_enabled" not in st.session_state:
-        st.session_state["ddg_search_enabled"] = True
-    # Get ddg_search_enabled from session state if set
-    ddg_search_enabled = st.session_state["ddg_search_enabled"]
-    # Checkbox for enabling web search
-    ddg_search = st.sidebar.checkbox("Web Search", value=ddg_search_enabled, help="Enable web search using DuckDuckGo.")
-    if ddg_search_enabled != ddg_search:
-        st.session_state["ddg_search_enabled"] = ddg_search
-        ddg_search_enabled = ddg_search
-        restart_assistant()
-
-    # Enable shell tools
-    if "shell_tools_enabled" not in st.session_state:
-        st.session_state["shell_tools_enabled"] = False
-    # Get shell_tools_enabled from session state if set
-    shell_tools_enabled = st.session_state["shell_tools_enabled"]
-    # Checkbox for enabling shell tools
-    shell_tools = st.sidebar.checkbox("Shell Tools", value=shell_tools_enabled, help="Enable shell tools.")
-    if shell_tools_enabled != shell_tools:
-        st.session_state["shell_tools_enabled"] = shell_tools
-        shell_tools_enabled = shell_tools
-        restart_assistant()
+    for name, (label, help_text, _) in tool_options.items():
+        option_checkbox(session, name, label, help_text)
 
     # Sidebar checkboxes for selecting team members
     st.sidebar.markdown("### Select Team Members")
-
-    # Enable Data Analyst
-    if "data_analyst_enabled" not in st.session_state:
-        st.session_state["data_analyst_enabled"] = False
-    # Get data_analyst_enabled from session state if set
-    data_analyst_enabled = st.session_state["data_analyst_enabled"]
-    # Checkbox for enabling web search
-    data_analyst = st.sidebar.checkbox(
-        "Data Analyst",
-        value=data_analyst_enabled,
-        help="Enable the Data Analyst assistant for data related queries.",
-    )
-    if data_analyst_enabled != data_analyst:
-        st.session_state["data_analyst_enabled"] = data_analyst
-        data_analyst_enabled = data_analyst
-        restart_assistant()
-
-    # Enable Python Assistant
-    if "python_assistant_enabled" not in st.session_state:
-        st.session_state["python_assistant_enabled"] = False
-    # Get python_assistant_enabled from session state if set
-    python_assistant_enabled = st.session_state["python_assistant_enabled"]
-    # Checkbox for enabling web search
-    python_assistant = st.sidebar.checkbox(
-        "Python Assistant",
-        value=python_assistant_enabled,
-        help="Enable the Python Assistant for writing and running python code.",
-    )
-    if python_assistant_enabled != python_assistant:
-        st.session_state["python_assistant_enabled"] = python_assistant
-        python_assistant_enabled = python_assistant
-        restart_assistant()
-
-    # Enable Research Assistant
-    if "research_assistant_enabled" not in st.session_state:
-        st.session_state["research_assistant_enabled"] = False
-    # Get research_assistant_enabled from session state if set
-    research_assistant_enabled = st.session_state["research_assistant_enabled"]
-    # Checkbox for enabling web search
-    research_assistant = st.sidebar.checkbox(
-        "Research Assistant",
-        value=research_assistant_enabled,
-        help="Enable the research assistant (uses Exa).",
-    )
-    if research_assistant_enabled != research_assistant:
-        st.session_state["research_assistant_enabled"] = research_assistant
-        research_assistant_enabled = research_assistant
-        restart_assistant()
-
-    # Enable Investment Assistant
-    if "investment_assistant_enabled" not in st.session_state:
-        st.session_state["investment_assistant_enabled"] = False
-    # Get investment_assistant_enabled from session state if set
-    investment_assistant_enabled = st.session_state["investment_assistant_enabled"]
-    # Checkbox for enabling web search
-    investment_assistant = st.sidebar.checkbox(
-        "Investment Assistant",
-        value=investment_assistant_enabled,
-        help="Enable the investment assistant. NOTE: This is not financial advice.",
-    )
-    if investment_assistant_enabled != investment_assistant:
-        st.session_state["investment_assistant_enabled"] = investment_assistant
-        investment_assistant_enabled = investment_assistant
-        restart_assistant()
-
-    # Get the assistant
-    llm_os: Assistant
-    if "llm_os" not in st.session_state or st.session_state["llm_os"] is None:
-        logger.info(f"---*--- Creating {llm_id} Claude OS (by Phidata) ---*---")
-        llm_os = get_llm_os(
-            llm_id=llm_id,
-            calculator=calculator_enabled,
-            ddg_search=ddg_search_enabled,
-            file_tools=file_tools_enabled,
-            shell_tools=shell_tools_enabled,
-            data_analyst=data_analyst_enabled,
-            python_assistant=python_assistant_enabled,
-            research_assistant=research_assistant_enabled,
-            investment_assistant=investment_assistant_enabled,
-        )
-        st.session_state["llm_os"] = llm_os
-    else:
-        llm_os = st.session_state["llm_os"]
-
-    # Create assistant run (i.e. log to database) and save run_id in session state
-    try:
-        st.session_state["llm_os_run_id"] = llm_os.create_run()
-    except Exception:
-        st.warning("Could not create Claude OS (by Phidata) run, is the database running?")
-        return
-
-    # Load existing messages
-    assistant_chat_history = llm_os.memory.get_chat_history()
-    if len(assistant_chat_history) > 0:
-        logger.debug("Loading chat history")
-        st.session_state["messages"] = assistant_chat_history
-    else:
-        logger.debug("No chat history found")
-        st.session_state["messages"] = [{"role": "assistant", "content": "Ask me questions..."}]
+    for name, (label, help_text, _) in team_options.items():
+        option_checkbox(session, name, label, help_text)
+
+    # Get the assistant, kept in memory while the session is in use and rebuilt from the descriptor otherwise
+    llm_os = get_session_assistant(session)
+
+    # Create assistant run (i.e. log to database) once, and load its messages once per app process
+    if session.run_id is None or st.session_state.get("loaded_run_id") != session.run_id:
+        assistant_key = session.assistant_key()
+        try:
+            run_id = llm_os.create_run()
+        except Exception:
+            st.warning("Could not create Claude OS (by Phidata) run, is the database running?")
+            return
+        if session.run_id != run_id:
+            session.run_id = run_id
+            save_session(session)
+            get_session_assistants().pop(assistant_key)
+            get_session_assistants().set(session.assistant_key(), llm_os)
+
+        # Load the last page of messages once per run, new messages are appended to the session state
+        assistant_chat_history, first_seq = load_messages(llm_os)
+        if len(assistant_chat_history) > 0:
+            logger.debug("Loading chat history")
+            st.session_state["messages"] = assistant_chat_history
+        else:
+            logger.debug("No chat history found")
+            st.session_state["messages"] = [{"role": "assistant", "content": "Ask me questions..."}]
+        # Earlier messages are read from storage a page at a time
+        st.session_state["messages_first_seq"] = first_seq
+        st.session_state["num_messages_shown"] = MESSAGES_PAGE_SIZE
+        st.session_state["loaded_run_id"] = run_id
+        # Refresh the run list as this run may be new
+        st.session_state["llm_os_run_ids"] = None
 
     # Prompt for user input
     if prompt := st.chat_input():
         st.session_state["messages"].append({"role": "user", "content": prompt})
 
-    # Display existing chat messages
-    for message in st.session_state["messages"]:
+    # Display the most recent chat messages
+    messages_to_show = st.session_state["messages"][-st.session_state["num_messages_shown"] :]
+    num_hidden_messages = len(st.session_state["messages"]) - len(messages_to_show)
+    first_seq = st.session_state.get("messages_first_seq")
+    if num_hidden_messages > 0 or first_seq is not None:
+        if st.button("Load earlier messages"):
+            if num_hidden_messages < MESSAGES_PAGE_SIZE and first_seq is not None:
+                earlier_messages, first_seq = load_messages(llm_os, before_seq=first_seq)
+                st.session_state["messages"] = earlier_messages + st.session_state["messages"]
+                st.session_state["messages_first_seq"] = first_seq
+            st.session_state["num_messages_shown"] += MESSAGES_PAGE_SIZE
+            st.rerun()
+    for message in messages_to_show:
         if message["role"] == "system":
             continue
         with st.chat_message(message["role"]):
@@ -200,12 +144,17 @@ def main() -> None:
     if last_message.get("role") == "user":
         question = last_message["content"]
         with st.chat_message("assistant"):
-            response = ""
-            resp_container = st.empty()
-            for delta in llm_os.run(question):
-                response += delta  # type: ignore
-                resp_container.markdown(response)
+            # The output of shell commands is shown while they run, above the response
+            shell_output = get_shell_output_sink(ShellOutputRenderer(st.container()))
+            # Render the response on a time and size budget instead of on every delta
+            renderer = MarkdownStreamRenderer(st.container())
+            with tracer.trace("turn", run_id=llm_os.run_id) as trace, stream_shell_output(shell_output):
+                for delta in llm_os.run(question):
+                    renderer.write(delta)  # type: ignore
+            response = renderer.close()
             st.session_state["messages"].append({"role": "assistant", "content": response})
+            if trace is not None:
+                st.session_state["last_trace"] = trace.summary()
 
     # Load Claude OS (by Phidata) knowledge base
     if llm_os.knowledge_base:
@@ -216,19 +165,21 @@ def main() -> None:
         input_url = st.sidebar.text_input(
             "Add URL to Knowledge Base", type="default", key=st.session_state["url_scrape_key"]
         )
+        # Loaded websites are only crawled again when asked to
+        recrawl = st.sidebar.checkbox("Re-crawl if already loaded", value=False)
         add_url_button = st.sidebar.button("Add URL")
         if add_url_button:
             if input_url is not None:
-                alert = st.sidebar.info("Processing URLs...", icon="ℹ️")
-                if f"{input_url}_scraped" not in st.session_state:
-                    scraper = WebsiteReader(max_links=2, max_depth=1)
-                    web_documents: List[Document] = scraper.read(input_url)
-                    if web_documents:
-                        llm_os.knowledge_base.load_documents(web_documents, upsert=True)
-                    else:
-                        st.sidebar.error("Could not read website")
-                    st.session_state[f"{input_url}_uploaded"] = True
-                alert.empty()
+                status = get_ingested_status(session, f"url:{input_url}")
+                # Adding a URL again retries it if it failed, and crawls it again if asked to
+                if status is None or status == "failed" or (recrawl and status == "done"):
+                    # Websites are crawled and loaded in the background, re-crawls only load the changed pages
+                    submit_ingestion(
+                        session,
+                        f"url:{input_url}",
+                        input_url,
+                        lambda on_finish: get_ingestion_queue().submit_url(input_url, on_finish=on_finish),
+                    )
 
         # Add PDFs to knowledge base
         if "file_uploader_key" not in st.session_state:
@@ -238,22 +189,39 @@ def main() -> None:
             "Add a PDF :page_facing_up:", type="pdf", key=st.session_state["file_uploader_key"]
         )
         if uploaded_file is not None:
-            alert = st.sidebar.info("Processing PDF...", icon="🧠")
             auto_rag_name = uploaded_file.name.split(".")[0]
-            if f"{auto_rag_name}_uploaded" not in st.session_state:
-                reader = PDFReader()
-                auto_rag_documents: List[Document] = reader.read(uploaded_file)
-                if auto_rag_documents:
-                    llm_os.knowledge_base.load_documents(auto_rag_documents, upsert=True)
-                else:
-                    st.sidebar.error("Could not read PDF")
-                st.session_state[f"{auto_rag_name}_uploaded"] = True
-            alert.empty()
+            pdf_data = uploaded_file.getvalue()
+            pdf_key = f"pdf:{sha256(pdf_data).hexdigest()}"
+            status = get_ingested_status(session, pdf_key)
+            # The uploader keeps the file across reruns, so a failed PDF is only loaded again when asked to
+            if status is None or (status == "failed" and st.sidebar.button(f"Retry {auto_rag_name}")):
+                # PDFs are parsed and loaded in the background
+                submit_ingestion(
+                    session,
+                    pdf_key,
+                    auto_rag_name,
+                    lambda on_finish: get_ingestion_queue().submit_pdf(
+                        pdf_data, name=auto_rag_name, on_finish=on_finish
+                    ),
+                )
+
+        # Show the status of this session's ingestion jobs
+        if len(session.ingested) > 0:
+            with st.sidebar:
+                show_ingestion_jobs()
 
     if llm_os.knowledge_base and llm_os.knowledge_base.vector_db:
         if st.sidebar.button("Clear Knowledge Base"):
             llm_os.knowledge_base.vector_db.clear()
             st.sidebar.success("Knowledge base cleared")
+        if isinstance(llm_os.knowledge_base.vector_db, PgVectorStore):
+            with st.sidebar.expander("Knowledge Base Cache", expanded=False):
+                st.json(llm_os.knowledge_base.vector_db.cache_stats())
+
+    # Show where the time of the last turn went, when tracing is on
+    if tracer.enabled and st.session_state.get("last_trace") is not None:
+        with st.sidebar.expander("Turn Timings", expanded=False):
+            st.json(st.session_state["last_trace"])
 
     # Show team member memory
     if llm_os.team and len(llm_os.team) > 0:
@@ -265,32 +233,183 @@ def main() -> None:
                         _team_member_memory_container.json(team_member.memory.get_llm_messages())
 
     if llm_os.storage:
-        llm_os_run_ids: List[str] = llm_os.storage.get_all_run_ids()
-        new_llm_os_run_id = st.sidebar.selectbox("Run ID", options=llm_os_run_ids)
-        if st.session_state["llm_os_run_id"] != new_llm_os_run_id:
-            logger.info(f"---*--- Loading {llm_id} run: {new_llm_os_run_id} ---*---")
-            st.session_state["llm_os"] = get_llm_os(
-                llm_id=llm_id,
-                calculator=calculator_enabled,
-                ddg_search=ddg_search_enabled,
-                file_tools=file_tools_enabled,
-                shell_tools=shell_tools_enabled,
-                data_analyst=data_analyst_enabled,
-                python_assistant=python_assistant_enabled,
-                research_assistant=research_assistant_enabled,
-                investment_assistant=investment_assistant_enabled,
-                run_id=new_llm_os_run_id,
+        # Show the most recent runs matching the search, the list is cached until the search or the run changes
+        run_id_search = st.sidebar.text_input("Search Runs", key="run_id_search")
+        if (
+            st.session_state.get("llm_os_run_ids") is None
+            or st.session_state.get("llm_os_run_ids_search") != run_id_search
+        ):
+            st.session_state["llm_os_run_ids"] = llm_os.storage.get_run_ids(  # type: ignore
+                limit=RUN_IDS_PAGE_SIZE, search=run_id_search
             )
+            st.session_state["llm_os_run_ids_search"] = run_id_search
+        llm_os_run_ids: List[str] = list(st.session_state["llm_os_run_ids"])
+        if session.run_id not in llm_os_run_ids:
+            llm_os_run_ids.insert(0, session.run_id)  # type: ignore
+        new_llm_os_run_id = st.sidebar.selectbox(
+            "Run ID", options=llm_os_run_ids, index=llm_os_run_ids.index(session.run_id)  # type: ignore
+        )
+        if session.run_id != new_llm_os_run_id:
+            logger.info(f"---*--- Loading {llm_id} run: {new_llm_os_run_id} ---*---")
+            # The assistant of the run is built on the next rerun, with the tools of this session
+            session.run_id = new_llm_os_run_id
+            save_session(session)
             st.rerun()
 
     if st.sidebar.button("New Run"):
-        restart_assistant()
+        restart_assistant(session)
+
+
+def get_session() -> Optional[SessionDescriptor]:
+    """Return the descriptor of this browser session, or None if it could not be loaded.
+
+    The session id is kept in the URL, so a session served by another app process, or by this one after a restart,
+    is read back from postgres. The descriptor is cached in st.session_state, which only this process sees.
+    """
+
+    session_id = st.query_params.get("session")
+    session: Optional[SessionDescriptor] = st.session_state.get("session")
+    if session is not None and session.session_id == session_id:
+        return session
+    try:
+        session = get_session_store().get(session_id) if session_id else None
+        if session is None:
+            options = {name: default for name, (_, _, default) in {**tool_options, **team_options}.items()}
+            session = SessionDescriptor(options=options)
+            get_session_store().save(session)
+    except Exception as e:
+        logger.error(f"Could not load session {session_id}: {e}")
+        return None
+    st.query_params["session"] = session.session_id
+    st.session_state["session"] = session
+    return session
+
+
+def save_session(session: SessionDescriptor) -> None:
+    get_session_store().save(session)
+    st.session_state["session"] = session
+
+
+def get_session_assistants() -> TTLCache:
+    # The assistants of the sessions this process served recently, the others are rebuilt from their descriptor
+    session_settings = SessionSettings()
+    return resource_pool.get(
+        "session_assistants",
+        lambda: TTLCache(maxsize=session_settings.max_assistants, ttl=session_settings.idle_ttl, sliding=True),
+    )
+
+
+def get_session_assistant(session: SessionDescriptor) -> Assistant:
+    assistants = get_session_assistants()
+    llm_os = assistants.get(session.assistant_key())
+    if llm_os is None:
+        logger.info(f"---*--- Creating {session.llm_id} Claude OS (by Phidata) ---*---")
+        llm_os = get_llm_os(
+            llm_id=session.llm_id,
+            run_id=session.run_id,
+            user_id=session.user_id,
+            tool_call_timeout=TOOL_CALL_TIMEOUT,
+            **session.options,
+        )
+        assistants.set(session.assistant_key(), llm_os)
+    return llm_os
+
+
+def option_checkbox(session: SessionDescriptor, name: str, label: str, help_text: str) -> None:
+    enabled = session.options.get(name, False)
+    if st.sidebar.checkbox(label, value=enabled, help=help_text) != enabled:
+        get_session_assistants().pop(session.assistant_key())
+        session.options[name] = not enabled
+        restart_assistant(session)
+
+
+def load_messages(llm_os: Assistant, before_seq: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """Return a page of the chat history of the run, and the seq to load the page before it from (None at the start)."""
+
+    storage = llm_os.storage
+    if isinstance(storage, PgRunStorage) and storage.settings.message_log and llm_os.run_id is not None:
+        page = storage.get_messages(llm_os.run_id, limit=MESSAGES_PAGE_SIZE, before_seq=before_seq)
+        if len(page) > 0 or before_seq is not None:
+            first_seq = page[0][0] if len(page) == MESSAGES_PAGE_SIZE else None
+            return [message for _, message in page], first_seq
+    # Runs stored before the message log keep their messages in memory
+    return llm_os.memory.get_chat_history(), None
+
+
+def get_shell_output_sink(renderer: ShellOutputRenderer) -> Callable[[ShellEvent], None]:
+    # Parallel tool calls run on other threads, which need the script context to write to the page
+    script_run_ctx = get_script_run_ctx()
+
+    def sink(event: ShellEvent) -> None:
+        if get_script_run_ctx(suppress_warning=True) is None:
+            add_script_run_ctx(current_thread(), script_run_ctx)
+        renderer(event)
+
+    return sink
+
+
+def get_ingested_status(session: SessionDescriptor, key: str) -> Optional[str]:
+    """Return the status of the last ingestion of a document by the session, None if it never submitted it."""
+
+    source = session.ingested.get(key)
+    if source is None:
+        return None
+    job = get_ingestion_queue().get_job(source.job_id)
+    if job is not None:
+        return "queued" if job.status == "running" else job.status
+    if source.status == "queued":
+        # The process running the job stopped before it finished
+        return "failed"
+    return source.status
+
+
+def submit_ingestion(
+    session: SessionDescriptor,
+    key: str,
+    name: str,
+    submit: Callable[[Callable[[IngestionJob], None]], IngestionJob],
+) -> None:
+    """Submit an ingestion job, its outcome is saved in the session when it finishes."""
+
+    def on_finish(job: IngestionJob) -> None:
+        source = IngestedSource(
+            name=name, job_id=job.job_id, status=job.status, error=job.error, finished_at=job.finished_at
+        )
+        current = session.ingested.get(key)
+        if current is not None and current.job_id == job.job_id:
+            session.ingested[key] = source
+        get_session_store().set_ingested(session.session_id, key, source)
+
+    job = submit(on_finish)
+    session.ingested[key] = IngestedSource(name=name, job_id=job.job_id)
+    save_session(session)
+    if job.finished_at is not None:
+        # The job finished before it was saved in the session
+        on_finish(job)
+
+
+@st.experimental_fragment(run_every=2)
+def show_ingestion_jobs() -> None:
+    session_job_ids = {source.job_id for source in st.session_state["session"].ingested.values()}
+    for job in get_ingestion_queue().get_jobs():
+        if job.job_id not in session_job_ids:
+            continue
+        if job.status == "failed":
+            st.error(f"Could not load {job.name}: {job.error}")
+        elif job.status == "done":
+            unchanged = f", {job.chunks_unchanged} unchanged" if job.chunks_unchanged > 0 else ""
+            st.success(f"Loaded {job.name}: {job.pages} pages, {job.chunks} chunks{unchanged} in {job.elapsed:.1f}s")
+        else:
+            st.progress(job.progress, text=f"Loading {job.name}: {job.chunks_written}/{job.chunks} chunks")
 
 
-def restart_assistant():
+def restart_assistant(session: SessionDescriptor):
     logger.debug("---*--- Restarting Assistant ---*---")
-    st.session_state["llm_os"] = None
-    st.session_state["llm_os_run_id"] = None
+    get_session_assistants().pop(session.assistant_key())
+    session.run_id = None
+    save_session(session)
+    st.session_state["loaded_run_id"] = None
+    st.session_state["last_trace"] = None
     if "url_scrape_key" in st.session_state:
         st.session_state["url_scrape_key"] += 1
     if "file_uploader_key" in st.session_state:
@@ -1,25 +1,33 @@
-import json
+from os import getenv
 from pathlib import Path
-from typing import Optional
 from textwrap import dedent
-from typing import List
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
 
 from phi.assistant import Assistant
+from phi.embedder import Embedder
 from phi.tools import Toolkit
-from phi.tools.exa import ExaTools
-from phi.tools.shell import ShellTools
-from phi.tools.calculator import Calculator
-from phi.tools.duckduckgo import DuckDuckGo
-from phi.tools.yfinance import YFinanceTools
-from phi.tools.file import FileTools
-from phi.llm.anthropic import Claude
 from phi.knowledge import AssistantKnowledge
-from phi.embedder.voyageai import VoyageAIEmbedder
-from phi.assistant.duckdb import DuckDbAssistant
-from phi.assistant.python import PythonAssistant
-from phi.storage.assistant.postgres import PgAssistantStorage
 from phi.utils.log import logger
-from phi.vectordb.pgvector import PgVector2
+from phi.utils.timer import Timer
+from anthropic import Anthropic as AnthropicClient
+
+from cache import TTLCache  # type: ignore
+from context import BudgetedAssistant, ContextBudget, ContextSettings  # type: ignore
+from crawler import CrawlSettings, PgCrawlState, WebsiteCrawler  # type: ignore
+from db import get_db_engine  # type: ignore
+from embeddings import PgEmbeddingCache  # type: ignore
+from ingestion import IngestionQueue  # type: ignore
+from llm import ParallelClaude  # type: ignore
+from resources import resource_pool  # type: ignore
+from sessions import PgSessionStore  # type: ignore
+from storage import PgRunStorage, StorageSettings  # type: ignore
+from tool_cache import LocalToolCacheStore, PgToolCacheStore, ToolCacheStore, ToolResultCache  # type: ignore
+from vectordb import IndexSettings, PgVectorStore, QuantizationSettings, SearchSettings  # type: ignore
+
+if TYPE_CHECKING:
+    from materialize import TableMaterializer  # type: ignore
+    from python_workers import PythonWorkerPool  # type: ignore
+    from shell_tools import ShellRunner  # type: ignore
 
 db_url = "postgresql+psycopg://ai:ai@localhost:5532/ai"
 cwd = Path(__file__).parent.resolve()
@@ -28,6 +36,376 @@ if not scratch_dir.exists():
     scratch_dir.mkdir(exist_ok=True, parents=True)
 
 
+def get_claude(
+    model: str = "claude-3-5-sonnet-20240620",
+    parallel_tool_calls: bool = False,
+    tool_call_timeout: Optional[float] = None,
+    context_budget: Optional[ContextBudget] = None,
+) -> ParallelClaude:
+    # The Claude LLM holds the tools and metrics for its assistant, so a new one is created for every assistant.
+    # The underlying Anthropic client (and its HTTP connection pool) is shared across the process.
+    return ParallelClaude(
+        model=model,
+        anthropic_client=resource_pool.get("anthropic_client", AnthropicClient),
+        parallel_tool_calls=parallel_tool_calls,
+        tool_call_timeout=tool_call_timeout,
+        context_budget=context_budget,
+    )
+
+
+def get_toolkit(name: str, factory: Callable[[], Toolkit]) -> Toolkit:
+    # Toolkits are stateless so they are shared across runs
+    return resource_pool.get(("toolkit", name), factory)
+
+
+def get_tool_cache() -> ToolResultCache:
+    # Results of the web search and finance tools are shared by all sessions, and by all processes
+    # through postgres (or a local file) unless LLM_OS_TOOL_CACHE_STORE is set to "memory"
+    def _create_tool_cache() -> ToolResultCache:
+        store_type = getenv("LLM_OS_TOOL_CACHE_STORE", "postgres")
+        store: Optional[ToolCacheStore] = None
+        if store_type == "postgres":
+            store = PgToolCacheStore(db_engine=get_db_engine(db_url))
+        elif store_type == "disk":
+            store = LocalToolCacheStore(path=scratch_dir.joinpath("tool_cache.db"))
+        return ToolResultCache(store=store)
+
+    return resource_pool.get("tool_cache", _create_tool_cache)
+
+
+def get_table_materializer() -> "TableMaterializer":
+    from materialize import TableMaterializer  # type: ignore
+
+    # Data Analyst tables are copied to Parquet files under scratch/data once, and shared by all sessions
+    return resource_pool.get("table_materializer", lambda: TableMaterializer(data_dir=scratch_dir.joinpath("data")))
+
+
+def get_shell_runner() -> "ShellRunner":
+    from shell_tools import ShellRunner, ShellSettings  # type: ignore
+
+    # Shell commands run as subprocesses of one event loop thread, which also bounds how many run at the same time
+    return resource_pool.get("shell_runner", lambda: ShellRunner(settings=ShellSettings()))
+
+
+def get_python_worker_pool() -> "PythonWorkerPool":
+    from python_workers import PythonWorkerPool, PythonWorkerSettings  # type: ignore
+
+    # Python Assistant code runs in worker processes started ahead of time with pandas imported, shared by all
+    # sessions, and packages are installed from a wheel cache under scratch/wheels
+    return resource_pool.get(
+        "python_worker_pool",
+        lambda: PythonWorkerPool(
+            base_dir=scratch_dir, wheel_dir=scratch_dir.joinpath("wheels"), settings=PythonWorkerSettings()
+        ),
+    )
+
+
+def get_storage() -> PgRunStorage:
+    return resource_pool.get(
+        ("storage", "llm_os_runs"),
+        lambda: PgRunStorage(table_name="llm_os_runs", db_engine=get_db_engine(db_url), settings=StorageSettings()),
+    )
+
+
+def get_session_store() -> PgSessionStore:
+    # App sessions are stored next to the runs, so any app process can rebuild their LLM OS
+    return resource_pool.get(
+        ("session_store", "llm_os_sessions"), lambda: PgSessionStore(db_engine=get_db_engine(db_url))
+    )
+
+
+def get_embedder() -> Embedder:
+    def _create_embedder() -> Embedder:
+        from phi.embedder.voyageai import VoyageAIEmbedder
+
+        return VoyageAIEmbedder(model="voyage-large-2", dimensions=1536)
+
+    return resource_pool.get(("embedder", "voyage-large-2", 1536), _create_embedder)
+
+
+def get_vector_db() -> PgVectorStore:
+    index_settings = IndexSettings()
+    return resource_pool.get(
+        ("vector_db", "llm_os_documents"),
+        lambda: PgVectorStore(
+            db_engine=get_db_engine(db_url),
+            collection="llm_os_documents",
+            embedder=get_embedder(),
+            # Chunks embedded before are not sent to VoyageAI again, also after the knowledge base is cleared
+            embedding_cache=PgEmbeddingCache(db_engine=get_db_engine(db_url)),
+            # Users repeat the same questions, the search results are cleared when the knowledge base changes
+            query_cache=TTLCache(maxsize=1024, ttl=24 * 60 * 60),
+            results_cache=TTLCache(maxsize=256, ttl=10 * 60),
+            index=index_settings.get_index(),
+            index_min_rows=index_settings.min_rows,
+            # Hybrid search also matches exact terms (tickers, product names, error codes) with a full-text index
+            search_settings=SearchSettings(),
+            # Half precision or binary copies of the embeddings keep the index small, the candidates found on them
+            # are re-scored against the full precision embeddings (LLM_OS_VECTOR_QUANTIZATION)
+            quantization=QuantizationSettings(),
+        ),
+    )
+
+
+def get_ingestion_queue() -> IngestionQueue:
+    # One ingestion queue (and its worker pools) is shared by all sessions
+    return resource_pool.get(
+        ("ingestion_queue", "llm_os_documents"),
+        lambda: IngestionQueue(
+            knowledge_base=AssistantKnowledge(vector_db=get_vector_db()),
+            # Re-crawls only load the pages that changed since the last crawl
+            crawler=WebsiteCrawler(settings=CrawlSettings(), crawl_state=PgCrawlState(db_engine=get_db_engine(db_url))),
+        ),
+    )
+
+
+# Toolkits and team members are created by these factories, which import what they need,
+# so only the toolkits and team members enabled in get_llm_os are imported
+
+
+def create_calculator() -> Toolkit:
+    from phi.tools.calculator import Calculator
+
+    return Calculator(
+        add=True,
+        subtract=True,
+        multiply=True,
+        divide=True,
+        exponentiate=True,
+        factorial=True,
+        is_prime=True,
+        square_root=True,
+    )
+
+
+def create_ddg_search() -> Toolkit:
+    from phi.tools.duckduckgo import DuckDuckGo
+
+    return get_tool_cache().wrap(DuckDuckGo(fixed_max_results=3))
+
+
+def create_shell_tools() -> Toolkit:
+    from shell_tools import StreamingShellTools  # type: ignore
+
+    return StreamingShellTools(runner=get_shell_runner())
+
+
+def create_file_tools() -> Toolkit:
+    from phi.tools.file import FileTools
+
+    return FileTools(base_dir=cwd)
+
+
+def create_exa() -> Toolkit:
+    from phi.tools.exa import ExaTools
+
+    return get_tool_cache().wrap(ExaTools(num_results=5, text_length_limit=1000))
+
+
+def create_yfinance() -> Toolkit:
+    from phi.tools.yfinance import YFinanceTools
+
+    return get_tool_cache().wrap(
+        YFinanceTools(stock_price=True, company_info=True, analyst_recommendations=True, company_news=True)
+    )
+
+
+def create_data_analyst(llm: ParallelClaude, debug_mode: bool) -> Assistant:
+    from phi.assistant.duckdb import DuckDbAssistant
+
+    semantic_model = {
+        "tables": [
+            {
+                "name": "movies",
+                "description": "CSV of my favorite movies.",
+                "path": "https://phidata-public.s3.amazonaws.com/demo_data/IMDB-Movie-Data.csv",
+            }
+        ]
+    }
+    # Tables with a local copy are views over Parquet files, the others are read from their source
+    # until they are copied in the background
+    table_materializer = get_table_materializer()
+    data_analyst_connection = table_materializer.connect(semantic_model)
+    return DuckDbAssistant(
+        llm=llm,
+        name="Data Analyst",
+        role="Analyze movie data and provide insights",
+        semantic_model=table_materializer.localize_semantic_model(semantic_model, data_analyst_connection),
+        connection=data_analyst_connection,
+        base_dir=scratch_dir,
+    )
+
+
+def create_python_assistant(llm: ParallelClaude, debug_mode: bool) -> Assistant:
+    from phi.assistant.python import PythonAssistant
+    from python_workers import PooledPythonTools  # type: ignore
+
+    return PythonAssistant(
+        llm=llm,
+        name="Python Assistant",
+        role="Write and run python code",
+        pip_install=True,
+        # The code runs in a worker process, where streamlit elements are not shown in the app
+        charting_libraries=["matplotlib"],
+        base_dir=scratch_dir,
+        # Runs the code in a worker of the pool, which keeps the variables of the session between tasks
+        tools=[PooledPythonTools(pool=get_python_worker_pool(), pip_install=True)],
+        extra_instructions=[
+            "The code runs in a separate process: print the results you need or return them with "
+            "`variable_to_return`, and save charts to image files in the working directory.",
+            "Variables, functions and imports from your previous code are kept, you can reuse them.",
+        ],
+    )
+
+
+def create_research_assistant(llm: ParallelClaude, debug_mode: bool) -> Assistant:
+    return Assistant(
+        llm=llm,
+        name="Research Assistant",
+        role="Write a research report on a given topic",
+        description="You are a Senior New York Times researcher tasked with writing a cover story research report.",
+        instructions=[
+            "For a given topic, use the `search_exa` to get the top 10 search results.",
+            "Carefully read the results and generate a final - NYT cover story worthy report in the <report_format> provided below.",
+            "Make your report engaging, informative, and well-structured.",
+            "Remember: you are writing for the New York Times, so the quality of the report is important.",
+        ],
+        expected_output=dedent(
+            """\
+        An engaging, informative, and well-structured report in the following format:
+        <report_format>
+        ## Title
+
+        - **Overview** Brief introduction of the topic.
+        - **Importance** Why is this topic significant now?
+
+        ### Section 1
+        - **Detail 1**
+        - **Detail 2**
+
+        ### Section 2
+        - **Detail 1**
+        - **Detail 2**
+
+        ## Conclusion
+        - **Summary of report:** Recap of the key findings from the report.
+        - **Implications:** What these findings mean for the future.
+
+        ## References
+        - [Reference 1](Link to Source)
+        - [Reference 2](Link to Source)
+        </report_format>
+        """
+        ),
+        tools=[get_toolkit("exa", create_exa)],
+        # This setting tells the LLM to format messages in markdown
+        markdown=True,
+        add_datetime_to_instructions=True,
+        debug_mode=debug_mode,
+    )
+
+
+def create_investment_assistant(llm: ParallelClaude, debug_mode: bool) -> Assistant:
+    return Assistant(
+        llm=llm,
+        name="Investment Assistant",
+        role="Write a investment report on a given company (stock) symbol",
+        description="You are a Senior Investment Analyst for Goldman Sachs tasked with writing an investment report for a very important client.",
+        instructions=[
+            "For a given stock symbol, get the stock price, company information, analyst recommendations, and company news",
+            "Carefully read the research and generate a final - Goldman Sachs worthy investment report in the <report_format> provided below.",
+            "Provide thoughtful insights and recommendations based on the research.",
+            "When you share numbers, make sure to include the units (e.g., millions/billions) and currency.",
+            "REMEMBER: This report is for a very important client, so the quality of the report is important.",
+        ],
+        expected_output=dedent(
+            """\
+        <report_format>
+        ## [Company Name]: Investment Report
+
+        ### **Overview**
+        {give a brief introduction of the company and why the user should read this report}
+        {make this section engaging and create a hook for the reader}
+
+        ### Core Metrics
+        {provide a summary of core metrics and show the latest data}
+        - Current price: {current price}
+        - 52-week high: {52-week high}
+        - 52-week low: {52-week low}
+        - Market Cap: {Market Cap} in billions
+        - P/E Ratio: {P/E Ratio}
+        - Earnings per Share: {EPS}
+        - 50-day average: {50-day average}
+        - 200-day average: {200-day average}
+        - Analyst Recommendations: {buy, hold, sell} (number of analysts)
+
+        ### Financial Performance
+        {analyze the company's financial performance}
+
+        ### Growth Prospects
+        {analyze the company's growth prospects and future potential}
+
+        ### News and Updates
+        {summarize relevant news that can impact the stock price}
+
+        ### [Summary]
+        {give a summary of the report and what are the key takeaways}
+
+        ### [Recommendation]
+        {provide a recommendation on the stock along with a thorough reasoning}
+
+        </report_format>
+        """
+        ),
+        tools=[get_toolkit("yfinance", create_yfinance)],
+        # This setting tells the LLM to format messages in markdown
+        markdown=True,
+        add_datetime_to_instructions=True,
+        debug_mode=debug_mode,
+    )
+
+
+# get_llm_os flag -> toolkit factory, in the order the tools are added
+toolkit_registry: Dict[str, Callable[[], Toolkit]] = {
+    "calculator": create_calculator,
+    "ddg_search": create_ddg_search,
+    "shell_tools": create_shell_tools,
+    "file_tools": create_file_tools,
+}
+
+# get_llm_os flag -> team member factory, in the order the team members are added
+team_registry: Dict[str, Callable[[ParallelClaude, bool], Assistant]] = {
+    "data_analyst": create_data_analyst,
+    "python_assistant": create_python_assistant,
+    "research_assistant": create_research_assistant,
+    "investment_assistant": create_investment_assistant,
+}
+
+# get_llm_os flag -> instructions added to the LLM OS when it is enabled
+extra_instructions_registry: Dict[str, List[str]] = {
+    "shell_tools": [
+        "You can use the `run_shell_command` tool to run shell commands. For example, `run_shell_command(args='ls')`.",
+        "To run several independent shell commands, use the `run_shell_commands` tool, which runs them at the same time.",
+        "Shell commands are stopped after a timeout and long outputs are truncated, so prefer commands with a short, filtered output.",
+    ],
+    "file_tools": [
+        "You can use the `read_file` tool to read a file, `save_file` to save a file, and `list_files` to list files in the working directory."
+    ],
+    "data_analyst": ["To answer questions about my favorite movies, delegate the task to the `Data Analyst`."],
+    "python_assistant": ["To write and run python code, delegate the task to the `Python Assistant`."],
+    "research_assistant": [
+        "To write a research report, delegate the task to the `Research Assistant`. "
+        "Return the report in the <report_format> to the user as is, without any additional text like 'here is the report'."
+    ],
+    "investment_assistant": [
+        "To get an investment report on a stock, delegate the task to the `Investment Assistant`. "
+        "Return the report in the <report_format> to the user without any additional text like 'here is the report'.",
+        "Answer any questions they may have using the information in the report.",
+        "Never provide investment advise without the investment report.",
+    ],
+}
+
+
 def get_llm_os(
     llm_id: str = "claude-3-5-sonnet-20240620",
     calculator: bool = False,
@@ -38,197 +416,60 @@ def get_llm_os(
     python_assistant: bool = False,
     research_assistant: bool = False,
     investment_assistant: bool = False,
+    parallel_tool_calls: bool = False,
+    tool_call_timeout: Optional[float] = None,
+    context_settings: Optional[ContextSettings] = None,
     user_id: Optional[str] = None,
     run_id: Optional[str] = None,
     debug_mode: bool = True,
 ) -> Assistant:
     logger.info(f"-*- Creating {llm_id} LLM OS -*-")
+    construction_timer = Timer()
+    construction_timer.start()
+
+    # Shared by the LLM OS and its team members, so the prompt tokens saved by the team count for the turn
+    context_budget = ContextBudget(context_settings)
 
     # Add tools available to the LLM OS
-    tools: List[Toolkit] = []
-    extra_instructions: List[str] = []
-    if calculator:
-        tools.append(
-            Calculator(
-                add=True,
-                subtract=True,
-                multiply=True,
-                divide=True,
-                exponentiate=True,
-                factorial=True,
-                is_prime=True,
-                square_root=True,
-            )
-        )
-    if ddg_search:
-        tools.append(DuckDuckGo(fixed_max_results=3))
-    if shell_tools:
-        tools.append(ShellTools())
-        extra_instructions.append(
-            "You can use the `run_shell_command` tool to run shell commands. For example, `run_shell_command(args='ls')`."
-        )
-    if file_tools:
-        tools.append(FileTools(base_dir=cwd))
-        extra_instructions.append(
-            "You can use the `read_file` tool to read a file, `save_file` to save a file, and `list_files` to list files in the working directory."
-        )
+    enabled = {
+        "calculator": calculator,
+        "ddg_search": ddg_search,
+        "shell_tools": shell_tools,
+        "file_tools": file_tools,
+        "data_analyst": data_analyst,
+        "python_assistant": python_assistant,
+        "research_assistant": research_assistant,
+        "investment_assistant": investment_assistant,
+    }
+    tools: List[Toolkit] = [get_toolkit(name, factory) for name, factory in toolkit_registry.items() if enabled[name]]
 
     # Add team members available to the LLM OS
-    team: List[Assistant] = []
-    if data_analyst:
-        _data_analyst = DuckDbAssistant(
-            llm=Claude(model="claude-3-5-sonnet-20240620"),
-            name="Data Analyst",
-            role="Analyze movie data and provide insights",
-            semantic_model=json.dumps(
-                {
-                    "tables": [
-                        {
-                            "name": "movies",
-                            "description": "CSV of my favorite movies.",
-                            "path": "https://phidata-public.s3.amazonaws.com/demo_data/IMDB-Movie-Data.csv",
-                        }
-                    ]
-                }
-            ),
-            base_dir=scratch_dir,
-        )
-        team.append(_data_analyst)
-        extra_instructions.append(
-            "To answer questions about my favorite movies, delegate the task to the `Data Analyst`."
-        )
-    if python_assistant:
-        _python_assistant = PythonAssistant(
-            llm=Claude(model="claude-3-5-sonnet-20240620"),
-            name="Python Assistant",
-            role="Write and run python code",
-            pip_install=True,
-            charting_libraries=["streamlit"],
-            base_dir=scratch_dir,
-        )
-        team.append(_python_assistant)
-        extra_instructions.append("To write and run python code, delegate the task to the `Python Assistant`.")
-    if research_assistant:
-        _research_assistant = Assistant(
-            llm=Claude(model="claude-3-5-sonnet-20240620"),
-            name="Research Assistant",
-            role="Write a research report on a given topic",
-            description="You are a Senior New York Times researcher tasked with writing a cover story research report.",
-            instructions=[
-                "For a given topic, use the `search_exa` to get the top 10 search results.",
-                "Carefully read the results and generate a final - NYT cover story worthy report in the <report_format> provided below.",
-                "Make your report engaging, informative, and well-structured.",
-                "Remember: you are writing for the New York Times, so the quality of the report is important.",
-            ],
-            expected_output=dedent(
-                """\
-            An engaging, informative, and well-structured report in the following format:
-            <report_format>
-            ## Title
-
-            - **Overview** Brief introduction of the topic.
-            - **Importance** Why is this topic significant now?
-
-            ### Section 1
-            - **Detail 1**
-            - **Detail 2**
-
-            ### Section 2
-            - **Detail 1**
-            - **Detail 2**
-
-            ## Conclusion
-            - **Summary of report:** Recap of the key findings from the report.
-            - **Implications:** What these findings mean for the future.
-
-            ## References
-            - [Reference 1](Link to Source)
-            - [Reference 2](Link to Source)
-            </report_format>
-            """
+    team: List[Assistant] = [
+        factory(
+            get_claude(
+                parallel_tool_calls=parallel_tool_calls,
+                tool_call_timeout=tool_call_timeout,
+                context_budget=context_budget,
             ),
-            tools=[ExaTools(num_results=5, text_length_limit=1000)],
-            # This setting tells the LLM to format messages in markdown
-            markdown=True,
-            add_datetime_to_instructions=True,
-            debug_mode=debug_mode,
-        )
-        team.append(_research_assistant)
-        extra_instructions.append(
-            "To write a research report, delegate the task to the `Research Assistant`. "
-            "Return the report in the <report_format> to the user as is, without any additional text like 'here is the report'."
-        )
-    if investment_assistant:
-        _investment_assistant = Assistant(
-            llm=Claude(model="claude-3-5-sonnet-20240620"),
-            name="Investment Assistant",
-            role="Write a investment report on a given company (stock) symbol",
-            description="You are a Senior Investment Analyst for Goldman Sachs tasked with writing an investment report for a very important client.",
-            instructions=[
-                "For a given stock symbol, get the stock price, company information, analyst recommendations, and company news",
-                "Carefully read the research and generate a final - Goldman Sachs worthy investment report in the <report_format> provided below.",
-                "Provide thoughtful insights and recommendations based on the research.",
-                "When you share numbers, make sure to include the units (e.g., millions/billions) and currency.",
-                "REMEMBER: This report is for a very important client, so the quality of the report is important.",
-            ],
-            expected_output=dedent(
-                """\
-            <report_format>
-            ## [Company Name]: Investment Report
-
-            ### **Overview**
-            {give a brief introduction of the company and why the user should read this report}
-            {make this section engaging and create a hook for the reader}
-
-            ### Core Metrics
-            {provide a summary of core metrics and show the latest data}
-            - Current price: {current price}
-            - 52-week high: {52-week high}
-            - 52-week low: {52-week low}
-            - Market Cap: {Market Cap} in billions
-            - P/E Ratio: {P/E Ratio}
-            - Earnings per Share: {EPS}
-            - 50-day average: {50-day average}
-            - 200-day average: {200-day average}
-            - Analyst Recommendations: {buy, hold, sell} (number of analysts)
-
-            ### Financial Performance
-            {analyze the company's financial performance}
-
-            ### Growth Prospects
-            {analyze the company's growth prospects and future potential}
-
-            ### News and Updates
-            {summarize relevant news that can impact the stock price}
-
-            ### [Summary]
-            {give a summary of the report and what are the key takeaways}
-
-            ### [Recommendation]
-            {provide a recommendation on the stock along with a thorough reasoning}
-
-            </report_format>
-            """
-            ),
-            tools=[YFinanceTools(stock_price=True, company_info=True, analyst_recommendations=True, company_news=True)],
-            # This setting tells the LLM to format messages in markdown
-            markdown=True,
-            add_datetime_to_instructions=True,
-            debug_mode=debug_mode,
-        )
-        team.append(_investment_assistant)
-        extra_instructions.extend(
-            [
-                "To get an investment report on a stock, delegate the task to the `Investment Assistant`. "
-                "Return the report in the <report_format> to the user without any additional text like 'here is the report'.",
-                "Answer any questions they may have using the information in the report.",
-                "Never provide investment advise without the investment report.",
-            ]
+            debug_mode,
         )
+        for name, factory in team_registry.items()
+        if enabled[name]
+    ]
+    extra_instructions: List[str] = [
+        instruction
+        for name, instructions in extra_instructions_registry.items()
+        if enabled[name]
+        for instruction in instructions
+    ]
 
     # Create the LLM OS Assistant
-    llm_os = Assistant(
-        llm=Claude(model="claude-3-5-sonnet-20240620"),
+    llm_os = BudgetedAssistant(
+        llm=get_claude(
+            parallel_tool_calls=parallel_tool_calls,
+            tool_call_timeout=tool_call_timeout,
+            context_budget=context_budget,
+        ),
         name="llm_os",
         run_id=run_id,
         user_id=user_id,
@@ -256,14 +497,10 @@ def get_llm_os(
         ],
         extra_instructions=extra_instructions,
         # Add long-term memory to the LLM OS backed by a PostgreSQL database
-        storage=PgAssistantStorage(table_name="llm_os_runs", db_url=db_url),
+        storage=get_storage(),
         # Add a knowledge base to the LLM OS
         knowledge_base=AssistantKnowledge(
-            vector_db=PgVector2(
-                db_url=db_url,
-                collection="llm_os_documents",
-                embedder=VoyageAIEmbedder(model="voyage-large-2", dimensions=1536),
-            ),
+            vector_db=get_vector_db(),
             # 3 references are added to the prompt when searching the knowledge base
             num_documents=3,
         ),
@@ -294,5 +531,13 @@ def get_llm_os(
         """
         ),
         debug_mode=debug_mode,
+        # Keeps the chat history and tool outputs within the token budget, and caches the stable system prompt
+        context_budget=context_budget,
+    )
+    construction_timer.stop()
+    resource_pool.record_construction(construction_timer.elapsed)
+    logger.info(
+        f"-*- Created LLM OS in {construction_timer.elapsed:.4f}s "
+        f"(resource cache hit rate: {resource_pool.hit_rate:.2%}) -*-"
     )
     return llm_os
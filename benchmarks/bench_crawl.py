@@ -0,0 +1,84 @@
+"""Measure the website crawler against a local website: a first crawl, then re-crawls after some pages changed.
+
+Serves `--pages` linked pages from a local HTTP server with `--latency` seconds per response, and crawls them
+with WebsiteCrawler (without embedding). Reports the time, the requests sent, the 304 responses and the pages
+found changed of each crawl. Pass --reader to also time phi's WebsiteReader, which fetches one page at a time
+with a 1-3s delay between pages.
+
+Usage:
+    python -m benchmarks.bench_crawl
+    python -m benchmarks.bench_crawl --pages 200 --latency 0.1 --concurrency 16 --per-host 8 --delay 0
+"""
+
+import argparse
+import json
+import random
+from time import perf_counter
+from typing import Any, Dict
+
+from phi.document.reader.website import WebsiteReader
+
+from benchmarks.stubs import StubWebsite
+from crawler import CrawlSettings, WebsiteCrawler  # type: ignore
+
+
+def crawl(crawler: WebsiteCrawler, website: StubWebsite, max_pages: int) -> Dict[str, Any]:
+    requests, not_modified = website.requests, website.not_modified
+    start = perf_counter()
+    pages = crawler.crawl(website.url, max_pages=max_pages)
+    elapsed = perf_counter() - start
+    # Stored as the ingestion queue does once the pages are written
+    crawler.crawl_state.set_many([page.state for page in pages if page.state is not None])
+    statuses: Dict[str, int] = {}
+    for page in pages:
+        statuses[page.status] = statuses.get(page.status, 0) + 1
+    return {
+        "elapsed": round(elapsed, 4),
+        "pages": len(pages),
+        "requests": website.requests - requests,
+        "not_modified_responses": website.not_modified - not_modified,
+        "statuses": statuses,
+        "pages_per_sec": round(len(pages) / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per response of the local website")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--per-host", type=int, default=4)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds between two requests to the website")
+    parser.add_argument("--changed", type=float, default=0.1, help="Share of the pages changed before the re-crawl")
+    parser.add_argument("--reader", action="store_true", help="Also time phi's WebsiteReader")
+    args = parser.parse_args()
+
+    settings = CrawlSettings(
+        concurrency=args.concurrency,
+        per_host_concurrency=args.per_host,
+        per_host_delay=args.delay,
+        max_pages=args.pages,
+        max_depth=2,
+    )
+    crawler = WebsiteCrawler(settings=settings)
+    results: Dict[str, Any] = {"pages": args.pages, "latency": args.latency, "settings": settings.model_dump()}
+    with StubWebsite(pages=args.pages, latency=args.latency) as website:
+        results["first_crawl"] = crawl(crawler, website, args.pages)
+        results["recrawl_unchanged"] = crawl(crawler, website, args.pages)
+        changed = random.Random(42).sample(range(args.pages), int(args.pages * args.changed))
+        website.change(changed)
+        results["recrawl_changed"] = {"changed_pages": len(changed), **crawl(crawler, website, args.pages)}
+
+        if args.reader:
+            start = perf_counter()
+            documents = WebsiteReader(max_links=args.pages, max_depth=2).read(website.url)
+            elapsed = perf_counter() - start
+            results["website_reader"] = {
+                "elapsed": round(elapsed, 4),
+                "pages": len({document.meta_data.get("url") for document in documents}),
+            }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Compare Data Analyst queries against the source CSV with queries against the local Parquet copy.
+
+Generates a CSV shaped like the IMDB movies table (or uses --source), optionally served from a local HTTP
+server with --serve (reading CSVs over HTTP needs the DuckDB httpfs extension), then times:
+- source: a query that reads the CSV, which is what every query did before
+- first: copying the table to Parquet plus the first query on the copy
+- warm: later queries on the copy, each from a new connection like a new session
+- refresh_check: checking an unchanged source for changes
+
+Usage:
+    python -m benchmarks.bench_duckdb
+    python -m benchmarks.bench_duckdb --rows 2000000 --queries 10 --serve
+    python -m benchmarks.bench_duckdb --source https://phidata-public.s3.amazonaws.com/demo_data/IMDB-Movie-Data.csv
+"""
+
+import argparse
+import csv
+import json
+import random
+import tempfile
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from statistics import median
+from threading import Thread
+from time import perf_counter
+from typing import Any, Dict, List
+
+import duckdb
+
+from materialize import TableMaterializer  # type: ignore
+
+query = "SELECT genre, count(*) AS movies, avg(rating) AS rating FROM movies GROUP BY genre ORDER BY rating DESC"
+genres = ["Action", "Adventure", "Comedy", "Drama", "Horror", "Romance", "Sci-Fi", "Thriller"]
+
+
+def make_csv(path: Path, rows: int) -> None:
+    rng = random.Random(42)
+    with path.open("w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["rank", "title", "genre", "year", "runtime", "rating", "votes", "revenue"])
+        for i in range(rows):
+            writer.writerow(
+                [
+                    i + 1,
+                    f"Movie {i}",
+                    rng.choice(genres),
+                    rng.randint(1990, 2024),
+                    rng.randint(80, 180),
+                    round(rng.uniform(1, 10), 1),
+                    rng.randint(10, 1000000),
+                    round(rng.uniform(0, 900), 2),
+                ]
+            )
+
+
+def serve(directory: Path) -> ThreadingHTTPServer:
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=str(directory)))
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def timed(f) -> float:
+    start = perf_counter()
+    f()
+    return perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=500000)
+    parser.add_argument("--queries", type=int, default=5)
+    parser.add_argument("--source", default=None, help="CSV path or URL, a CSV is generated if not set")
+    parser.add_argument("--serve", action="store_true", help="Serve the generated CSV over HTTP")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = Path(tmp_dir)
+        server = None
+        source = args.source
+        if source is None:
+            csv_dir = tmp_path.joinpath("csv")
+            csv_dir.mkdir()
+            make_csv(csv_dir.joinpath("movies.csv"), args.rows)
+            source = str(csv_dir.joinpath("movies.csv"))
+            if args.serve:
+                server = serve(csv_dir)
+                source = f"http://127.0.0.1:{server.server_address[1]}/movies.csv"
+
+        semantic_model = {"tables": [{"name": "movies", "description": "Movies", "path": source}]}
+        results: Dict[str, Any] = {"source": source, "queries": args.queries}
+
+        def source_query() -> None:
+            with duckdb.connect() as connection:
+                connection.execute(query.replace("FROM movies", f"FROM '{source}'")).fetchall()
+
+        source_times = [timed(source_query) for _ in range(args.queries)]
+
+        materializer = TableMaterializer(data_dir=tmp_path.joinpath("data"))
+
+        def first_query() -> None:
+            connection = materializer.connect(semantic_model, wait=True)
+            connection.execute(query).fetchall()
+            connection.close()
+
+        first_time = timed(first_query)
+        table = materializer.get_table("movies")
+
+        def warm_query() -> None:
+            connection = materializer.connect(semantic_model)
+            connection.execute(query).fetchall()
+            connection.close()
+
+        warm_times: List[float] = [timed(warm_query) for _ in range(args.queries)]
+        refresh_check = timed(lambda: materializer.refresh("movies", source))
+        materializer.pool.shutdown()
+        if server is not None:
+            server.shutdown()
+
+        results.update(
+            {
+                "rows": table.rows if table else None,
+                "source_query": {"median": round(median(source_times), 4), "first": round(source_times[0], 4)},
+                "first_query": {
+                    "elapsed": round(first_time, 4),
+                    "materialize_time": round(table.materialize_time, 4) if table else None,
+                },
+                "warm_query": {"median": round(median(warm_times), 4), "max": round(max(warm_times), 4)},
+                "refresh_check": round(refresh_check, 4),
+            }
+        )
+        results["warm_speedup"] = round(results["source_query"]["median"] / results["warm_query"]["median"], 2)
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
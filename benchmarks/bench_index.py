@@ -0,0 +1,123 @@
+"""Measure search latency and recall@k of the ANN indexes against exact search on a synthetic local corpus.
+
+Loads clustered random vectors into a pgvector collection, computes the exact top-k for each query with a
+sequential scan, then builds an HNSW and an IVFFlat index through PgVectorStore.ensure_index and sweeps the
+query-time ef_search / probes. Requires a local pgvector (see run_pgvector.sh).
+
+Usage:
+    python -m benchmarks.bench_index --db-url postgresql+psycopg://ai:ai@localhost:5532/ai
+    python -m benchmarks.bench_index --rows 100000 --dims 1536 --k 10 --db-url postgresql+psycopg://ai:ai@localhost:5532/ai
+"""
+
+import argparse
+import json
+from time import perf_counter
+from typing import Any, Dict, List
+
+import numpy as np
+from phi.document import Document
+from phi.vectordb.pgvector.index import HNSW, Ivfflat
+
+from benchmarks.stubs import StubEmbedder
+from db import get_db_engine  # type: ignore
+from vectordb import PgVectorStore  # type: ignore
+
+
+def make_vectors(rng: np.random.Generator, centers: np.ndarray, n: int, spread: float) -> np.ndarray:
+    """Return `n` unit vectors scattered around randomly chosen cluster centers."""
+    vectors = centers[rng.integers(0, len(centers), n)] + spread * rng.standard_normal((n, centers.shape[1]))
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def load_corpus(vector_db: PgVectorStore, vectors: np.ndarray, batch_size: int = 1000) -> float:
+    start = perf_counter()
+    for batch_start in range(0, len(vectors), batch_size):
+        vector_db.upsert_embedded(
+            [
+                Document(id=str(i), name="bench", content=f"chunk {i}", embedding=vectors[i].tolist())
+                for i in range(batch_start, min(batch_start + batch_size, len(vectors)))
+            ]
+        )
+    return perf_counter() - start
+
+
+def run_queries(vector_db: PgVectorStore, queries: np.ndarray, k: int, exact: bool = False) -> Dict[str, Any]:
+    latencies: List[float] = []
+    ids: List[List[str]] = []
+    for query in queries:
+        start = perf_counter()
+        documents = vector_db.search_by_embedding(query.tolist(), limit=k, exact=exact) or []
+        latencies.append(perf_counter() - start)
+        ids.append([document.id for document in documents])  # type: ignore
+    return {"ids": ids, "latencies": latencies}
+
+
+def summarize(result: Dict[str, Any], exact_ids: List[List[str]], k: int) -> Dict[str, Any]:
+    latencies = np.array(result["latencies"]) * 1000
+    recall = np.mean([len(set(ids) & set(truth)) / k for ids, truth in zip(result["ids"], exact_ids)])
+    return {
+        "recall_at_k": round(float(recall), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "mean_ms": round(float(latencies.mean()), 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dims", type=int, default=256)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--spread", type=float, default=1.5, help="Noise around the cluster centers")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3, help="Number of documents per search (num_documents)")
+    parser.add_argument("--hnsw-m", type=int, default=16)
+    parser.add_argument("--hnsw-ef-construction", type=int, default=64)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[10, 40, 100])
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 10, 20])
+    parser.add_argument("--db-url", required=True)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    centers = rng.standard_normal((args.clusters, args.dims))
+    vectors = make_vectors(rng, centers, args.rows, spread=args.spread)
+    queries = make_vectors(rng, centers, args.queries, spread=args.spread)
+
+    vector_db = PgVectorStore(
+        collection="bench_index_documents",
+        db_engine=get_db_engine(args.db_url),
+        embedder=StubEmbedder(dimensions=args.dims),
+        index=None,
+    )
+    vector_db.delete()
+    vector_db.create()
+    results: Dict[str, Any] = {"rows": args.rows, "dims": args.dims, "queries": args.queries, "k": args.k}
+    results["load_time"] = round(load_corpus(vector_db, vectors), 4)
+
+    exact = run_queries(vector_db, queries, args.k, exact=True)
+    exact_ids = exact["ids"]
+    results["exact"] = summarize(exact, exact_ids, args.k)
+
+    for name, index, sweep, param in (
+        ("hnsw", HNSW(m=args.hnsw_m, ef_construction=args.hnsw_ef_construction), args.ef_search, "ef_search"),
+        ("ivfflat", Ivfflat(), args.probes, "probes"),
+    ):
+        vector_db.index = index
+        start = perf_counter()
+        action = vector_db.ensure_index(min_rows=0)
+        index_results: Dict[str, Any] = {
+            "action": action,
+            "build_time": round(perf_counter() - start, 4),
+            "options": vector_db.get_index_options(args.rows),
+        }
+        for value in sweep:
+            setattr(index, param, value)
+            index_results[f"{param}={value}"] = summarize(run_queries(vector_db, queries, args.k), exact_ids, args.k)
+        results[name] = index_results
+
+    vector_db.delete()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Measure document ingestion throughput (pages/sec, chunks/sec) on a generated local PDF corpus.
+
+Compares the previous synchronous path (PDFReader + load_documents) against the background IngestionQueue,
+using a stub embedder with a fixed latency per request. Pass --db-url to write to a local pgvector
+(see run_pgvector.sh), otherwise documents are kept in memory. With --db-url the corpus is also
+re-uploaded unchanged, and loaded again after clearing the collection, to measure the embedding cache.
+
+Usage:
+    python -m benchmarks.bench_ingestion
+    python -m benchmarks.bench_ingestion --pdfs 4 --pages 50 --embed-latency 0.05 --db-url postgresql+psycopg://ai:ai@localhost:5532/ai
+"""
+
+import argparse
+import json
+import random
+from io import BytesIO
+from time import perf_counter
+from typing import Any, Dict, List, Optional
+
+from phi.document.reader.pdf import PDFReader
+from phi.knowledge import AssistantKnowledge
+from phi.vectordb.base import VectorDb
+
+from benchmarks.stubs import InMemoryVectorDb, StubEmbedder, make_pdf
+from ingestion import IngestionQueue  # type: ignore
+
+words = (
+    "revenue growth margin data center accelerator inference training cluster supply demand quarter guidance "
+    "analyst dividend buyback valuation market share platform software developer ecosystem export regulation"
+).split()
+
+
+def make_corpus(num_pdfs: int, pages_per_pdf: int, lines_per_page: int = 60) -> List[bytes]:
+    rng = random.Random(42)
+    corpus = []
+    for _ in range(num_pdfs):
+        pages = [
+            "\n".join(" ".join(rng.choice(words) for _ in range(12)) for _ in range(lines_per_page))
+            for _ in range(pages_per_pdf)
+        ]
+        corpus.append(make_pdf(pages))
+    return corpus
+
+
+def get_vector_db(db_url: Optional[str], embedder: StubEmbedder) -> VectorDb:
+    if db_url is None:
+        return InMemoryVectorDb(embedder=embedder)
+
+    from db import get_db_engine  # type: ignore
+    from embeddings import PgEmbeddingCache  # type: ignore
+    from vectordb import PgVectorStore  # type: ignore
+
+    embedding_cache = PgEmbeddingCache(db_engine=get_db_engine(db_url), table_name="bench_embedding_cache")
+    embedding_cache.clear()
+    vector_db = PgVectorStore(
+        collection="bench_ingestion_documents",
+        db_engine=get_db_engine(db_url),
+        embedder=embedder,
+        embedding_cache=embedding_cache,
+    )
+    vector_db.delete()
+    return vector_db
+
+
+def run_sequential(corpus: List[bytes], vector_db: VectorDb) -> Dict[str, Any]:
+    knowledge_base = AssistantKnowledge(vector_db=vector_db)
+    chunks = 0
+    start = perf_counter()
+    for i, data in enumerate(corpus):
+        pdf = BytesIO(data)
+        pdf.name = f"bench_{i}.pdf"
+        documents = PDFReader().read(pdf)
+        knowledge_base.load_documents(documents, upsert=True)
+        chunks += len(documents)
+    return {"elapsed": perf_counter() - start, "chunks": chunks}
+
+
+def run_queue(corpus: List[bytes], vector_db: VectorDb, embed_workers: int) -> Dict[str, Any]:
+    queue = IngestionQueue(knowledge_base=AssistantKnowledge(vector_db=vector_db), embed_workers=embed_workers)
+    # Start the worker processes before timing, as the app keeps them warm
+    queue.parse_pool.submit(int).result()
+    start = perf_counter()
+    jobs = [queue.submit_pdf(data, name=f"bench_{i}") for i, data in enumerate(corpus)]
+    queue.job_pool.shutdown(wait=True)
+    elapsed = perf_counter() - start
+    queue.shutdown()
+    failed = [job.error for job in jobs if job.status != "done"]
+    if failed:
+        raise RuntimeError(f"Ingestion failed: {failed}")
+    return {
+        "elapsed": elapsed,
+        "chunks": sum(job.chunks_written for job in jobs),
+        "chunks_unchanged": sum(job.chunks_unchanged for job in jobs),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdfs", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="Seconds per embedding request")
+    parser.add_argument("--embed-workers", type=int, default=4)
+    parser.add_argument("--db-url", default=None)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.pdfs, args.pages)
+    pages = args.pdfs * args.pages
+    results: Dict[str, Any] = {"pdfs": args.pdfs, "pages": pages, "embed_latency": args.embed_latency}
+    def record(name: str, result: Dict[str, Any], embedder: StubEmbedder) -> None:
+        result["embedding_requests"] = embedder.requests
+        result["pages_per_sec"] = round(pages / result["elapsed"], 2)
+        result["chunks_per_sec"] = round(result["chunks"] / result["elapsed"], 2)
+        result["elapsed"] = round(result["elapsed"], 4)
+        results[name] = result
+
+    for name, run in (
+        ("sequential", lambda vector_db: run_sequential(corpus, vector_db)),
+        ("queue", lambda vector_db: run_queue(corpus, vector_db, args.embed_workers)),
+    ):
+        embedder = StubEmbedder(latency=args.embed_latency)
+        vector_db = get_vector_db(args.db_url, embedder)
+        record(name, run(vector_db), embedder)
+
+    if args.db_url is not None:
+        # Upload the same PDFs again: every chunk is stored with the same content
+        embedder.requests = 0
+        record("queue_reupload", run_queue(corpus, vector_db, args.embed_workers), embedder)
+        # Load them after clearing the collection: every embedding is read from the cache
+        vector_db.clear()
+        embedder.requests = 0
+        record("queue_after_clear", run_queue(corpus, vector_db, args.embed_workers), embedder)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+"""Run scripted LLM OS scenarios end to end, with local stand-ins for every remote service.
+
+Claude talks to a stub Anthropic client (scripted responses and tool calls with a fixed latency), VoyageAI is
+replaced by a stub embedder and the web search, Exa and YFinance toolkits by stub toolkits. Everything else is the
+real LLM OS built by get_llm_os: run storage, knowledge base, caches and ingestion run against a local
+Postgres/pgvector (see run_pgvector.sh), in `bench_llm_os_*` tables that are dropped at the start of each run.
+
+Scenarios:
+    cold_start      Import time in a fresh interpreter, first and warm get_llm_os, first message of the process
+    first_token     Time to the first streamed chunk and to the full response of a new run
+    multi_turn      Latency of each turn of one conversation, and of loading it back from storage
+    delegation      A message delegated to the Research and Investment Assistants, with and without parallel tool calls
+    ingestion       PDFs and a website (served locally) loaded through the ingestion queue, then the website re-crawled
+    search          Knowledge base search, uncached and cached, and through the search_knowledge_base tool
+    tracing         Cost of the tracing instrumentation, off and on, and the stages of a traced delegation turn
+
+Results are printed as JSON, --output also writes them to a file to compare across versions.
+
+Usage:
+    python -m benchmarks.bench_llm_os
+    python -m benchmarks.bench_llm_os --scenarios first_token multi_turn --output results.json
+    python -m benchmarks.bench_llm_os --db-url postgresql+psycopg://ai:ai@localhost:5532/ai --first-token-latency 0.5
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from time import perf_counter, sleep
+from typing import Any, Callable, Dict, List, Optional
+
+from phi.assistant import Assistant
+
+from benchmarks.bench_ingestion import make_corpus
+from benchmarks.stubs import StubAnthropicClient, StubEmbedder, StubToolkit, StubWebsite
+from cache import TTLCache  # type: ignore
+from db import get_db_engine  # type: ignore
+from embeddings import PgEmbeddingCache  # type: ignore
+from ingestion import IngestionJob  # type: ignore
+from resources import resource_pool  # type: ignore
+from storage import PgRunStorage  # type: ignore
+from tracing import tracer  # type: ignore
+from vectordb import IndexSettings, PgVectorStore  # type: ignore
+
+repo_dir = Path(__file__).parent.parent.resolve()
+scenario_names = ["cold_start", "first_token", "multi_turn", "delegation", "ingestion", "search", "tracing"]
+
+# Functions of the toolkits replaced by stubs, by resource pool key
+stub_toolkits: Dict[str, List[str]] = {
+    "ddg_search": ["duckduckgo_search", "duckduckgo_news"],
+    "exa": ["search_exa"],
+    "yfinance": ["get_current_stock_price", "get_company_info", "get_analyst_recommendations", "get_company_news"],
+}
+
+# Keyword in a message -> tools the stub LLM calls, each assistant only calls the tools it has
+scripted_tool_calls = {
+    "knowledge base": [("search_knowledge_base", {"query": "revenue growth of the data center platform"})],
+    "report": [
+        ("delegate_task_to_research_assistant", {"task_description": "Write a research report on NVDA"}),
+        ("search_exa", {"query": "NVDA"}),
+    ],
+    "invest": [
+        ("delegate_task_to_investment_assistant", {"task_description": "Write an investment report on NVDA"}),
+        ("get_current_stock_price", {"symbol": "NVDA"}),
+        ("get_company_info", {"symbol": "NVDA"}),
+        ("get_analyst_recommendations", {"symbol": "NVDA"}),
+        ("get_company_news", {"symbol": "NVDA"}),
+    ],
+}
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0.0, "p99": 0.0}
+    values = sorted(values)
+    return {
+        "p50": round(values[int(0.5 * (len(values) - 1))], 4),
+        "p99": round(values[min(len(values) - 1, int(0.99 * len(values)))], 4),
+    }
+
+
+class Harness:
+    """Builds the LLM OS with stub services and runs the scenarios."""
+
+    def __init__(self, args: argparse.Namespace):
+        import assistant  # type: ignore
+
+        self.args = args
+        self.assistant_module = assistant
+        assistant.db_url = args.db_url
+        resource_pool.clear()
+
+        self.client = StubAnthropicClient(
+            tool_calls=scripted_tool_calls,
+            first_token_latency=args.first_token_latency,
+            token_latency=args.token_latency,
+        )
+        self.embedder = StubEmbedder(latency=args.embed_latency)
+        self.toolkits = {
+            name: StubToolkit(name=name, function_names=function_names, latency=args.tool_latency)
+            for name, function_names in stub_toolkits.items()
+        }
+
+        # get_llm_os takes the shared resources from the resource pool, so seeding it swaps in the stubs
+        db_engine = get_db_engine(args.db_url)
+        self.storage = PgRunStorage(table_name="bench_llm_os_runs", db_engine=db_engine)
+        self.embedding_cache = PgEmbeddingCache(db_engine=db_engine, table_name="bench_llm_os_embedding_cache")
+        index_settings = IndexSettings()
+        self.vector_db = PgVectorStore(
+            db_engine=db_engine,
+            collection="bench_llm_os_documents",
+            embedder=self.embedder,
+            embedding_cache=self.embedding_cache,
+            query_cache=TTLCache(maxsize=1024, ttl=24 * 60 * 60),
+            results_cache=TTLCache(maxsize=256, ttl=10 * 60),
+            index=index_settings.get_index(),
+            index_min_rows=index_settings.min_rows,
+        )
+        self.storage.delete()
+        self.vector_db.delete()
+        self.embedding_cache.clear()
+
+        resource_pool.get("anthropic_client", lambda: self.client)
+        resource_pool.get(("embedder", "voyage-large-2", 1536), lambda: self.embedder)
+        resource_pool.get(("storage", "llm_os_runs"), lambda: self.storage)
+        resource_pool.get(("vector_db", "llm_os_documents"), lambda: self.vector_db)
+        for name, toolkit in self.toolkits.items():
+            resource_pool.get(("toolkit", name), lambda toolkit=toolkit: toolkit)
+
+    def get_llm_os(self, **kwargs: Any) -> Assistant:
+        return self.assistant_module.get_llm_os(debug_mode=False, **kwargs)
+
+    def time_message(self, llm_os: Assistant, message: str) -> Dict[str, float]:
+        start = perf_counter()
+        first_chunk: Optional[float] = None
+        for _ in llm_os.run(message, stream=True):
+            if first_chunk is None:
+                first_chunk = perf_counter() - start
+        total = perf_counter() - start
+        return {"first_token": first_chunk if first_chunk is not None else total, "total": total}
+
+    ###########################################################################
+    # Scenarios
+    ###########################################################################
+
+    def cold_start(self) -> Dict[str, Any]:
+        import_times: List[float] = []
+        for _ in range(self.args.repeat):
+            output = subprocess.run(
+                [
+                    sys.executable,
+                    "-c",
+                    "from time import perf_counter; start = perf_counter(); import assistant; "
+                    "print(perf_counter() - start)",
+                ],
+                cwd=repo_dir,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            import_times.append(float(output.stdout.strip().splitlines()[-1]))
+
+        options = dict(
+            calculator=True,
+            ddg_search=True,
+            file_tools=True,
+            shell_tools=True,
+            python_assistant=True,
+            research_assistant=True,
+            investment_assistant=True,
+        )
+        start = perf_counter()
+        llm_os = self.get_llm_os(**options)
+        first_build = perf_counter() - start
+        # Creates the run storage table and the knowledge base table
+        first_message = self.time_message(llm_os, "What is Claude 3.5 Sonnet?")
+
+        warm_builds: List[float] = []
+        for _ in range(self.args.repeat):
+            start = perf_counter()
+            self.get_llm_os(**options)
+            warm_builds.append(perf_counter() - start)
+        return {
+            "import": percentiles(import_times),
+            "first_get_llm_os": round(first_build, 4),
+            "warm_get_llm_os": percentiles(warm_builds),
+            "first_message": {key: round(value, 4) for key, value in first_message.items()},
+        }
+
+    def first_token(self) -> Dict[str, Any]:
+        first_tokens: List[float] = []
+        totals: List[float] = []
+        for _ in range(self.args.repeat):
+            llm_os = self.get_llm_os(ddg_search=True)
+            timing = self.time_message(llm_os, "What is Claude 3.5 Sonnet?")
+            first_tokens.append(timing["first_token"])
+            totals.append(timing["total"])
+        return {
+            "first_token": percentiles(first_tokens),
+            # Time spent in the LLM OS before the LLM sends its first chunk
+            "overhead": percentiles([t - self.args.first_token_latency for t in first_tokens]),
+            "total": percentiles(totals),
+        }
+
+    def multi_turn(self) -> Dict[str, Any]:
+        llm_os = self.get_llm_os(calculator=True, ddg_search=True)
+        turns = [self.time_message(llm_os, f"Question {i}: what is new?")["total"] for i in range(self.args.turns)]
+
+        start = perf_counter()
+        reloaded = self.get_llm_os(calculator=True, ddg_search=True, run_id=llm_os.run_id)
+        reloaded.create_run()
+        reload_time = perf_counter() - start
+        return {
+            "turns": len(turns),
+            "turn": percentiles(turns),
+            "first_turn": round(turns[0], 4),
+            "last_turn": round(turns[-1], 4),
+            "reload_run": round(reload_time, 4),
+            "messages_reloaded": len(reloaded.memory.chat_history),
+            # Prompt tokens saved and read from the prompt cache in the last turn, and the chats summarized
+            "context": {
+                key: value for key, value in (llm_os.run_data or {}).get("context", {}).items() if key != "summary"
+            },
+        }
+
+    def delegation(self) -> Dict[str, Any]:
+        results: Dict[str, Any] = {}
+        for parallel in (False, True):
+            llm_os = self.get_llm_os(research_assistant=True, investment_assistant=True, parallel_tool_calls=parallel)
+            requests, tool_calls = self.client.requests, self.client.tool_calls_made
+            timing = self.time_message(llm_os, "Write a report on NVDA and tell me if I should invest in it")
+            results["parallel" if parallel else "sequential"] = {
+                "total": round(timing["total"], 4),
+                "llm_requests": self.client.requests - requests,
+                "tool_calls": self.client.tool_calls_made - tool_calls,
+            }
+        return results
+
+    def wait_for(self, jobs: List[IngestionJob]) -> None:
+        while any(job.status not in ("done", "failed") for job in jobs):
+            sleep(0.01)
+        failed = [job.error for job in jobs if job.status == "failed"]
+        if failed:
+            raise RuntimeError(f"Ingestion failed: {failed}")
+
+    def ingestion(self) -> Dict[str, Any]:
+        queue = self.assistant_module.get_ingestion_queue()
+        # Start the worker processes before timing, as the app keeps them warm
+        queue.parse_pool.submit(int).result()
+
+        queue.crawler.crawl_state.clear()
+
+        results: Dict[str, Any] = {}
+        with StubWebsite(pages=self.args.website_pages) as website:
+            sources: Dict[str, Callable[[], List[IngestionJob]]] = {
+                "pdf": lambda: [
+                    queue.submit_pdf(data, name=f"bench_{i}")
+                    for i, data in enumerate(make_corpus(self.args.pdfs, self.args.pages))
+                ],
+                "url": lambda: [queue.submit_url(website.url, max_pages=self.args.website_pages)],
+                # The same website crawled again, with one page changed
+                "url_recrawl": lambda: (
+                    website.change([website.pages - 1]),
+                    [queue.submit_url(website.url, max_pages=self.args.website_pages)],
+                )[1],
+            }
+            for source, submit in sources.items():
+                requests = self.embedder.requests
+                start = perf_counter()
+                jobs = submit()
+                self.wait_for(jobs)
+                elapsed = perf_counter() - start
+                pages = sum(job.pages for job in jobs)
+                chunks = sum(job.chunks_written for job in jobs)
+                results[source] = {
+                    "pages": pages,
+                    "chunks": chunks,
+                    "elapsed": round(elapsed, 4),
+                    "pages_per_sec": round(pages / elapsed, 2),
+                    "chunks_per_sec": round(chunks / elapsed, 2),
+                    "pages_unchanged": sum(job.pages_unchanged for job in jobs),
+                    "embedding_requests": self.embedder.requests - requests,
+                }
+        return results
+
+    def search(self) -> Dict[str, Any]:
+        if not self.vector_db.exists() or self.vector_db.get_count() == 0:
+            jobs = [self.assistant_module.get_ingestion_queue().submit_pdf(make_corpus(1, 20)[0], name="bench_search")]
+            self.wait_for(jobs)
+
+        queries = [f"revenue growth of the data center platform in quarter {i}" for i in range(self.args.queries)]
+        self.vector_db.results_cache.clear()  # type: ignore
+        self.vector_db.query_cache.clear()  # type: ignore
+        timings: Dict[str, List[float]] = {"uncached": [], "cached": []}
+        for name in timings:
+            for query in queries:
+                start = perf_counter()
+                self.vector_db.search(query, limit=3)
+                timings[name].append(perf_counter() - start)
+
+        llm_os = self.get_llm_os()
+        tool_timings = [
+            self.time_message(llm_os, "Search the knowledge base for the revenue growth")["total"]
+            for _ in range(self.args.repeat)
+        ]
+        return {
+            "documents": self.vector_db.get_count(),
+            "uncached": percentiles(timings["uncached"]),
+            "cached": percentiles(timings["cached"]),
+            "search_knowledge_base_message": percentiles(tool_timings),
+            "cache": self.vector_db.cache_stats(),
+        }
+
+    def tracing(self) -> Dict[str, Any]:
+        enabled = tracer.settings.enabled
+        results: Dict[str, Any] = {}
+        try:
+            # Instrumented code outside of a traced turn, or with tracing off
+            tracer.settings.enabled = False
+            iterations = 100000
+            start = perf_counter()
+            for _ in range(iterations):
+                with tracer.span("noop"):
+                    pass
+            results["span_off_ns"] = round((perf_counter() - start) / iterations * 1e9, 1)
+
+            message = "Write a report on NVDA and tell me if I should invest in it"
+            for tracing_enabled in (False, True):
+                tracer.settings.enabled = tracing_enabled
+                totals: List[float] = []
+                for _ in range(self.args.repeat):
+                    llm_os = self.get_llm_os(research_assistant=True, investment_assistant=True)
+                    with tracer.trace("turn", run_id=llm_os.run_id) as trace:
+                        totals.append(self.time_message(llm_os, message)["total"])
+                results["turn_on" if tracing_enabled else "turn_off"] = percentiles(totals)
+            if trace is not None:
+                results["stages"] = trace.summary()["stages"]
+        finally:
+            tracer.settings.enabled = enabled
+        return results
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=repo_dir, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=scenario_names, default=scenario_names)
+    parser.add_argument("--db-url", default="postgresql+psycopg://ai:ai@localhost:5532/ai")
+    parser.add_argument("--output", type=Path, default=None, help="Also write the results to this file")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions of each timed step")
+    parser.add_argument("--turns", type=int, default=10, help="Turns of the multi-turn conversation")
+    parser.add_argument("--pdfs", type=int, default=2)
+    parser.add_argument("--pages", type=int, default=20, help="Pages per PDF")
+    parser.add_argument("--website-pages", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=20, help="Knowledge base search queries")
+    parser.add_argument("--first-token-latency", type=float, default=0.2, help="Seconds before the first chunk")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="Seconds between two chunks")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="Seconds per embedding request")
+    parser.add_argument("--tool-latency", type=float, default=0.1, help="Seconds per stub tool call")
+    args = parser.parse_args()
+
+    harness = Harness(args)
+    results: Dict[str, Any] = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": get_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "settings": {k: v for k, v in vars(args).items() if k not in ("db_url", "output", "scenarios")},
+        "scenarios": {},
+    }
+    for name in args.scenarios:
+        start = perf_counter()
+        results["scenarios"][name] = getattr(harness, name)()
+        results["scenarios"][name]["scenario_time"] = round(perf_counter() - start, 4)
+    results["resource_pool"] = resource_pool.stats()
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output is not None:
+        args.output.write_text(output)
+
+
+if __name__ == "__main__":
+    main()
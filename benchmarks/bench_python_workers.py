@@ -0,0 +1,109 @@
+"""Measure the latency of the Python Assistant's code executions, in a fresh interpreter and in the worker pool.
+
+Runs a task of `--executions` steps (load a table with pandas, then aggregate it) for `--runs` runs, and reports
+the median and max latency of the first execution of a run and of its later executions for:
+- fresh_interpreter: every execution runs in a new interpreter, which imports pandas again
+- cold_pool: a pool without warm workers, the first execution of a run starts its worker
+- warm_pool: a pool with warm workers started ahead of time, the default
+With --package, also times installing a package twice through the wheel cache (the second install finds it
+already installed or cached).
+
+Usage:
+    python -m benchmarks.bench_python_workers
+    python -m benchmarks.bench_python_workers --runs 10 --executions 5 --warm-workers 2
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from statistics import median
+from time import perf_counter, sleep
+from typing import Any, Dict, List
+
+from python_workers import PythonWorkerPool, PythonWorkerSettings  # type: ignore
+
+load_code = """\
+import pandas as pd
+import numpy as np
+df = pd.DataFrame({"group": np.arange(100_000) % 10, "value": np.random.default_rng(0).random(100_000)})
+"""
+step_code = """\
+summary = df.groupby("group")["value"].agg(["mean", "max"]).round(4)
+"""
+
+
+def summarize(latencies: List[float]) -> Dict[str, Any]:
+    if not latencies:
+        return {}
+    return {"median_ms": round(median(latencies) * 1000, 3), "max_ms": round(max(latencies) * 1000, 3)}
+
+
+def run_fresh_interpreter(args: argparse.Namespace, work_dir: Path) -> Dict[str, Any]:
+    first: List[float] = []
+    later: List[float] = []
+    for _ in range(args.runs):
+        for i in range(args.executions):
+            # Without a persistent namespace, every step runs the code it depends on again
+            code = load_code + step_code * i
+            start = perf_counter()
+            subprocess.run([sys.executable, "-c", code], cwd=work_dir, check=True)
+            (first if i == 0 else later).append(perf_counter() - start)
+    return {"first_execution": summarize(first), "later_executions": summarize(later)}
+
+
+def run_pool(args: argparse.Namespace, work_dir: Path, warm_workers: int) -> Dict[str, Any]:
+    settings = PythonWorkerSettings(warm_workers=warm_workers, max_workers=max(1, warm_workers) + 1)
+    pool = PythonWorkerPool(base_dir=work_dir, wheel_dir=work_dir.joinpath("wheels"), settings=settings)
+    # Warm workers are started when the app starts, before the first task
+    while len(pool.idle) < warm_workers:
+        sleep(0.05)
+    first: List[float] = []
+    later: List[float] = []
+    for run in range(args.runs):
+        for i in range(args.executions):
+            execution = pool.execute(f"run_{run}", load_code if i == 0 else step_code)
+            if not execution.ok:
+                raise RuntimeError(execution.error)
+            (first if execution.first else later).append(execution.latency)
+        pool.release(f"run_{run}")
+        # The time between two tasks, where the pool starts the next warm worker
+        sleep(args.think_time)
+    results = {"first_execution": summarize(first), "later_executions": summarize(later), "stats": pool.stats()}
+    pool.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--executions", type=int, default=4, help="Executions of each run")
+    parser.add_argument("--warm-workers", type=int, default=1)
+    parser.add_argument("--think-time", type=float, default=1.5, help="Seconds between two runs")
+    parser.add_argument("--package", help="Package to install twice through the wheel cache, e.g. tabulate")
+    args = parser.parse_args()
+
+    results: Dict[str, Any] = {"runs": args.runs, "executions": args.executions}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = Path(tmp_dir)
+        results["fresh_interpreter"] = run_fresh_interpreter(args, work_dir)
+        results["cold_pool"] = run_pool(args, work_dir, warm_workers=0)
+        results["warm_pool"] = run_pool(args, work_dir, warm_workers=args.warm_workers)
+        if args.package:
+            pool = PythonWorkerPool(
+                base_dir=work_dir, wheel_dir=work_dir.joinpath("wheels"), settings=PythonWorkerSettings(warm_workers=0)
+            )
+            installs = []
+            for _ in range(2):
+                start = perf_counter()
+                message = pool.install(args.package)
+                installs.append({"message": message, "elapsed": round(perf_counter() - start, 4)})
+            results["pip_install"] = installs
+            pool.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
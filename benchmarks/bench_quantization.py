@@ -0,0 +1,110 @@
+"""Compare the size, search latency and recall@k of the knowledge base with full precision, half precision and
+binary vectors.
+
+Loads clustered random unit vectors into a pgvector collection and computes the exact top-k of each query on the
+full precision embeddings. Then, for each storage mode, prepares the collection through PgVectorStore
+(ensure_quantization and ensure_index) and reports:
+- prepare_time: seconds to add the compact vectors and build the ANN index
+- index_mb: size of the ANN index, which has to stay in memory for fast searches
+- compact_mb: size of the binary vectors, scanned for candidates when pgvector can not index them (before 0.7)
+- recall_at_k, p50_ms, p95_ms: for each re-scoring factor (candidates re-scored per result)
+Half precision vectors need pgvector 0.7 or later, and are skipped on older versions. Requires a local pgvector
+(see run_pgvector.sh).
+
+Usage:
+    python -m benchmarks.bench_quantization --db-url postgresql+psycopg://ai:ai@localhost:5532/ai
+    python -m benchmarks.bench_quantization --rows 50000 --rescore-factors 4 8 16 --db-url postgresql+psycopg://ai:ai@localhost:5532/ai
+"""
+
+import argparse
+import json
+from time import perf_counter
+from typing import Any, Dict
+
+import numpy as np
+from phi.vectordb.pgvector.index import HNSW
+from sqlalchemy.sql.expression import text
+
+from benchmarks.bench_index import load_corpus, make_vectors, run_queries, summarize
+from benchmarks.stubs import StubEmbedder
+from db import get_db_engine  # type: ignore
+from vectordb import PgVectorStore, QuantizationSettings  # type: ignore
+
+
+def get_sizes(vector_db: PgVectorStore) -> Dict[str, float]:
+    with vector_db.Session() as sess, sess.begin():
+        index_bytes = sum(
+            sess.execute(text("SELECT pg_relation_size(:name)"), {"name": vector_db.get_qualified_name(name)}).scalar()
+            for name in vector_db.get_ann_indexes()
+        )
+        compact_bytes = 0
+        if vector_db.get_quantization_mode() == "binary":
+            compact_bytes = sess.execute(text(f"SELECT sum(pg_column_size(embedding_bits)) FROM {vector_db.table}"))
+            compact_bytes = compact_bytes.scalar() or 0
+        table_bytes = sess.execute(text(f"SELECT pg_table_size('{vector_db.table}')")).scalar()
+    return {
+        "index_mb": round(index_bytes / 1024**2, 3),
+        "compact_mb": round(compact_bytes / 1024**2, 3),
+        "table_mb": round(table_bytes / 1024**2, 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--dims", type=int, default=1536, help="voyage-large-2 embeddings have 1536 dimensions")
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--spread", type=float, default=1.5, help="Noise around the cluster centers")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=3, help="Number of documents per search (num_documents)")
+    parser.add_argument("--ef-search", type=int, default=40)
+    parser.add_argument("--rescore-factors", type=int, nargs="+", default=[2, 8, 32])
+    parser.add_argument("--db-url", required=True)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    centers = rng.standard_normal((args.clusters, args.dims))
+    vectors = make_vectors(rng, centers, args.rows, spread=args.spread)
+    queries = make_vectors(rng, centers, args.queries, spread=args.spread)
+
+    db_engine = get_db_engine(args.db_url)
+    collection = "bench_quantization_documents"
+    loader = PgVectorStore(collection=collection, db_engine=db_engine, embedder=StubEmbedder(dimensions=args.dims))
+    loader.delete()
+    loader.create()
+    results: Dict[str, Any] = {"rows": args.rows, "dims": args.dims, "queries": args.queries, "k": args.k}
+    results["pgvector"] = ".".join(map(str, loader.get_pgvector_version()))
+    results["load_time"] = round(load_corpus(loader, vectors), 4)
+    exact_ids = run_queries(loader, queries, args.k, exact=True)["ids"]
+
+    for mode in ("none", "halfvec", "binary"):
+        vector_db = PgVectorStore(
+            collection=collection,
+            db_engine=db_engine,
+            embedder=StubEmbedder(dimensions=args.dims),
+            index=HNSW(ef_search=args.ef_search),
+            quantization=QuantizationSettings(mode=mode),
+        )
+        start = perf_counter()
+        if vector_db.get_quantization_mode() != mode:
+            results[mode] = {"skipped": f"not supported by pgvector {results['pgvector']}"}
+            continue
+        action = vector_db.ensure_index(min_rows=0)
+        mode_results: Dict[str, Any] = {"prepare_time": round(perf_counter() - start, 4), "index": action}
+        mode_results.update(get_sizes(vector_db))
+        if mode == "none":
+            mode_results.update(summarize(run_queries(vector_db, queries, args.k), exact_ids, args.k))
+        else:
+            for factor in args.rescore_factors:
+                vector_db.quantization.rescore_factor = factor
+                mode_results[f"rescore_factor={factor}"] = summarize(
+                    run_queries(vector_db, queries, args.k), exact_ids, args.k
+                )
+        results[mode] = mode_results
+
+    loader.delete()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Compare the recall and latency of vector, hybrid and reranked hybrid knowledge base search on a local corpus.
+
+Generates a corpus of chunks, each naming one identifier (a ticker symbol, a product name or an error code) among
+words from a topic, and two kinds of queries for each sampled chunk:
+- exact: the chunk's identifier and a few generic words, like "What is the latest on ZQXT?"
+- semantic: some of the chunk's topic words, without the identifier
+
+Chunks are embedded with a bag of words over the topic vocabulary: words outside it (the identifiers) do not
+move the embedding, which is how rare terms behave with dense embedding models. Each query has one relevant
+chunk, recall@k is the share of queries that find it in the top k, MRR is the mean of 1 / its rank (up to 10).
+Requires a local pgvector (see run_pgvector.sh).
+
+Usage:
+    python -m benchmarks.bench_retrieval --db-url postgresql+psycopg://ai:ai@localhost:5532/ai
+    python -m benchmarks.bench_retrieval --chunks 20000 --queries 400 --rerankers none lexical cross_encoder \\
+        --db-url postgresql+psycopg://ai:ai@localhost:5532/ai
+"""
+
+import argparse
+import json
+import random
+import string
+from hashlib import md5
+from math import sqrt
+from time import perf_counter
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from phi.document import Document
+from phi.embedder import Embedder
+
+from db import get_db_engine  # type: ignore
+from vectordb import PgVectorStore, SearchSettings  # type: ignore
+
+vocabulary = """
+account acquisition advertising analyst annual asset audit balance bank battery billing board bond brand budget
+buyback capacity capital carbon cash chip client cloud cluster compliance component consumer contract cost credit
+customer data database debt demand deployment design device dividend driver earnings energy engine equity expense
+export factory finance forecast freight fuel fund growth guidance hardware hiring income index inflation insurance
+interest inventory investor invoice lease license liquidity loan logistics margin market memory merger mining mobile
+network order outage payment pension pipeline platform policy portfolio price pricing product profit quarter rate
+recall regulation release rental reserve retail revenue risk road satellite security semiconductor server service
+shipping software solar spending startup storage strategy subscription supplier supply tariff tax telecom tenant
+trading traffic transaction travel treasury upgrade user valuation vehicle vendor warehouse wholesale wireless yield
+""".split()
+generic_words = ["what", "is", "the", "latest", "on", "tell", "me", "about", "news", "for"]
+
+
+class VocabularyEmbedder(Embedder):
+    """Bag of words over a fixed vocabulary, hashed into `dimensions` buckets and normalized."""
+
+    model: str = "bench-vocabulary"
+    dimensions: int = 256
+    vocabulary: Set[str] = set(vocabulary)
+
+    def get_embedding(self, text: str) -> List[float]:
+        values = [0.0] * self.dimensions
+        for word in text.lower().split():
+            word = word.strip(".,?!:;")
+            if word in self.vocabulary:
+                values[int(md5(word.encode()).hexdigest(), 16) % self.dimensions] += 1.0
+        norm = sqrt(sum(v * v for v in values)) or 1.0
+        return [v / norm for v in values]
+
+    def get_embedding_and_usage(self, text: str) -> Tuple[List[float], Optional[Dict]]:
+        return self.get_embedding(text), None
+
+
+def make_identifier(rng: random.Random, kind: str) -> str:
+    if kind == "ticker":
+        return "".join(rng.choices(string.ascii_uppercase, k=4))
+    if kind == "product":
+        return "".join(rng.choices(string.ascii_lowercase, k=6)).capitalize() + f" {rng.randint(2, 99)}"
+    return f"ERR_{rng.randint(1000, 9999)}{rng.choice(string.ascii_uppercase)}"
+
+
+def make_corpus(
+    rng: random.Random, num_chunks: int, num_topics: int, num_queries: int
+) -> Tuple[List[Document], List[Dict[str, Any]]]:
+    topics = [rng.sample(vocabulary, 25) for _ in range(num_topics)]
+    chunks: List[Document] = []
+    identifiers: List[str] = []
+    for i in range(num_chunks):
+        identifier = make_identifier(rng, rng.choice(["ticker", "product", "error"]))
+        words = rng.choices(rng.choice(topics), k=30) + rng.choices(vocabulary, k=10)
+        rng.shuffle(words)
+        content = f"{identifier}: " + " ".join(words) + "."
+        chunks.append(Document(id=str(i), name="bench", content=content))
+        identifiers.append(identifier)
+
+    queries: List[Dict[str, Any]] = []
+    for i in rng.sample(range(num_chunks), num_queries):
+        if len(queries) % 2 == 0:
+            text = f"{' '.join(rng.sample(generic_words, 4))} {identifiers[i]}?"
+            kind = "exact"
+        else:
+            words = chunks[i].content.split(": ", 1)[1].rstrip(".").split()
+            text = " ".join(rng.sample(words, 8))
+            kind = "semantic"
+        queries.append({"kind": kind, "text": text, "relevant": str(i)})
+    return chunks, queries
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000, 3)
+
+
+def evaluate(vector_db: PgVectorStore, queries: List[Dict[str, Any]], k: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    by_kind: Dict[str, Dict[str, List[float]]] = {}
+    for query in queries:
+        start = perf_counter()
+        documents = vector_db.search_uncached(query["text"], limit=10) or []
+        latencies.append(perf_counter() - start)
+        ids = [document.id for document in documents]
+        rank = ids.index(query["relevant"]) + 1 if query["relevant"] in ids else None
+        scores = by_kind.setdefault(query["kind"], {"recall": [], "mrr": []})
+        scores["recall"].append(1.0 if rank is not None and rank <= k else 0.0)
+        scores["mrr"].append(1.0 / rank if rank is not None else 0.0)
+
+    result: Dict[str, Any] = {}
+    for kind, scores in sorted(by_kind.items()):
+        result[kind] = {
+            f"recall_at_{k}": round(sum(scores["recall"]) / len(scores["recall"]), 4),
+            "mrr": round(sum(scores["mrr"]) / len(scores["mrr"]), 4),
+        }
+    result["p50_ms"] = percentile(latencies, 50)
+    result["p99_ms"] = percentile(latencies, 99)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--topics", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3, help="Number of documents per search (num_documents)")
+    parser.add_argument("--candidates", type=int, default=20, help="Results taken from each list in hybrid mode")
+    parser.add_argument(
+        "--rerankers", nargs="+", default=["none", "lexical"], choices=["none", "lexical", "cross_encoder"]
+    )
+    parser.add_argument("--db-url", required=True)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    chunks, queries = make_corpus(rng, args.chunks, args.topics, args.queries)
+    embedder = VocabularyEmbedder()
+    db_engine = get_db_engine(args.db_url)
+
+    def get_vector_db(mode: str, reranker: str = "none") -> PgVectorStore:
+        return PgVectorStore(
+            collection="bench_retrieval_documents",
+            db_engine=db_engine,
+            embedder=embedder,
+            index=None,
+            search_settings=SearchSettings(mode=mode, candidates=args.candidates, reranker=reranker),
+        )
+
+    vector_db = get_vector_db("hybrid")
+    vector_db.delete()
+    vector_db.create()
+    start = perf_counter()
+    vector_db.upsert(chunks, batch_size=500)
+    results: Dict[str, Any] = {
+        "chunks": args.chunks,
+        "queries": args.queries,
+        "k": args.k,
+        "load_time": round(perf_counter() - start, 4),
+    }
+    # Warm up the connection pool and the full-text index
+    vector_db.search_uncached(queries[0]["text"])
+
+    results["vector"] = evaluate(get_vector_db("vector"), queries, args.k)
+    for reranker in args.rerankers:
+        name = "hybrid" if reranker == "none" else f"hybrid+{reranker}"
+        results[name] = evaluate(get_vector_db("hybrid", reranker), queries, args.k)
+
+    vector_db.delete()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
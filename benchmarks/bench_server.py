@@ -0,0 +1,154 @@
+"""Load test the HTTP API: concurrent clients create a run and send it messages, streamed over SSE.
+
+Runs the server in-process with a stub LLM (a fixed first token latency, then one word every few ms), so the
+numbers measure the server and not the LLM provider. Reports p50/p99 of the time to the first streamed delta and
+of the full response, requests/sec, and how many requests were rejected by admission control (503).
+Pass --db-url to build the assistants with get_llm_os and store runs in a local Postgres, otherwise assistants
+are kept in memory.
+
+Usage:
+    python -m benchmarks.bench_server
+    python -m benchmarks.bench_server --clients 64 --messages 3 --max-runs 16
+    python -m benchmarks.bench_server --db-url postgresql+psycopg://ai:ai@localhost:5532/ai
+"""
+
+import argparse
+import asyncio
+import json
+from time import perf_counter
+from typing import Any, Dict, List, Optional
+
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+
+from phi.assistant import Assistant
+
+from benchmarks.stubs import StubLLM
+from server import AssistantFactory, LLMOSServer, ServerSettings  # type: ignore
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(p / 100 * len(values)))], 4)
+
+
+def get_stub_factory(first_token_latency: float, token_latency: float) -> AssistantFactory:
+    def factory(run_id: Optional[str], user_id: Optional[str], options: Dict[str, Any]) -> Assistant:
+        llm = StubLLM(first_token_latency=first_token_latency, token_latency=token_latency)
+        return Assistant(llm=llm, run_id=run_id, user_id=user_id)
+
+    return factory
+
+
+def get_llm_os_factory(db_url: str, first_token_latency: float, token_latency: float) -> AssistantFactory:
+    import assistant  # type: ignore
+
+    assistant.db_url = db_url
+
+    def factory(run_id: Optional[str], user_id: Optional[str], options: Dict[str, Any]) -> Assistant:
+        llm_os = assistant.get_llm_os(run_id=run_id, user_id=user_id, **options)
+        llm_os.llm = StubLLM(first_token_latency=first_token_latency, token_latency=token_latency)
+        return llm_os
+
+    return factory
+
+
+async def run_client(base_url: str, client_id: int, num_messages: int, results: Dict[str, Any]) -> None:
+    http = AsyncHTTPClient()
+    try:
+        response = await http.fetch(
+            f"{base_url}/v1/runs", method="POST", body=json.dumps({"user_id": f"bench-{client_id}"})
+        )
+    except Exception:
+        results["errors"] += 1
+        return
+    run_id = json.loads(response.body)["run_id"]
+
+    for i in range(num_messages):
+        start = perf_counter()
+        first_delta: List[float] = []
+
+        def on_chunk(chunk: bytes) -> None:
+            if not first_delta and b"data: {\"delta\"" in chunk:
+                first_delta.append(perf_counter() - start)
+
+        request = HTTPRequest(
+            f"{base_url}/v1/runs/{run_id}/messages",
+            method="POST",
+            body=json.dumps({"message": f"Message {i} from client {client_id}"}),
+            streaming_callback=on_chunk,
+            request_timeout=120,
+        )
+        try:
+            await http.fetch(request)
+        except HTTPClientError as e:
+            results["rejected" if e.code == 503 else "errors"] += 1
+            continue
+        except Exception:
+            results["errors"] += 1
+            continue
+        results["total_latency"].append(perf_counter() - start)
+        if first_delta:
+            results["first_token_latency"].append(first_delta[0])
+
+
+async def run_load(args: argparse.Namespace) -> Dict[str, Any]:
+    if args.db_url:
+        from assistant import get_storage  # type: ignore
+
+        factory = get_llm_os_factory(args.db_url, args.first_token_latency, args.token_latency)
+        storage = get_storage()
+    else:
+        factory = get_stub_factory(args.first_token_latency, args.token_latency)
+        storage = None
+
+    settings = ServerSettings(max_concurrent_runs=args.max_runs, max_queued_runs=args.max_queued)
+    server = LLMOSServer(assistant_factory=factory, storage=storage, settings=settings)
+    sockets = bind_sockets(0, "127.0.0.1")
+    http_server = HTTPServer(server.make_app())
+    http_server.add_sockets(sockets)
+    base_url = f"http://127.0.0.1:{sockets[0].getsockname()[1]}"
+    AsyncHTTPClient.configure(None, max_clients=args.clients)
+
+    results: Dict[str, Any] = {"first_token_latency": [], "total_latency": [], "errors": 0, "rejected": 0}
+    start = perf_counter()
+    await asyncio.gather(*(run_client(base_url, i, args.messages, results) for i in range(args.clients)))
+    elapsed = perf_counter() - start
+    http_server.stop()
+
+    completed = len(results["total_latency"])
+    return {
+        "clients": args.clients,
+        "messages_per_client": args.messages,
+        "max_concurrent_runs": args.max_runs,
+        "completed": completed,
+        "rejected": results["rejected"],
+        "errors": results["errors"],
+        "elapsed": round(elapsed, 4),
+        "requests_per_sec": round(completed / elapsed, 2) if elapsed > 0 else 0.0,
+        "first_token_p50": percentile(results["first_token_latency"], 50),
+        "first_token_p99": percentile(results["first_token_latency"], 99),
+        "total_p50": percentile(results["total_latency"], 50),
+        "total_p99": percentile(results["total_latency"], 99),
+        "server": {k: v for k, v in server.stats().items() if k != "resource_pool"},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=32, help="Concurrent clients")
+    parser.add_argument("--messages", type=int, default=3, help="Messages sent by each client")
+    parser.add_argument("--max-runs", type=int, default=32, help="Responses generated at the same time")
+    parser.add_argument("--max-queued", type=int, default=64, help="Responses waiting for a worker")
+    parser.add_argument("--first-token-latency", type=float, default=0.2, help="Seconds before the first word")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="Seconds between two words")
+    parser.add_argument("--db-url", default=None, help="Store runs in this database")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run_load(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Compare phi's ShellTools with the streaming shell tools of the LLM OS.
+
+Runs three workloads with both toolkits and reports, for each one, the seconds until the tool returns, the seconds
+until the first output reaches the output sink (the UI) and the characters returned to the assistant:
+- chatty: a command writing `--lines` lines (like `find /` or a log dump)
+- slow: a command that writes a line, then runs for `--slow-seconds` (like a log tail), with a `--timeout` limit
+- concurrent: `--commands` commands of `--command-seconds` each, run one after the other by ShellTools and with
+  run_shell_commands by the streaming shell tools
+
+Usage:
+    python -m benchmarks.bench_shell
+    python -m benchmarks.bench_shell --lines 1000000 --timeout 2 --commands 8
+"""
+
+import argparse
+import json
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional
+
+from phi.tools.shell import ShellTools
+
+from shell_tools import ShellEvent, ShellRunner, ShellSettings, StreamingShellTools, stream_shell_output  # type: ignore
+
+
+def measure(call: Callable[[], str]) -> Dict[str, Any]:
+    start = perf_counter()
+    first_output: List[Optional[float]] = [None]
+
+    def sink(event: ShellEvent) -> None:
+        if event.kind in ("stdout", "stderr") and first_output[0] is None:
+            first_output[0] = perf_counter() - start
+
+    with stream_shell_output(sink):
+        output = call()
+    elapsed = perf_counter() - start
+    return {
+        "seconds": round(elapsed, 4),
+        # ShellTools only returns the output once the command exits
+        "first_output_seconds": round(first_output[0] if first_output[0] is not None else elapsed, 4),
+        "chars_returned": len(output),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=200000)
+    parser.add_argument("--slow-seconds", type=float, default=5.0)
+    parser.add_argument("--timeout", type=float, default=2.0, help="Seconds a command can run (LLM_OS_SHELL_TIMEOUT)")
+    parser.add_argument("--commands", type=int, default=4)
+    parser.add_argument("--command-seconds", type=float, default=0.5)
+    parser.add_argument("--tail", type=int, default=100, help="Lines of output returned to the assistant")
+    args = parser.parse_args()
+
+    chatty = ["seq", "1", str(args.lines)]
+    slow = ["bash", "-c", f"echo started; sleep {args.slow_seconds}; echo done"]
+    commands = [["sleep", str(args.command_seconds)] for _ in range(args.commands)]
+
+    shell_tools = ShellTools()
+    runner = ShellRunner(settings=ShellSettings(timeout=args.timeout, kill_grace=0.5))
+    streaming_tools = StreamingShellTools(runner=runner)
+
+    results: Dict[str, Any] = {"lines": args.lines, "timeout": args.timeout, "commands": args.commands}
+    results["chatty"] = {
+        "shell_tools": measure(lambda: shell_tools.run_shell_command(chatty, tail=args.tail)),
+        "streaming": measure(lambda: streaming_tools.run_shell_command(chatty, tail=args.tail)),
+    }
+    # ShellTools has no timeout, it waits for the command to exit
+    results["slow"] = {
+        "shell_tools": measure(lambda: shell_tools.run_shell_command(slow, tail=args.tail)),
+        "streaming": measure(lambda: streaming_tools.run_shell_command(slow, tail=args.tail)),
+    }
+    results["concurrent"] = {
+        "shell_tools": measure(lambda: "\n".join(shell_tools.run_shell_command(c, tail=args.tail) for c in commands)),
+        "streaming": measure(lambda: streaming_tools.run_shell_commands(commands, tail=args.tail)),
+    }
+    results["runner"] = runner.stats()
+    runner.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Measure the startup time and memory of the LLM OS for each toolkit and team member flag of get_llm_os.
+
+Each measurement runs in a fresh interpreter that imports the assistant module and builds the LLM OS with one
+flag enabled (plus none and all), and reports:
+- import: seconds to import the assistant module
+- get_llm_os: seconds to build the LLM OS, which imports the toolkits and team members that are enabled
+- startup: import + get_llm_os
+- rss_mb: peak resident memory of the interpreter
+- heavy_modules: slow to import dependencies that were loaded, which should only be those of the enabled flags
+
+With --max-startup or --max-rss, exits with status 1 if the median startup or the peak memory of any flag
+combination is over budget, so it can run in CI.
+
+Usage:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --repeat 5 --max-startup 3 --max-rss 400
+    python -m benchmarks.bench_startup --flags none calculator all
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from statistics import median
+from typing import Any, Dict, List
+
+repo_dir = Path(__file__).parent.parent.resolve()
+flag_names = [
+    "calculator",
+    "ddg_search",
+    "file_tools",
+    "shell_tools",
+    "data_analyst",
+    "python_assistant",
+    "research_assistant",
+    "investment_assistant",
+]
+heavy_modules = ["duckdb", "duckduckgo_search", "exa_py", "pandas", "voyageai", "yfinance"]
+
+# Runs in the fresh interpreter, prints the measurements as JSON on its last line
+measure_script = """\
+import json, resource, sys
+from time import perf_counter
+
+start = perf_counter()
+import assistant
+
+import_seconds = perf_counter() - start
+if sys.argv[2]:
+    assistant.db_url = sys.argv[2]
+start = perf_counter()
+assistant.get_llm_os(**json.loads(sys.argv[1]), debug_mode=False)
+get_llm_os_seconds = perf_counter() - start
+print(
+    json.dumps(
+        {
+            "import": import_seconds,
+            "get_llm_os": get_llm_os_seconds,
+            # Kilobytes on Linux
+            "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "heavy_modules": [name for name in json.loads(sys.argv[3]) if name in sys.modules],
+        }
+    )
+)
+"""
+
+
+def measure(flags: Dict[str, bool], db_url: str) -> Dict[str, Any]:
+    env = dict(os.environ)
+    # The Anthropic client is created when the LLM OS is built, but no request is sent
+    env.setdefault("ANTHROPIC_API_KEY", "bench")
+    output = subprocess.run(
+        [sys.executable, "-c", measure_script, json.dumps(flags), db_url, json.dumps(heavy_modules)],
+        cwd=repo_dir,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def get_combinations(names: List[str]) -> Dict[str, Dict[str, bool]]:
+    combinations: Dict[str, Dict[str, bool]] = {}
+    for name in names:
+        if name == "none":
+            combinations[name] = {}
+        elif name == "all":
+            combinations[name] = {flag: True for flag in flag_names}
+        else:
+            combinations[name] = {name: True}
+    return combinations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--flags",
+        nargs="+",
+        default=["none", *flag_names, "all"],
+        choices=["none", *flag_names, "all"],
+        help="Flag combinations to measure",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Interpreters started for each combination")
+    parser.add_argument("--max-startup", type=float, default=None, help="Budget for the median startup, in seconds")
+    parser.add_argument("--max-rss", type=float, default=None, help="Budget for the peak memory, in MB")
+    parser.add_argument("--db-url", default="", help="Database of the LLM OS, no connection is made to build it")
+    args = parser.parse_args()
+
+    results: Dict[str, Any] = {}
+    over_budget: List[str] = []
+    for name, flags in get_combinations(args.flags).items():
+        runs = [measure(flags, args.db_url) for _ in range(args.repeat)]
+        result: Dict[str, Any] = {key: round(median(run[key] for run in runs), 4) for key in ("import", "get_llm_os")}
+        result["startup"] = round(median(run["import"] + run["get_llm_os"] for run in runs), 4)
+        result["rss_mb"] = round(max(run["rss_mb"] for run in runs), 1)
+        result["heavy_modules"] = runs[-1]["heavy_modules"]
+        results[name] = result
+        if args.max_startup is not None and result["startup"] > args.max_startup:
+            over_budget.append(f"{name}: startup {result['startup']}s > {args.max_startup}s")
+        if args.max_rss is not None and result["rss_mb"] > args.max_rss:
+            over_budget.append(f"{name}: rss {result['rss_mb']}MB > {args.max_rss}MB")
+
+    print(json.dumps({"repeat": args.repeat, "results": results, "over_budget": over_budget}, indent=2))
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Compare the per-turn write cost of storing a run as one row and as an append-only message log.
+
+Plays a conversation of `--turns` turns against PgRunStorage, each turn adding a user message, tool calls and
+an answer of `--message-chars` characters to the memory of the run, and writes the run after every turn like
+the assistant does. For each mode, reports at a few points of the conversation the latency of the write and the
+bytes of WAL postgres generated for it (the write amplification), then the time to read the run back and to read
+the last page of its chat history. Requires a local pgvector (see run_pgvector.sh).
+
+Usage:
+    python -m benchmarks.bench_storage --db-url postgresql+psycopg://ai:ai@localhost:5532/ai
+    python -m benchmarks.bench_storage --turns 500 --message-chars 4000 --db-url postgresql+psycopg://ai:ai@localhost:5532/ai
+"""
+
+import argparse
+import json
+import random
+import string
+from time import perf_counter
+from typing import Any, Dict, List
+
+from phi.assistant.run import AssistantRun
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.expression import text
+
+from db import get_db_engine  # type: ignore
+from storage import PgRunStorage, StorageSettings  # type: ignore
+
+
+def make_text(rng: random.Random, chars: int) -> str:
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 9))) for _ in range(chars // 6 + 1)]
+    return " ".join(words)[:chars]
+
+
+def make_turn(rng: random.Random, i: int, message_chars: int) -> Dict[str, List[Dict[str, Any]]]:
+    question = {"role": "user", "content": f"Question {i}: {make_text(rng, 200)}"}
+    answer = {"role": "assistant", "content": make_text(rng, message_chars)}
+    tool_call = {"role": "assistant", "content": "", "tool_calls": [{"id": f"call_{i}", "type": "function"}]}
+    tool_result = {"role": "tool", "content": make_text(rng, message_chars), "tool_call_id": f"call_{i}"}
+    return {
+        "chat_history": [question, answer],
+        "llm_messages": [question, tool_call, tool_result, answer],
+    }
+
+
+def get_wal_lsn(db_engine: Engine) -> int:
+    with db_engine.connect() as connection:
+        lsn = connection.execute(text("select pg_current_wal_insert_lsn() - '0/0'::pg_lsn")).scalar()
+    return int(lsn)  # type: ignore
+
+
+def play(storage: PgRunStorage, args: argparse.Namespace, checkpoints: List[int]) -> Dict[str, Any]:
+    rng = random.Random(42)
+    memory: Dict[str, List[Dict[str, Any]]] = {"chat_history": [], "llm_messages": []}
+    results: Dict[str, Any] = {}
+    for i in range(1, args.turns + 1):
+        for field, messages in make_turn(rng, i, args.message_chars).items():
+            memory[field].extend(messages)
+        row = AssistantRun(run_id="bench", user_id="bench", memory={k: list(v) for k, v in memory.items()})
+        wal_start = get_wal_lsn(storage.db_engine)
+        start = perf_counter()
+        storage.upsert(row)
+        write_time = perf_counter() - start
+        if i in checkpoints:
+            results[f"turn_{i}"] = {
+                "write_ms": round(write_time * 1000, 3),
+                "wal_bytes": get_wal_lsn(storage.db_engine) - wal_start,
+            }
+
+    start = perf_counter()
+    storage.read("bench")
+    results["read_run_ms"] = round((perf_counter() - start) * 1000, 3)
+    if storage.settings.message_log:
+        start = perf_counter()
+        storage.get_messages("bench", limit=20)
+        results["read_last_page_ms"] = round((perf_counter() - start) * 1000, 3)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--message-chars", type=int, default=2000, help="Characters of each answer and tool output")
+    parser.add_argument("--db-url", required=True)
+    args = parser.parse_args()
+
+    checkpoints = sorted({1, 10, args.turns // 2, args.turns} - {0})
+    db_engine = get_db_engine(args.db_url)
+    results: Dict[str, Any] = {"turns": args.turns, "message_chars": args.message_chars}
+    # Writes are synchronous, so the write latency and WAL of each turn are measured
+    for mode, settings in (
+        ("row", StorageSettings(message_log=False)),
+        ("message_log", StorageSettings(message_log=True, async_writes=False)),
+    ):
+        storage = PgRunStorage(table_name="bench_storage_runs", db_engine=db_engine, settings=settings)
+        storage.delete()
+        storage.create()
+        results[mode] = play(storage, args, checkpoints)
+        storage.delete()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Replay a recorded response stream through the app's markdown rendering and report render calls and bytes sent.
+
+Usage:
+    python -m benchmarks.bench_streaming
+    python -m benchmarks.bench_streaming --stream path/to/stream.json --min-interval 0.05 --min-chars 200
+"""
+
+import argparse
+import json
+from pathlib import Path
+from typing import Any, Dict, List
+
+from streaming import MarkdownStreamRenderer  # type: ignore
+
+fixtures_dir = Path(__file__).parent.joinpath("fixtures")
+
+
+class SimulatedClock:
+    """Clock that advances by a fixed interval per delta, so the replay runs at full speed."""
+
+    def __init__(self):
+        self.now: float = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class CountingPlaceholder:
+    def __init__(self, container: "CountingContainer"):
+        self.container = container
+
+    def markdown(self, body: str) -> None:
+        self.container.render_calls += 1
+        self.container.bytes_sent += len(body.encode())
+
+
+class CountingContainer:
+    """Stands in for a streamlit container and counts what would be sent to the browser."""
+
+    def __init__(self):
+        self.render_calls: int = 0
+        self.bytes_sent: int = 0
+        self.elements: int = 0
+
+    def empty(self) -> CountingPlaceholder:
+        self.elements += 1
+        return CountingPlaceholder(self)
+
+    def markdown(self, body: str) -> None:
+        CountingPlaceholder(self).markdown(body)
+
+
+def replay_naive(deltas: List[str]) -> Dict[str, Any]:
+    # The previous app behaviour: re-render the whole response on every delta
+    container = CountingContainer()
+    response = ""
+    for delta in deltas:
+        response += delta
+        container.markdown(response)
+    return {"render_calls": container.render_calls, "bytes_sent": container.bytes_sent, "elements": 1}
+
+
+def replay_renderer(deltas: List[str], interval: float, min_interval: float, min_chars: int) -> Dict[str, Any]:
+    container = CountingContainer()
+    clock = SimulatedClock()
+    renderer = MarkdownStreamRenderer(container, min_interval=min_interval, min_chars=min_chars, clock=clock)
+    for delta in deltas:
+        clock.now += interval
+        renderer.write(delta)
+    response = renderer.close()
+    assert response == "".join(deltas), "Rendered response does not match the stream"
+    return {"render_calls": container.render_calls, "bytes_sent": container.bytes_sent, "elements": container.elements}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stream", type=Path, default=fixtures_dir.joinpath("investment_report_stream.json"))
+    parser.add_argument("--min-interval", type=float, default=0.05)
+    parser.add_argument("--min-chars", type=int, default=200)
+    args = parser.parse_args()
+
+    recorded = json.loads(args.stream.read_text())
+    deltas: List[str] = recorded["deltas"]
+    interval: float = recorded.get("interval", 0.02)
+
+    results = {
+        "stream": str(args.stream),
+        "deltas": len(deltas),
+        "response_bytes": len("".join(deltas).encode()),
+        "naive": replay_naive(deltas),
+        "renderer": replay_renderer(deltas, interval, args.min_interval, args.min_chars),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
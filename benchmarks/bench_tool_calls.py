@@ -0,0 +1,75 @@
+"""Measure the latency of one turn's tool calls, run one after another vs in parallel.
+
+Uses stub tools that sleep for a known delay (a web search, a knowledge base search and two team delegations)
+and runs them through ParallelClaude.run_function_calls, the same path Claude uses for the tool calls of a
+response. Also checks that results come back in the order the calls were made, and that a call exceeding
+--timeout is reported as timed out.
+
+Usage:
+    python -m benchmarks.bench_tool_calls
+    python -m benchmarks.bench_tool_calls --delays 0.5 1.0 0.2 1.5 --timeout 1.0
+"""
+
+import argparse
+import json
+from time import perf_counter, sleep
+from typing import Any, Dict, List, Optional
+
+from phi.tools.function import Function, FunctionCall
+
+from llm import ParallelClaude  # type: ignore
+
+tool_names = [
+    "duckduckgo_search",
+    "search_knowledge_base",
+    "delegate_task_to_research_assistant",
+    "delegate_task_to_investment_assistant",
+]
+
+
+def make_function_calls(delays: List[float]) -> List[FunctionCall]:
+    function_calls: List[FunctionCall] = []
+    for i, delay in enumerate(delays):
+
+        def stub_tool(query: str, delay: float = delay, i: int = i) -> str:
+            sleep(delay)
+            return f"result {i} for {query}"
+
+        function = Function.from_callable(stub_tool)
+        function.name = tool_names[i % len(tool_names)]
+        function_calls.append(FunctionCall(function=function, arguments={"query": f"q{i}"}, call_id=str(i)))
+    return function_calls
+
+
+def run_turn(delays: List[float], parallel: bool, timeout: Optional[float]) -> Dict[str, Any]:
+    llm = ParallelClaude(parallel_tool_calls=parallel, tool_call_timeout=timeout)
+    start = perf_counter()
+    results = llm.run_function_calls(make_function_calls(delays), role="user")
+    elapsed = perf_counter() - start
+    return {
+        "elapsed": round(elapsed, 4),
+        "in_order": [message.tool_call_id for message in results] == [str(i) for i in range(len(delays))],
+        "timed_out": sum(1 for message in results if "did not finish" in str(message.content)),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--delays", type=float, nargs="+", default=[0.4, 0.8, 0.2, 1.0], help="Seconds per tool")
+    parser.add_argument("--timeout", type=float, default=0.6, help="Tool call timeout for the timeout run")
+    args = parser.parse_args()
+
+    results: Dict[str, Any] = {
+        "delays": args.delays,
+        "expected_sequential": round(sum(args.delays), 4),
+        "expected_parallel": round(max(args.delays), 4),
+        "sequential": run_turn(args.delays, parallel=False, timeout=None),
+        "parallel": run_turn(args.delays, parallel=True, timeout=None),
+        "parallel_with_timeout": run_turn(args.delays, parallel=True, timeout=args.timeout),
+    }
+    results["speedup"] = round(results["sequential"]["elapsed"] / results["parallel"]["elapsed"], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""Deterministic local stand-ins for the remote services used by the LLM OS."""
+
+import json
+import math
+import threading
+import time
+from email.utils import formatdate
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from anthropic import Anthropic as AnthropicClient
+from phi.document import Document
+from phi.embedder import Embedder
+from phi.llm.base import LLM
+from phi.llm.message import Message
+from phi.tools import Toolkit
+from phi.vectordb.base import VectorDb
+
+
+class StubLLM(LLM):
+    """Streams a fixed response word by word, after `first_token_latency` and then `token_latency` seconds per word."""
+
+    model: str = "stub-llm"
+    name: str = "StubLLM"
+    response_text: str = (
+        "Claude 3.5 Sonnet is the first release in the Claude 3.5 model family. It raises the industry bar for "
+        "intelligence, outperforming competitor models on a wide range of evaluations, at the speed and cost "
+        "of a mid-tier model."
+    )
+    first_token_latency: float = 0.2
+    token_latency: float = 0.01
+
+    def response(self, messages: List[Message]) -> str:
+        return "".join(self.response_stream(messages))
+
+    def response_stream(self, messages: List[Message]) -> Iterator[str]:
+        time.sleep(self.first_token_latency)
+        words = self.response_text.split(" ")
+        for i, word in enumerate(words):
+            if i > 0:
+                time.sleep(self.token_latency)
+            yield word if i == len(words) - 1 else word + " "
+        messages.append(Message(role="assistant", content=self.response_text))
+
+
+class StubAnthropicClient(AnthropicClient):
+    """Stands in for the Anthropic client used by Claude, so the real Claude parsing and tool calling code runs.
+
+    `messages.stream` and `messages.create` answer with a scripted response: if the last message contains one of
+    the keywords in `tool_calls`, the response calls those tools (the ones the assistant has, in the XML format of
+    the Claude tool call prompt), otherwise it is `response_text`, streamed word by word. System prompt blocks
+    marked with `cache_control` are cached like Anthropic's prompt cache, and reported in the usage.
+
+    :param tool_calls: Keyword -> list of (tool name, arguments) called when the last message contains the keyword.
+    :param first_token_latency: Seconds before the first chunk of a response.
+    :param token_latency: Seconds between two chunks.
+    """
+
+    response_text: str = StubLLM.model_fields["response_text"].default
+
+    def __init__(
+        self,
+        tool_calls: Optional[Dict[str, List[Tuple[str, Dict[str, str]]]]] = None,
+        first_token_latency: float = 0.2,
+        token_latency: float = 0.01,
+    ):
+        super().__init__(api_key="stub")
+        self.tool_calls = tool_calls or {}
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        # Claude calls client.messages.stream and client.messages.create
+        self.messages = self  # type: ignore
+        # Number of requests and of tool calls made in responses
+        self.requests: int = 0
+        self.tool_calls_made: int = 0
+        # System prompt prefixes marked for caching
+        self.cached_prefixes: Set[str] = set()
+
+    def get_chunks(self, system: Optional[str], messages: List[Dict[str, Any]]) -> List[str]:
+        self.requests += 1
+        last_message = str(messages[-1]["content"]) if messages else ""
+        calls: List[Tuple[str, Dict[str, str]]] = []
+        if "<function_results>" not in last_message:
+            for keyword, keyword_calls in self.tool_calls.items():
+                if keyword.lower() in last_message.lower():
+                    calls.extend(c for c in keyword_calls if f"<tool_name>{c[0]}</tool_name>" in (system or ""))
+        if not calls:
+            words = self.response_text.split(" ")
+            return [word if i == len(words) - 1 else word + " " for i, word in enumerate(words)]
+
+        self.tool_calls_made += len(calls)
+        # The response stops before "</function_calls>", which Claude sends as a stop sequence
+        chunks = ["<function_calls>\n"]
+        for name, arguments in calls:
+            chunks.extend(["<invoke>\n", f"<tool_name>{name}</tool_name>\n", "<parameters>\n"])
+            chunks.extend(f"<{key}>{value}</{key}>\n" for key, value in arguments.items())
+            chunks.extend(["</parameters>\n", "</invoke>\n"])
+        return chunks
+
+    def stream(
+        self, messages: List[Dict[str, Any]], system: Union[str, List[Dict[str, Any]], None] = None, **kwargs: Any
+    ) -> "StubStream":
+        cached_chars = 0
+        if isinstance(system, list):
+            for block in system:
+                if "cache_control" in block:
+                    if block["text"] in self.cached_prefixes:
+                        cached_chars += len(block["text"])
+                    self.cached_prefixes.add(block["text"])
+            system = "".join(block["text"] for block in system)
+        input_chars = len(system or "") + sum(len(str(m["content"])) for m in messages)
+        return StubStream(
+            self.get_chunks(system, messages),
+            self.first_token_latency,
+            self.token_latency,
+            input_chars - cached_chars,
+            cached_chars,
+        )
+
+    def create(
+        self, messages: List[Dict[str, Any]], system: Union[str, List[Dict[str, Any]], None] = None, **kwargs: Any
+    ) -> Any:
+        stream = self.stream(messages, system=system)
+        text = "".join(stream.text_stream)
+        return SimpleNamespace(role="assistant", content=[SimpleNamespace(type="text", text=text)], usage=stream.usage)
+
+
+class StubStream:
+    """The context manager returned by StubAnthropicClient.messages.stream."""
+
+    def __init__(
+        self,
+        chunks: List[str],
+        first_token_latency: float,
+        token_latency: float,
+        input_chars: int = 0,
+        cached_chars: int = 0,
+    ):
+        self.chunks = chunks
+        # Token counts, estimated at 4 characters per token
+        self.usage = SimpleNamespace(
+            input_tokens=input_chars // 4,
+            output_tokens=sum(len(chunk) for chunk in chunks) // 4,
+            cache_read_input_tokens=cached_chars // 4,
+        )
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+
+    def __enter__(self) -> "StubStream":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+    @property
+    def text_stream(self) -> Iterator[str]:
+        time.sleep(self.first_token_latency)
+        for i, chunk in enumerate(self.chunks):
+            if i > 0 and self.token_latency > 0:
+                time.sleep(self.token_latency)
+            yield chunk
+
+    def get_final_message(self) -> Any:
+        return SimpleNamespace(usage=self.usage)
+
+
+class StubToolkit(Toolkit):
+    """A toolkit with the given function names, each sleeping for `latency` seconds and returning a fixed result."""
+
+    def __init__(self, name: str, function_names: List[str], latency: float = 0.0):
+        super().__init__(name=name)
+        self.latency = latency
+        self.calls: int = 0
+        for function_name in function_names:
+            self.register(self.make_function(function_name))
+
+    def make_function(self, function_name: str) -> Any:
+        def stub_function(**kwargs: str) -> str:
+            self.calls += 1
+            if self.latency > 0:
+                time.sleep(self.latency)
+            return f"{function_name} result for {json.dumps(kwargs, sort_keys=True)}"
+
+        stub_function.__name__ = function_name
+        stub_function.__doc__ = f"Stub for {function_name}."
+        return stub_function
+
+
+class StubEmbedder(Embedder):
+    """Returns a deterministic unit vector for each text after sleeping for `latency` seconds per request."""
+
+    model: str = "stub-embedder"
+    dimensions: int = 1536
+    latency: float = 0.0
+    requests: int = 0
+
+    def embed_text(self, text: str) -> List[float]:
+        seed = sha256(text.encode()).digest()
+        values = [(seed[i % len(seed)] / 255.0) - 0.5 + 0.001 * (i % 7) for i in range(self.dimensions)]
+        norm = math.sqrt(sum(v * v for v in values)) or 1.0
+        return [v / norm for v in values]
+
+    def get_embedding(self, text: str) -> List[float]:
+        return self.get_embedding_and_usage(text)[0]
+
+    def get_embedding_and_usage(self, text: str) -> Tuple[List[float], Optional[Dict]]:
+        self.requests += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return self.embed_text(text), {"total_tokens": len(text.split())}
+
+
+class InMemoryVectorDb(VectorDb):
+    """Keeps documents in a dict, used when no local Postgres is available."""
+
+    def __init__(self, embedder: Optional[Embedder] = None):
+        self.embedder: Embedder = embedder or StubEmbedder()
+        self.documents: Dict[str, Document] = {}
+
+    def create(self) -> None:
+        pass
+
+    def doc_exists(self, document: Document) -> bool:
+        return any(d.content == document.content for d in self.documents.values())
+
+    def name_exists(self, name: str) -> bool:
+        return any(d.name == name for d in self.documents.values())
+
+    def insert(self, documents: List[Document]) -> None:
+        self.upsert(documents)
+
+    def upsert_available(self) -> bool:
+        return True
+
+    def upsert(self, documents: List[Document]) -> None:
+        for document in documents:
+            if document.embedding is None:
+                document.embed(self.embedder)
+            self.documents[document.id or document.content] = document
+
+    def search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        query_embedding = self.embedder.get_embedding(query)
+
+        def score(document: Document) -> float:
+            return sum(a * b for a, b in zip(query_embedding, document.embedding or []))
+
+        return sorted(self.documents.values(), key=score, reverse=True)[:limit]
+
+    def delete(self) -> None:
+        self.documents.clear()
+
+    def exists(self) -> bool:
+        return True
+
+    def optimize(self) -> None:
+        pass
+
+    def clear(self) -> bool:
+        self.documents.clear()
+        return True
+
+
+def make_pdf(pages: List[str]) -> bytes:
+    """Build a minimal PDF with one page of Helvetica text per entry in `pages`."""
+
+    objects: List[bytes] = []
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    objects.append(
+        b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % i for i in page_ids) + b"] /Count %d >>" % len(pages)
+    )
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for page_id, text in zip(page_ids, pages):
+        lines = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in text.splitlines()]
+        stream = b"BT /F1 10 Tf 12 TL 40 800 Td " + b" ".join(b"(%s) '" % line.encode("latin-1") for line in lines)
+        stream += b" ET"
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (page_id + 1)
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + obj + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return pdf
+
+
+class StubWebsite:
+    """Linked HTML pages served from a local HTTP server, with ETags and Last-Modified headers.
+
+    Page 0 links to every page and each page links to its neighbours, so a crawl of depth 2 from page 0 finds
+    every page. Conditional requests for a page that did not change since get a 304. Use as a context manager,
+    the server runs until the block exits.
+
+    :param pages: Number of pages.
+    :param paragraphs: Paragraphs of text per page.
+    :param latency: Seconds each response is delayed by.
+    """
+
+    def __init__(self, pages: int, paragraphs: int = 50, latency: float = 0.0):
+        self.pages = pages
+        self.paragraphs = paragraphs
+        self.latency = latency
+        # Bumped by `change`, part of the content and the ETag of a page
+        self.versions: List[int] = [0] * pages
+        self.modified_at: List[float] = [time.time()] * pages
+        self.requests: int = 0
+        self.not_modified: int = 0
+        self._lock = threading.Lock()
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        assert self.server is not None
+        return f"http://127.0.0.1:{self.server.server_address[1]}/0"
+
+    def change(self, pages: List[int]) -> None:
+        for page in pages:
+            self.versions[page] += 1
+            self.modified_at[page] = time.time()
+
+    def render(self, page: int) -> bytes:
+        links = [0, page - 1, page + 1] if page > 0 else list(range(1, self.pages))
+        anchors = "".join(f'<a href="/{i}">Page {i}</a>' for i in links if 0 <= i < self.pages and i != page)
+        paragraphs = "".join(
+            f"<p>Page {page} version {self.versions[page]} paragraph {j}: "
+            "the data center platform grew revenue in the quarter.</p>"
+            for j in range(self.paragraphs)
+        )
+        return f"<html><body><nav>{anchors}</nav><article>{paragraphs}</article></body></html>".encode()
+
+    def __enter__(self) -> "StubWebsite":
+        website = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                with website._lock:
+                    website.requests += 1
+                if website.latency > 0:
+                    time.sleep(website.latency)
+                path = self.path.strip("/")
+                if not path.isdigit() or int(path) >= website.pages:
+                    self.send_error(404)
+                    return
+                page = int(path)
+                etag = f'"{page}-{website.versions[page]}"'
+                if self.headers.get("If-None-Match") == etag:
+                    with website._lock:
+                        website.not_modified += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                body = website.render(page)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", formatdate(website.modified_at[page], usegmt=True))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
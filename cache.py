@@ -0,0 +1,136 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from phi.utils.timer import Timer
+
+
+class TTLCache:
+    """Thread-safe LRU cache where entries also expire after `ttl` seconds.
+
+    Each entry remembers how long it took to compute, so a hit adds that time to `latency_saved`.
+
+    :param maxsize: Maximum number of entries, the least recently used entry is evicted first.
+    :param ttl: Seconds an entry stays valid, None to keep entries until they are evicted.
+    :param clock: Function returning the current time in seconds.
+    :param sliding: Each hit extends the entry by `ttl`, so entries expire after `ttl` seconds without use.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 256,
+        ttl: Optional[float] = 300,
+        clock: Callable[[], float] = monotonic,
+        sliding: bool = False,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.sliding = sliding
+        # key -> (value, expires_at, seconds it took to compute the value)
+        self._entries: "OrderedDict[Hashable, Tuple[Any, Optional[float], float]]" = OrderedDict()
+        self._lock = Lock()
+        # Cache counters
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.invalidations: int = 0
+        self.latency_saved: float = 0.0
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._remove_expired()
+            return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the value for `key`, or None if it is missing or expired."""
+
+        with self._lock:
+            self._remove_expired()
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at, cost = entry
+                now = self.clock()
+                if expires_at is None or expires_at > now:
+                    if self.sliding and self.ttl is not None:
+                        self._entries[key] = (value, now + self.ttl, cost)
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.latency_saved += cost
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: Any, cost: float = 0.0, ttl: Optional[float] = None) -> None:
+        """Cache `value` for `key`, `ttl` overrides the cache ttl for this entry."""
+
+        ttl = ttl if ttl is not None else self.ttl
+        with self._lock:
+            expires_at = self.clock() + ttl if ttl is not None else None
+            self._entries[key] = (value, expires_at, cost)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._remove_expired()
+
+    def _remove_expired(self) -> None:
+        # Runs on every read and write, so idle entries are dropped without waiting for the next set.
+        # Entries are in least recently used order, so the expired entries of a sliding cache come first.
+        # Entries set with a different ttl may be behind unexpired ones, they are removed when read.
+        now = self.clock()
+        while len(self._entries) > 0:
+            _, expires_at, _ = next(iter(self._entries.values()))
+            if expires_at is None or expires_at > now:
+                break
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        """Remove the entry for `key`, and return its value if it had one."""
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry[0] if entry is not None else None
+
+    def get_or_set(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """Return the cached value for `key`, computing and caching it with `factory` on a miss.
+
+        None values are returned but not cached.
+        """
+
+        value = self.get(key)
+        if value is not None:
+            return value
+        timer = Timer()
+        timer.start()
+        value = factory()
+        timer.stop()
+        if value is not None:
+            self.set(key, value, cost=timer.elapsed)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            if len(self._entries) > 0:
+                self.invalidations += 1
+            self._entries.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._remove_expired()
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hit_rate, 4),
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "latency_saved": round(self.latency_saved, 4),
+            }
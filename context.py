@@ -0,0 +1,317 @@
+import json
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from os import getenv
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field, PrivateAttr
+
+from phi.assistant import Assistant
+from phi.llm.message import Message
+from phi.utils.log import logger
+from anthropic import Anthropic as AnthropicClient
+
+from resources import resource_pool  # type: ignore
+from storage import PgRunStorage  # type: ignore
+from tracing import tracer  # type: ignore
+
+# Separates the stable part of the system prompt, which is cached by the provider, from the part that changes
+# every turn (the current time and the conversation summary). It is removed before the prompt is sent.
+system_prompt_breakpoint = "\n<!-- end of the stable system prompt -->\n"
+
+
+class ContextSettings(BaseModel):
+    """Token budget of the context sent to the LLM."""
+
+    # Tokens of chat history returned by the `get_chat_history` tool, older chats are folded into a rolling summary
+    history_tokens: int = int(getenv("LLM_OS_CONTEXT_HISTORY_TOKENS", "4000"))
+    # Number of recent chats that are never summarized
+    keep_chats: int = int(getenv("LLM_OS_CONTEXT_KEEP_CHATS", "3"))
+    # Tokens of older chats folded into the summary at once: the summary is only updated once the chats outside the
+    # recent ones reach this size, so long recent chats do not cause a summary request every turn
+    summarize_tokens: int = int(getenv("LLM_OS_CONTEXT_SUMMARIZE_TOKENS", "2000"))
+    # Tokens of a tool output sent to the LLM, longer outputs keep their start and end
+    tool_output_tokens: int = int(getenv("LLM_OS_CONTEXT_TOOL_OUTPUT_TOKENS", "2000"))
+    # Mark the stable system prompt for Anthropic prompt caching
+    prompt_caching: bool = getenv("LLM_OS_PROMPT_CACHING", "true").lower() == "true"
+    # Model writing the conversation summaries
+    summary_model: str = getenv("LLM_OS_SUMMARY_MODEL", "claude-3-haiku-20240307")
+    summary_max_tokens: int = int(getenv("LLM_OS_SUMMARY_MAX_TOKENS", "512"))
+
+
+def count_tokens(text: str) -> int:
+    """Estimate the tokens of a text, Claude averages about 4 characters per token on English text and code."""
+
+    return (len(text) + 3) // 4
+
+
+def truncate_text(text: str, max_tokens: int) -> Tuple[str, int]:
+    """Keep the start and the end of a text that is longer than `max_tokens`, returns the text and the tokens cut."""
+
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text, 0
+    # Most of the budget goes to the start, which usually has the most relevant results
+    head = max_tokens * 3
+    tail = max_tokens
+    cut = len(text) - head - tail
+    truncated = f"{text[:head]}\n[... {cut} characters truncated ...]\n{text[-tail:]}"
+    return truncated, tokens - count_tokens(truncated)
+
+
+class ContextBudget:
+    """Keeps the context of a run within its token budget, and counts the prompt tokens saved in the current turn.
+
+    Shared by an assistant and the LLMs of its team members, so the tokens saved when a team member's tool output
+    is truncated count for the turn that delegated the task.
+    """
+
+    def __init__(self, settings: Optional[ContextSettings] = None):
+        self.settings = settings or ContextSettings()
+        # Reason -> prompt tokens saved in the current turn
+        self.saved: Dict[str, int] = {}
+        # Prompt tokens read from the provider's prompt cache in the current turn
+        self.cached: int = 0
+        self._lock = Lock()
+
+    def start_turn(self) -> None:
+        with self._lock:
+            self.saved = {}
+            self.cached = 0
+
+    def record_saved(self, reason: str, tokens: int) -> None:
+        if tokens <= 0:
+            return
+        with self._lock:
+            self.saved[reason] = self.saved.get(reason, 0) + tokens
+
+    def record_usage(self, usage: Any) -> None:
+        cache_read = getattr(usage, "cache_read_input_tokens", None)
+        if cache_read:
+            with self._lock:
+                self.cached += cache_read
+
+    def truncate_tool_output(self, content: Optional[str]) -> Optional[str]:
+        if content is None:
+            return None
+        content, cut = truncate_text(content, self.settings.tool_output_tokens)
+        self.record_saved("tool_output", cut)
+        return content
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "prompt_tokens_saved": sum(self.saved.values()),
+                "saved_by": dict(self.saved),
+                "prompt_tokens_cached": self.cached,
+            }
+
+
+def get_summary_pool() -> ThreadPoolExecutor:
+    # Summaries are written off the turn, so the summary request does not add to the latency of the response
+    return resource_pool.get(
+        "summary_pool", lambda: ThreadPoolExecutor(max_workers=2, thread_name_prefix="llm-os-summary")
+    )
+
+
+def summarize_chats(
+    previous_summary: Optional[str], chats: List[Tuple[Message, Message]], settings: ContextSettings
+) -> str:
+    """Fold chats into the rolling summary of a conversation."""
+
+    conversation = ""
+    for user_message, assistant_message in chats:
+        # Long answers (like reports) are shortened, the summary only keeps what the assistant may need later
+        for message in (user_message, assistant_message):
+            content, _ = truncate_text(message.get_content_string(), settings.tool_output_tokens)
+            conversation += f"{message.role.upper()}: {content}\n"
+    prompt = ""
+    if previous_summary:
+        prompt += f"<summary>\n{previous_summary}\n</summary>\n"
+    prompt += f"<conversation>\n{conversation}</conversation>\n"
+    prompt += "Update the summary with the conversation." if previous_summary else "Summarize the conversation."
+
+    client = resource_pool.get("anthropic_client", AnthropicClient)
+    with tracer.span("summary", model=settings.summary_model, chats=len(chats)) as span:
+        response = client.messages.create(
+            model=settings.summary_model,
+            max_tokens=settings.summary_max_tokens,
+            system=(
+                "You summarize a conversation between a user and an AI assistant called LLM-OS. "
+                "Keep the facts, names, numbers, decisions and open questions the assistant may need later. "
+                "Write at most 200 words in the third person, and answer with the summary only."
+            ),
+            messages=[{"role": "user", "content": prompt}],
+        )
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            span.set(input_tokens=usage.input_tokens, output_tokens=usage.output_tokens)
+    return response.content[0].text.strip()
+
+
+class BudgetedAssistant(Assistant):
+    """Assistant that keeps its context within a token budget.
+
+    - The system prompt is split into a stable prefix, which the LLM marks for prompt caching, and a tail with the
+      current time and the summary of the earlier conversation.
+    - When the chats not yet summarized go over the history budget, the older ones are folded into a rolling
+      summary stored in the run_data, and `get_chat_history` returns the summary and the recent chats. The summary
+      is written in the background at the end of a turn and applied at the start of the next one.
+    - The tokens saved in a turn are stored in the run_data, logged and added to the trace of the turn.
+    - With a message log, the messages the assistant already holds are not read from storage again each turn.
+    """
+
+    context_budget: ContextBudget = Field(default_factory=ContextBudget)
+    # Summary being written: (chats summarized before it, chats it folds in, the summary)
+    _pending_summary: Optional[Tuple[int, int, Future]] = PrivateAttr(default=None)
+
+    @property
+    def context_data(self) -> Dict[str, Any]:
+        if self.run_data is None:
+            self.run_data = {}
+        return self.run_data.setdefault("context", {})
+
+    def get_system_prompt(self) -> Optional[str]:
+        # Called once at the start of each run
+        self.context_budget.start_turn()
+
+        # The current time changes every turn, so it is moved after the stable prefix
+        add_datetime_to_instructions = self.add_datetime_to_instructions
+        self.add_datetime_to_instructions = False
+        try:
+            system_prompt = super().get_system_prompt()
+        finally:
+            self.add_datetime_to_instructions = add_datetime_to_instructions
+        if system_prompt is None:
+            return None
+
+        tail: List[str] = []
+        if self.add_datetime_to_instructions:
+            tail.append(f"The current time is {datetime.now()}")
+        summary = self.context_data.get("summary")
+        if summary:
+            tail.append(f"<conversation_summary>\n{summary}\n</conversation_summary>")
+        if not tail:
+            return system_prompt
+        return system_prompt + system_prompt_breakpoint + "\n".join(tail)
+
+    def get_chat_history(self, num_chats: Optional[int] = None) -> str:
+        """Use this function to get the chat history between the user and assistant.
+
+        Args:
+            num_chats: The number of chats to return.
+                Each chat contains 2 messages. One from the user and one from the assistant.
+                Default: None
+
+        Returns:
+            str: A JSON of a list of dictionaries representing the chat history.
+                If earlier chats were summarized, the first dictionary holds their summary.
+
+        Example:
+            - To get the last chat, use num_chats=1.
+            - To get the last 5 chats, use num_chats=5.
+            - To get all chats, use num_chats=None.
+            - To get the first chat, use num_chats=None and pick the first message.
+        """
+        all_chats = self.memory.get_chats()
+        if len(all_chats) == 0:
+            return ""
+        requested = all_chats if num_chats is None else all_chats[-num_chats:]
+
+        # Recent chats are added until the budget is spent, the summary stands in for the older ones
+        history: List[Dict[str, Any]] = []
+        tokens = 0
+        for chat in reversed(requested):
+            chat_messages = [message.to_dict() for message in chat]
+            chat_tokens = count_tokens(json.dumps(chat_messages))
+            if history and tokens + chat_tokens > self.context_budget.settings.history_tokens:
+                break
+            history[:0] = chat_messages
+            tokens += chat_tokens
+        summary = self.context_data.get("summary")
+        if summary and len(history) < 2 * len(requested):
+            history.insert(0, {"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+
+        result = json.dumps(history)
+        full_history = json.dumps([message.to_dict() for chat in requested for message in chat])
+        self.context_budget.record_saved("chat_history", count_tokens(full_history) - count_tokens(result))
+        return result
+
+    def compact_history(self) -> None:
+        """Start folding the older chats into the rolling summary when the chats not yet summarized go over budget.
+
+        The summary is written in the background, `apply_summary` adds it to the run_data once it is done.
+        """
+
+        if self._pending_summary is not None:
+            return
+        settings = self.context_budget.settings
+        all_chats = self.memory.get_chats()
+        summarized_chats = self.context_data.get("summarized_chats", 0)
+        pending = all_chats[summarized_chats:]
+        if len(pending) <= settings.keep_chats:
+            return
+        chat_tokens = [sum(count_tokens(m.get_content_string()) for m in chat) for chat in pending]
+        if sum(chat_tokens) <= settings.history_tokens:
+            return
+        to_summarize = pending[: len(pending) - settings.keep_chats]
+        if sum(chat_tokens[: len(to_summarize)]) < settings.summarize_tokens:
+            return
+
+        future = get_summary_pool().submit(summarize_chats, self.context_data.get("summary"), to_summarize, settings)
+        self._pending_summary = (summarized_chats, len(to_summarize), future)
+
+    def apply_summary(self) -> None:
+        """Add the summary written in the background to the run_data, if it is done."""
+
+        if self._pending_summary is None:
+            return
+        summarized_chats, num_chats, future = self._pending_summary
+        if not future.done():
+            return
+        self._pending_summary = None
+        try:
+            summary = future.result()
+        except Exception as e:
+            logger.warning(f"Could not summarize the conversation: {e}")
+            return
+        if self.context_data.get("summarized_chats", 0) != summarized_chats:
+            # The run was summarized elsewhere meanwhile
+            return
+        self.context_data["summary"] = summary
+        self.context_data["summarized_chats"] = summarized_chats + num_chats
+        logger.debug(f"Summarized {num_chats} chats of run {self.run_id}")
+
+    def read_from_storage(self) -> Any:
+        # Called at the start of each run, the messages are only read if the run was written elsewhere meanwhile
+        if self.db_row is None or self.run_id is None or not isinstance(self.storage, PgRunStorage):
+            db_row = super().read_from_storage()
+            self.apply_summary()
+            return db_row
+        known_counts = {
+            "chat_history": len(self.memory.chat_history),
+            "llm_messages": len(self.memory.llm_messages),
+            "references": len(self.memory.references),
+        }
+        self.db_row = self.storage.read(run_id=self.run_id, known_counts=known_counts)
+        if self.db_row is not None:
+            self.from_database_row(row=self.db_row)
+        # After the run_data is read, so the summary of the last turn is stored with this one
+        self.apply_summary()
+        self.load_memory()
+        return self.db_row
+
+    def write_to_storage(self) -> Any:
+        # Called at the end of each run, and when a run is created or renamed. The summary is written in the
+        # background, so the run is stored without waiting for it
+        self.compact_history()
+        report = self.context_budget.report()
+        self.context_data["last_turn"] = report
+        if report["prompt_tokens_saved"] > 0 or report["prompt_tokens_cached"] > 0:
+            logger.info(
+                f"Context of run {self.run_id}: saved {report['prompt_tokens_saved']} prompt tokens "
+                f"{report['saved_by']}, read {report['prompt_tokens_cached']} from the prompt cache"
+            )
+        tracer.annotate(**report)
+        return super().write_to_storage()
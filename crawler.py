@@ -0,0 +1,421 @@
+import asyncio
+from contextlib import asynccontextmanager
+from hashlib import sha256
+from os import getenv
+from threading import Lock
+from time import monotonic
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urldefrag, urljoin, urlparse
+from urllib.robotparser import RobotFileParser
+
+import httpx
+from pydantic import BaseModel
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.schema import Column, MetaData, Table
+from sqlalchemy.sql.expression import select, text
+from sqlalchemy.types import DateTime, Integer, String
+
+from phi.utils.log import logger
+
+
+class CrawlSettings(BaseModel):
+    """Website crawler settings."""
+
+    # Pages fetched at the same time, across hosts
+    concurrency: int = int(getenv("LLM_OS_CRAWL_CONCURRENCY", "8"))
+    # Pages fetched at the same time from one host
+    per_host_concurrency: int = int(getenv("LLM_OS_CRAWL_PER_HOST", "2"))
+    # Minimum seconds between two requests to one host, a larger Crawl-delay in its robots.txt takes precedence
+    per_host_delay: float = float(getenv("LLM_OS_CRAWL_DELAY", "0.25"))
+    # Pages fetched per crawl, and depth of links followed from the first page (which has depth 1)
+    max_pages: int = int(getenv("LLM_OS_CRAWL_MAX_PAGES", "50"))
+    max_depth: int = int(getenv("LLM_OS_CRAWL_MAX_DEPTH", "2"))
+    # Seconds before a request times out
+    timeout: float = float(getenv("LLM_OS_CRAWL_TIMEOUT", "10"))
+    # Skip the pages disallowed by robots.txt
+    respect_robots: bool = getenv("LLM_OS_CRAWL_ROBOTS", "true").lower() == "true"
+    user_agent: str = getenv("LLM_OS_CRAWL_USER_AGENT", "llm-os-crawler/1.0")
+
+
+class PageState(BaseModel):
+    """What the last crawl of a page found, used to make the next crawl of the page conditional."""
+
+    url: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # Hash of the text content of the page
+    content_hash: Optional[str] = None
+    # Number of chunks the page was split into
+    chunks: int = 0
+    # Links of the page, so pages below an unchanged page are still crawled
+    links: List[str] = []
+
+
+class CrawledPage(BaseModel):
+    """A page fetched by the crawler.
+
+    `status` is one of:
+    - changed: new or modified content, in `content`
+    - not_modified: the server answered 304 to the conditional request
+    - unchanged: the server sent the page, with the same content as last time
+    - skipped: not HTML, or no main content
+    - failed: the request failed, `error` says why
+    """
+
+    url: str
+    depth: int
+    status: str
+    content: Optional[str] = None
+    error: Optional[str] = None
+    # State to store once the page is ingested, and the state of the previous crawl
+    state: Optional[PageState] = None
+    previous: Optional[PageState] = None
+
+
+###########################################################################
+# Crawl state
+###########################################################################
+
+
+class CrawlState:
+    """Base class for the crawl state, keeps the state of each crawled page in memory."""
+
+    def __init__(self):
+        self.pages: Dict[str, PageState] = {}
+        self._lock = Lock()
+
+    def get_many(self, urls: List[str]) -> Dict[str, PageState]:
+        with self._lock:
+            return {url: self.pages[url] for url in urls if url in self.pages}
+
+    def set_many(self, states: List[PageState]) -> None:
+        with self._lock:
+            self.pages.update({state.url: state for state in states})
+
+    def clear(self) -> None:
+        with self._lock:
+            self.pages = {}
+
+
+class PgCrawlState(CrawlState):
+    """Crawl state stored in a postgres table next to the knowledge base, so re-crawls survive restarts."""
+
+    def __init__(self, db_engine: Engine, table_name: str = "llm_os_crawled_pages", schema: Optional[str] = "ai"):
+        super().__init__()
+        self.table_name: str = table_name
+        self.schema: Optional[str] = schema
+        self.db_engine: Engine = db_engine
+        self.metadata: MetaData = MetaData(schema=self.schema)
+        self.Session: sessionmaker[Session] = sessionmaker(bind=self.db_engine)
+        self.table: Table = Table(
+            self.table_name,
+            self.metadata,
+            Column("url", String, primary_key=True),
+            Column("etag", String),
+            Column("last_modified", String),
+            Column("content_hash", String),
+            Column("chunks", Integer),
+            Column("links", postgresql.JSONB),
+            Column("crawled_at", DateTime(timezone=True), server_default=text("now()"), onupdate=text("now()")),
+            extend_existing=True,
+        )
+        self._created: bool = False
+
+    def create(self) -> None:
+        with self._lock:
+            if self._created:
+                return
+            if not inspect(self.db_engine).has_table(self.table_name, schema=self.schema):
+                if self.schema is not None:
+                    with self.Session() as sess, sess.begin():
+                        sess.execute(text(f"create schema if not exists {self.schema};"))
+                logger.debug(f"Creating table: {self.table_name}")
+                self.table.create(self.db_engine, checkfirst=True)
+            self._created = True
+
+    def get_many(self, urls: List[str]) -> Dict[str, PageState]:
+        if len(urls) == 0:
+            return {}
+        self.create()
+        with self.Session() as sess, sess.begin():
+            rows = sess.execute(select(self.table).where(self.table.c.url.in_(urls))).fetchall()
+        return {
+            row.url: PageState(
+                url=row.url,
+                etag=row.etag,
+                last_modified=row.last_modified,
+                content_hash=row.content_hash,
+                chunks=row.chunks or 0,
+                links=row.links or [],
+            )
+            for row in rows
+        }
+
+    def set_many(self, states: List[PageState]) -> None:
+        if len(states) == 0:
+            return
+        self.create()
+        stmt = postgresql.insert(self.table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["url"],
+            set_=dict(
+                etag=stmt.excluded.etag,
+                last_modified=stmt.excluded.last_modified,
+                content_hash=stmt.excluded.content_hash,
+                chunks=stmt.excluded.chunks,
+                links=stmt.excluded.links,
+                crawled_at=text("now()"),
+            ),
+        )
+        with self.Session() as sess, sess.begin():
+            sess.execute(stmt, [state.model_dump() for state in states])
+
+    def clear(self) -> None:
+        if inspect(self.db_engine).has_table(self.table_name, schema=self.schema):
+            with self.Session() as sess, sess.begin():
+                sess.execute(self.table.delete())
+
+
+###########################################################################
+# Crawler
+###########################################################################
+
+
+def get_primary_domain(url: str) -> str:
+    return ".".join(urlparse(url).netloc.split(".")[-2:])
+
+
+def extract_main_content(soup: Any) -> str:
+    """Return the text of the main content of a page, found the same way as the WebsiteReader."""
+
+    for tag in ["article", "main"]:
+        element = soup.find(tag)
+        if element:
+            return element.get_text(strip=True, separator=" ")
+    for class_name in ["content", "main-content", "post-content"]:
+        element = soup.find(class_=class_name)
+        if element:
+            return element.get_text(strip=True, separator=" ")
+    return ""
+
+
+def parse_page(url: str, html: bytes) -> Tuple[str, List[str]]:
+    """Return the main content of a page and the links to follow from it."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    primary_domain = get_primary_domain(url)
+    links: List[str] = []
+    for link in soup.find_all("a", href=True):
+        link_url, _ = urldefrag(urljoin(url, link["href"]))
+        parsed_url = urlparse(link_url)
+        if parsed_url.scheme not in ("http", "https") or not parsed_url.netloc.endswith(primary_domain):
+            continue
+        if any(parsed_url.path.endswith(ext) for ext in [".pdf", ".jpg", ".png"]):
+            continue
+        if link_url not in links:
+            links.append(link_url)
+    return extract_main_content(soup), links
+
+
+class HostLimiter:
+    """Bounds the requests to one host running at the same time, and spaces their starts by `delay` seconds."""
+
+    def __init__(self, concurrency: int, delay: float):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.delay = delay
+        self.next_request: float = 0.0
+        self._lock = asyncio.Lock()
+        self.robots: Optional[RobotFileParser] = None
+        # Reads robots.txt, every request to the host waits for it
+        self.robots_task: Optional["asyncio.Task[None]"] = None
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        async with self.semaphore:
+            async with self._lock:
+                wait = self.next_request - monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self.next_request = monotonic() + self.delay
+            yield
+
+
+class WebsiteCrawler:
+    """Crawls a website with a bounded pool of concurrent requests, for loading it into the knowledge base.
+
+    - At most `concurrency` pages are fetched at the same time, and at most `per_host_concurrency` from one host,
+      with requests to a host spaced by `per_host_delay` seconds (or the Crawl-delay of its robots.txt).
+    - Pages crawled before are requested with If-None-Match and If-Modified-Since. Pages the server did not
+      modify, or sent back with the same content, are reported as not changed, so they are not chunked and
+      embedded again. Their links are read from the crawl state, so the pages below them are still crawled.
+    - Each page is passed to `on_page` as soon as it is fetched. The caller stores the states of the pages it
+      ingested with `crawl_state.set_many`, so a page that failed to load is crawled again next time.
+
+    :param settings: Concurrency, politeness and limits of the crawl.
+    :param crawl_state: State of the pages crawled before, kept in memory if not given.
+    :param transport: httpx transport, for tests.
+    """
+
+    def __init__(
+        self,
+        settings: Optional[CrawlSettings] = None,
+        crawl_state: Optional[CrawlState] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.settings: CrawlSettings = settings or CrawlSettings()
+        self.crawl_state: CrawlState = crawl_state or CrawlState()
+        self.transport = transport
+
+    def crawl(
+        self,
+        url: str,
+        on_page: Optional[Callable[[CrawledPage], None]] = None,
+        max_pages: Optional[int] = None,
+        max_depth: Optional[int] = None,
+    ) -> List[CrawledPage]:
+        """Crawl a website from `url` and return the pages fetched, without their content."""
+
+        return asyncio.run(self.crawl_async(url, on_page=on_page, max_pages=max_pages, max_depth=max_depth))
+
+    async def crawl_async(
+        self,
+        url: str,
+        on_page: Optional[Callable[[CrawledPage], None]] = None,
+        max_pages: Optional[int] = None,
+        max_depth: Optional[int] = None,
+    ) -> List[CrawledPage]:
+        max_pages = max_pages or self.settings.max_pages
+        max_depth = max_depth or self.settings.max_depth
+        url, _ = urldefrag(url)
+        primary_domain = get_primary_domain(url)
+
+        queue: "asyncio.Queue[Tuple[str, int]]" = asyncio.Queue()
+        seen: Set[str] = {url}
+        queue.put_nowait((url, 1))
+        pages: List[CrawledPage] = []
+        hosts: Dict[str, HostLimiter] = {}
+
+        def enqueue(links: List[str], depth: int) -> None:
+            for link in links:
+                # Pages are counted when they are queued, so the crawl stops at max_pages
+                if len(seen) >= max_pages or depth > max_depth:
+                    return
+                if link not in seen and urlparse(link).netloc.endswith(primary_domain):
+                    seen.add(link)
+                    queue.put_nowait((link, depth))
+
+        async def worker(client: httpx.AsyncClient) -> None:
+            while True:
+                page_url, depth = await queue.get()
+                try:
+                    try:
+                        page = await self.fetch_politely(client, hosts, page_url, depth)
+                    except Exception as e:
+                        page = CrawledPage(url=page_url, depth=depth, status="failed", error=str(e))
+                    if page.status == "failed":
+                        logger.debug(f"Failed to crawl: {page_url}: {page.error}")
+                    if page.state is not None:
+                        enqueue(page.state.links, depth + 1)
+                    if on_page is not None:
+                        try:
+                            on_page(page)
+                        except Exception as e:
+                            logger.warning(f"Could not process {page_url}: {e}")
+                    page.content = None
+                    pages.append(page)
+                finally:
+                    queue.task_done()
+
+        limits = httpx.Limits(max_connections=self.settings.concurrency)
+        headers = {"User-Agent": self.settings.user_agent}
+        async with httpx.AsyncClient(
+            transport=self.transport, limits=limits, headers=headers, timeout=self.settings.timeout
+        ) as client:
+            workers = [asyncio.create_task(worker(client)) for _ in range(self.settings.concurrency)]
+            try:
+                await queue.join()
+            finally:
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+        changed = sum(page.status == "changed" for page in pages)
+        logger.info(f"Crawled {len(pages)} pages from {url}, {changed} changed")
+        return pages
+
+    async def fetch_politely(
+        self, client: httpx.AsyncClient, hosts: Dict[str, HostLimiter], url: str, depth: int
+    ) -> CrawledPage:
+        netloc = urlparse(url).netloc
+        host = hosts.get(netloc)
+        if host is None:
+            host = HostLimiter(self.settings.per_host_concurrency, self.settings.per_host_delay)
+            hosts[netloc] = host
+            if self.settings.respect_robots:
+                host.robots_task = asyncio.create_task(self.read_robots(client, host, url))
+        if host.robots_task is not None:
+            # Other workers may find pages of the host while its robots.txt is being read
+            await asyncio.shield(host.robots_task)
+        if host.robots is not None and not host.robots.can_fetch(self.settings.user_agent, url):
+            return CrawledPage(url=url, depth=depth, status="skipped", error="disallowed by robots.txt")
+        async with host.slot():
+            return await self.fetch(client, url, depth)
+
+    async def read_robots(self, client: httpx.AsyncClient, host: HostLimiter, url: str) -> None:
+        parsed_url = urlparse(url)
+        robots_url = f"{parsed_url.scheme}://{parsed_url.netloc}/robots.txt"
+        try:
+            async with host.slot():
+                response = await client.get(robots_url)
+        except httpx.HTTPError as e:
+            logger.debug(f"Could not read {robots_url}: {e}")
+            return
+        if response.status_code != 200:
+            return
+        robots = RobotFileParser(robots_url)
+        robots.parse(response.text.splitlines())
+        host.robots = robots
+        crawl_delay = robots.crawl_delay(self.settings.user_agent)
+        if crawl_delay is not None and float(crawl_delay) > host.delay:
+            host.delay = float(crawl_delay)
+
+    async def fetch(self, client: httpx.AsyncClient, url: str, depth: int) -> CrawledPage:
+        previous = (await asyncio.to_thread(self.crawl_state.get_many, [url])).get(url)
+        headers: Dict[str, str] = {}
+        if previous is not None:
+            if previous.etag:
+                headers["If-None-Match"] = previous.etag
+            if previous.last_modified:
+                headers["If-Modified-Since"] = previous.last_modified
+
+        try:
+            logger.debug(f"Crawling: {url}")
+            response = await client.get(url, headers=headers, follow_redirects=True)
+        except httpx.HTTPError as e:
+            return CrawledPage(url=url, depth=depth, status="failed", error=str(e) or type(e).__name__)
+        if response.status_code == 304 and previous is not None:
+            return CrawledPage(url=url, depth=depth, status="not_modified", state=previous, previous=previous)
+        if response.status_code != 200:
+            return CrawledPage(url=url, depth=depth, status="failed", error=f"HTTP {response.status_code}")
+        if "html" not in response.headers.get("content-type", "text/html"):
+            return CrawledPage(url=url, depth=depth, status="skipped", error="not html")
+
+        # Parsing is CPU bound, so it runs off the event loop
+        content, links = await asyncio.to_thread(parse_page, url, response.content)
+        state = PageState(
+            url=url,
+            etag=response.headers.get("etag"),
+            last_modified=response.headers.get("last-modified"),
+            content_hash=sha256(content.encode()).hexdigest(),
+            chunks=previous.chunks if previous is not None else 0,
+            links=links,
+        )
+        if not content:
+            return CrawledPage(url=url, depth=depth, status="skipped", error="no main content", state=state)
+        if previous is not None and previous.content_hash == state.content_hash:
+            return CrawledPage(url=url, depth=depth, status="unchanged", state=state, previous=previous)
+        return CrawledPage(url=url, depth=depth, status="changed", content=content, state=state, previous=previous)
@@ -0,0 +1,139 @@
+from os import getenv
+from threading import Lock, local
+from typing import Any, Dict
+
+from pydantic import BaseModel
+from sqlalchemy.engine import create_engine, Engine
+from sqlalchemy.pool import QueuePool
+
+from phi.utils.log import logger
+from phi.utils.timer import Timer
+
+from resources import resource_pool  # type: ignore
+
+
+class PoolSettings(BaseModel):
+    """Connection pool settings, shared by every store that talks to the LLM OS database.
+
+    Size the pool so that (pool_size + max_overflow) * number of worker processes stays below the
+    postgres `max_connections`.
+    """
+
+    # Number of connections kept open in the pool
+    pool_size: int = int(getenv("LLM_OS_DB_POOL_SIZE", "5"))
+    # Number of connections that can be opened above pool_size under load
+    max_overflow: int = int(getenv("LLM_OS_DB_MAX_OVERFLOW", "10"))
+    # Seconds to wait for a connection before raising an error
+    pool_timeout: float = float(getenv("LLM_OS_DB_POOL_TIMEOUT", "30"))
+    # Seconds after which a connection is recycled
+    pool_recycle: int = int(getenv("LLM_OS_DB_POOL_RECYCLE", "1800"))
+    # Test connections for liveness on checkout
+    pool_pre_ping: bool = getenv("LLM_OS_DB_POOL_PRE_PING", "true").lower() == "true"
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records the callers blocked on an exhausted pool and how long they wait, and the time spent
+    opening new connections."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = Lock()
+        # QueuePool._do_get calls itself again, only the outer call of each checkout is counted
+        self._checkout = local()
+        self.waiting: int = 0
+        self.checkouts: int = 0
+        self.waits: int = 0
+        self.wait_time: float = 0.0
+        self.max_wait_time: float = 0.0
+        self.connects: int = 0
+        self.connect_time: float = 0.0
+        self.max_connect_time: float = 0.0
+
+    def _do_get(self):
+        if getattr(self._checkout, "active", False):
+            return super()._do_get()
+        # A caller waits only when no connection is checked in and the overflow is used up
+        exhausted = self._pool.empty() and self._max_overflow > -1 and self._overflow >= self._max_overflow
+        self._checkout.active = True
+        self._checkout.connect_time = 0.0
+        if exhausted:
+            with self._stats_lock:
+                self.waiting += 1
+        wait_timer = Timer()
+        wait_timer.start()
+        try:
+            return super()._do_get()
+        finally:
+            wait_timer.stop()
+            self._checkout.active = False
+            with self._stats_lock:
+                self.checkouts += 1
+                if exhausted:
+                    wait_time = wait_timer.elapsed - self._checkout.connect_time
+                    self.waiting -= 1
+                    self.waits += 1
+                    self.wait_time += wait_time
+                    self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def _create_connection(self):
+        connect_timer = Timer()
+        connect_timer.start()
+        try:
+            return super()._create_connection()
+        finally:
+            connect_timer.stop()
+            if getattr(self._checkout, "active", False):
+                self._checkout.connect_time += connect_timer.elapsed
+            with self._stats_lock:
+                self.connects += 1
+                self.connect_time += connect_timer.elapsed
+                self.max_connect_time = max(self.max_connect_time, connect_timer.elapsed)
+
+
+def get_db_engine(db_url: str, settings: PoolSettings = PoolSettings()) -> Engine:
+    """Return the pooled engine for `db_url`. One engine (and pool) is created per process."""
+
+    def _create_engine() -> Engine:
+        logger.debug(
+            f"Creating db engine with pool_size: {settings.pool_size}, max_overflow: {settings.max_overflow}, "
+            f"pool_recycle: {settings.pool_recycle}, pool_pre_ping: {settings.pool_pre_ping}"
+        )
+        return create_engine(
+            db_url,
+            poolclass=InstrumentedQueuePool,
+            pool_size=settings.pool_size,
+            max_overflow=settings.max_overflow,
+            pool_timeout=settings.pool_timeout,
+            pool_recycle=settings.pool_recycle,
+            pool_pre_ping=settings.pool_pre_ping,
+        )
+
+    return resource_pool.get(("db_engine", db_url), _create_engine)
+
+
+def get_pool_stats(db_url: str) -> Dict[str, Any]:
+    """Return connection pool statistics for the engine serving `db_url`."""
+
+    pool = get_db_engine(db_url).pool
+    stats: Dict[str, Any] = {
+        "pool_size": pool.size(),  # type: ignore
+        "checked_in": pool.checkedin(),  # type: ignore
+        "checked_out": pool.checkedout(),  # type: ignore
+        "overflow": pool.overflow(),  # type: ignore
+    }
+    if isinstance(pool, InstrumentedQueuePool):
+        stats.update(
+            {
+                "waiting": pool.waiting,
+                "checkouts": pool.checkouts,
+                # Checkouts that found the pool exhausted, and how long they waited for a connection
+                "waits": pool.waits,
+                "avg_wait_time": round(pool.wait_time / pool.waits, 6) if pool.waits > 0 else 0.0,
+                "max_wait_time": round(pool.max_wait_time, 6),
+                # New connections opened, and how long opening them took
+                "connects": pool.connects,
+                "avg_connect_time": round(pool.connect_time / pool.connects, 6) if pool.connects > 0 else 0.0,
+                "max_connect_time": round(pool.max_connect_time, 6),
+            }
+        )
+    return stats
@@ -0,0 +1,200 @@
+import re
+import sys
+from abc import ABC, abstractmethod
+from hashlib import sha256
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.schema import MetaData, Table, Column
+from sqlalchemy.sql.expression import text, select
+from sqlalchemy.types import DateTime, Integer, String
+from pgvector.sqlalchemy import Vector
+
+from phi.document import Document
+from phi.embedder import Embedder
+from phi.utils.log import logger
+
+# Maximum number of texts sent in one VoyageAI embeddings request
+voyage_max_batch_size = 128
+
+
+def get_embeddings_and_usage(
+    embedder: Embedder, texts: List[str]
+) -> Tuple[List[List[float]], List[Optional[Dict]]]:
+    """Embed a list of texts, using one request per batch when the embedder supports it."""
+
+    # An embedder can only be a VoyageAIEmbedder if its module was imported, which is slow, so it is not imported here
+    voyageai = sys.modules.get("phi.embedder.voyageai")
+    if voyageai is not None and isinstance(embedder, voyageai.VoyageAIEmbedder):
+        embeddings: List[List[float]] = []
+        usage: List[Optional[Dict]] = []
+        for start in range(0, len(texts), voyage_max_batch_size):
+            batch = texts[start : start + voyage_max_batch_size]
+            request_params: Dict[str, Any] = {"texts": batch, "model": embedder.model}
+            if embedder.request_params:
+                request_params.update(embedder.request_params)
+            response = embedder.client.embed(**request_params)
+            embeddings.extend(response.embeddings)
+            # Usage is reported for the whole request, so it is shared evenly across the batch
+            usage.extend({"total_tokens": response.total_tokens // len(batch)} for _ in batch)
+        return embeddings, usage
+
+    results = [embedder.get_embedding_and_usage(text) for text in texts]
+    return [embedding for embedding, _ in results], [_usage for _, _usage in results]
+
+
+###########################################################################
+# Embedding cache
+###########################################################################
+
+
+def get_cache_key(embedder: Embedder, content: str) -> str:
+    """Cache key for a chunk: the embedder model, the dimensions and a hash of the normalized content."""
+
+    normalized = re.sub(r"\s+", " ", content.replace("\x00", "\ufffd")).strip()
+    model = getattr(embedder, "model", embedder.__class__.__name__)
+    return sha256(f"{model}|{embedder.dimensions}|{normalized}".encode()).hexdigest()
+
+
+class EmbeddingCache(ABC):
+    """Base class for the embedding cache, maps a cache key to an embedding."""
+
+    def __init__(self):
+        self.hits: int = 0
+        self.misses: int = 0
+
+    @abstractmethod
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        ...
+
+    @abstractmethod
+    def set_many(self, embedder: Embedder, embeddings: Dict[str, List[float]]) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / total, 4) if total else 0.0}
+
+
+class PgEmbeddingCache(EmbeddingCache):
+    """Embedding cache stored in a postgres table next to the knowledge base, shared by all processes."""
+
+    def __init__(self, db_engine: Engine, table_name: str = "llm_os_embedding_cache", schema: Optional[str] = "ai"):
+        super().__init__()
+        self.table_name: str = table_name
+        self.schema: Optional[str] = schema
+        self.db_engine: Engine = db_engine
+        self.metadata: MetaData = MetaData(schema=self.schema)
+        self.Session: sessionmaker[Session] = sessionmaker(bind=self.db_engine)
+        self.table: Table = Table(
+            self.table_name,
+            self.metadata,
+            # Hash of the embedder model, dimensions and normalized content
+            Column("key", String, primary_key=True),
+            Column("model", String),
+            Column("dimensions", Integer),
+            # Vector without a fixed number of dimensions, so one table serves every embedder
+            Column("embedding", Vector()),
+            Column("created_at", DateTime(timezone=True), server_default=text("now()")),
+            extend_existing=True,
+        )
+        self._created: bool = False
+        self._lock = Lock()
+
+    def create(self) -> None:
+        with self._lock:
+            if self._created:
+                return
+            if not inspect(self.db_engine).has_table(self.table_name, schema=self.schema):
+                with self.Session() as sess, sess.begin():
+                    sess.execute(text("create extension if not exists vector;"))
+                    if self.schema is not None:
+                        sess.execute(text(f"create schema if not exists {self.schema};"))
+                logger.debug(f"Creating table: {self.table_name}")
+                self.table.create(self.db_engine, checkfirst=True)
+            self._created = True
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        if len(keys) == 0:
+            return {}
+        self.create()
+        with self.Session() as sess, sess.begin():
+            rows = sess.execute(
+                select(self.table.c.key, self.table.c.embedding).where(self.table.c.key.in_(keys))
+            ).fetchall()
+        return {row.key: [float(v) for v in row.embedding] for row in rows}
+
+    def set_many(self, embedder: Embedder, embeddings: Dict[str, List[float]]) -> None:
+        if len(embeddings) == 0:
+            return
+        self.create()
+        model = getattr(embedder, "model", embedder.__class__.__name__)
+        stmt = postgresql.insert(self.table).on_conflict_do_nothing(index_elements=["key"])
+        with self.Session() as sess, sess.begin():
+            sess.execute(
+                stmt,
+                [
+                    {"key": key, "model": model, "dimensions": len(embedding), "embedding": embedding}
+                    for key, embedding in embeddings.items()
+                ],
+            )
+
+    def clear(self) -> None:
+        self.create()
+        with self.Session() as sess, sess.begin():
+            sess.execute(self.table.delete())
+
+
+def embed_documents(
+    embedder: Embedder, documents: List[Document], cache: Optional[EmbeddingCache] = None
+) -> List[Document]:
+    """Embed documents in place (like Document.embed) using batched requests.
+
+    If a cache is provided, chunks that were embedded before are read from the cache and
+    only the remaining chunks are sent to the embedder.
+    """
+
+    if len(documents) == 0:
+        return documents
+
+    to_embed = documents
+    keys: List[str] = []
+    if cache is not None:
+        keys = [get_cache_key(embedder, document.content) for document in documents]
+        try:
+            cached = cache.get_many(list(set(keys)))
+        except Exception as e:
+            logger.warning(f"Could not read the embedding cache: {e}")
+            cached = {}
+        to_embed = []
+        for document, key in zip(documents, keys):
+            if key in cached:
+                document.embedding = cached[key]
+                document.usage = {"total_tokens": 0, "cached": True}
+            else:
+                to_embed.append(document)
+        cache.hits += len(documents) - len(to_embed)
+        cache.misses += len(to_embed)
+
+    if len(to_embed) > 0:
+        embeddings, usage = get_embeddings_and_usage(embedder, [document.content for document in to_embed])
+        for document, embedding, _usage in zip(to_embed, embeddings, usage):
+            document.embedding = embedding
+            document.usage = _usage
+
+        if cache is not None:
+            key_by_document = {id(document): key for document, key in zip(documents, keys)}
+            new_embeddings = {key_by_document[id(document)]: document.embedding for document in to_embed}
+            try:
+                cache.set_many(embedder, new_embeddings)  # type: ignore
+            except Exception as e:
+                logger.warning(f"Could not write the embedding cache: {e}")
+    return documents
@@ -0,0 +1,369 @@
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from io import BytesIO
+from multiprocessing import get_context
+from queue import Queue
+from threading import Lock
+from time import time
+from typing import Callable, Dict, List, Optional, Set
+from uuid import uuid4
+
+from pydantic import BaseModel
+
+from phi.document import Document
+from phi.document.reader.pdf import PDFReader
+from phi.document.reader.base import Reader
+from phi.knowledge import AssistantKnowledge
+from phi.utils.log import logger
+
+from crawler import CrawledPage, WebsiteCrawler  # type: ignore
+from embeddings import embed_documents  # type: ignore
+from vectordb import PgVectorStore  # type: ignore
+
+
+###########################################################################
+# Parsing + chunking, these run in the process pool
+###########################################################################
+
+
+def count_pdf_pages(data: bytes) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(BytesIO(data)).pages)
+
+
+def read_pdf_pages(data: bytes, name: str, start: int, end: int, chunk_size: int) -> List[Document]:
+    """Read and chunk pages [start, end) of a PDF, with the same ids and meta_data as PDFReader."""
+    from pypdf import PdfReader
+
+    reader = PDFReader(chunk_size=chunk_size)
+    pdf = PdfReader(BytesIO(data))
+    documents: List[Document] = []
+    for page_number in range(start + 1, end + 1):
+        document = Document(
+            name=name,
+            id=f"{name}_{page_number}",
+            meta_data={"page": page_number},
+            content=pdf.pages[page_number - 1].extract_text(),
+        )
+        documents.extend(reader.chunk_document(document))
+    return documents
+
+
+###########################################################################
+# Ingestion jobs
+###########################################################################
+
+
+class IngestionJob(BaseModel):
+    """Status of a document ingestion job, shown in the app sidebar."""
+
+    job_id: str
+    name: str
+    # "pdf" or "url"
+    source_type: str
+    # queued, running, done or failed
+    status: str = "queued"
+    pages: int = 0
+    pages_read: int = 0
+    chunks: int = 0
+    chunks_embedded: int = 0
+    chunks_written: int = 0
+    # Chunks already stored with the same content, these are not embedded or written again
+    chunks_unchanged: int = 0
+    # Crawled pages not changed since the last crawl, these are not chunked again
+    pages_unchanged: int = 0
+    error: Optional[str] = None
+    created_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def progress(self) -> float:
+        if self.status == "done":
+            return 1.0
+        if self.chunks == 0 or self.pages_read < self.pages:
+            # Parsing makes up the first half of the progress
+            return 0.5 * self.pages_read / self.pages if self.pages > 0 else 0.0
+        return 0.5 + 0.5 * (self.chunks_written + self.chunks_unchanged) / self.chunks
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time()) - self.started_at
+
+    def stats(self) -> Dict[str, float]:
+        elapsed = self.elapsed
+        return {
+            "pages": self.pages,
+            "pages_unchanged": self.pages_unchanged,
+            "chunks": self.chunks,
+            "chunks_unchanged": self.chunks_unchanged,
+            "elapsed": round(elapsed, 4),
+            "pages_per_sec": round(self.pages / elapsed, 2) if elapsed > 0 else 0.0,
+            "chunks_per_sec": round(self.chunks_written / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+
+class IngestionStream:
+    """Lets the parsing tasks of a job hand it chunks while they run, like the pages of a crawl as they are fetched."""
+
+    def __init__(self):
+        self.futures: "Queue[Future]" = Queue()
+        self.callbacks: List[Callable[[], None]] = []
+        # True while a task may still add chunks
+        self.open: bool = False
+
+    def put(self, documents: List[Document]) -> None:
+        future: Future = Future()
+        future.set_result(documents)
+        self.futures.put(future)
+
+    def on_done(self, callback: Callable[[], None]) -> None:
+        """Run `callback` once the job has written all its chunks."""
+        self.callbacks.append(callback)
+
+
+class IngestionQueue:
+    """Loads PDFs and websites into the knowledge base in the background.
+
+    - Parsing and chunking run in a process pool, a PDF is split into page ranges read in parallel.
+    - Websites are crawled concurrently, and each changed page is chunked as soon as it is fetched. Pages that did
+      not change since the last crawl are skipped.
+    - Chunks are embedded in batches on a thread pool, which bounds the number of concurrent embedding requests.
+    - Embedded chunks are written to the vector db in bulk as soon as a write batch fills up.
+
+    :param knowledge_base: The knowledge base to load documents into.
+    :param crawler: Crawler for websites, keeps the crawl state in memory if not given.
+    :param parse_workers: Number of processes used for parsing and chunking.
+    :param embed_workers: Maximum number of concurrent embedding requests, shared by all jobs.
+    :param embed_batch_size: Number of chunks embedded per request.
+    :param write_batch_size: Number of chunks written to the vector db per statement.
+    :param pages_per_task: Number of PDF pages read per parsing task.
+    :param max_jobs: Number of jobs processed at the same time.
+    :param max_finished_jobs: Number of finished jobs kept for status reporting.
+    """
+
+    def __init__(
+        self,
+        knowledge_base: AssistantKnowledge,
+        crawler: Optional[WebsiteCrawler] = None,
+        parse_workers: Optional[int] = None,
+        embed_workers: int = 4,
+        embed_batch_size: int = 32,
+        write_batch_size: int = 100,
+        pages_per_task: int = 8,
+        chunk_size: int = 3000,
+        max_jobs: int = 2,
+        max_finished_jobs: int = 20,
+    ):
+        self.knowledge_base = knowledge_base
+        self.crawler = crawler or WebsiteCrawler()
+        if isinstance(knowledge_base.vector_db, PgVectorStore):
+            # Pages of a cleared knowledge base are loaded again on the next crawl, not reported as unchanged
+            knowledge_base.vector_db.on_clear.append(self.crawler.crawl_state.clear)
+        self.embed_batch_size = embed_batch_size
+        self.write_batch_size = write_batch_size
+        self.pages_per_task = pages_per_task
+        self.chunk_size = chunk_size
+        self.max_finished_jobs = max_finished_jobs
+
+        # Use spawn so worker processes do not inherit the threads of the app
+        self.parse_pool = ProcessPoolExecutor(max_workers=parse_workers, mp_context=get_context("spawn"))
+        self.embed_pool = ThreadPoolExecutor(max_workers=embed_workers, thread_name_prefix="ingestion-embed")
+        self.job_pool = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="ingestion-job")
+        # Each crawl runs its own event loop
+        self.crawl_pool = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="ingestion-crawl")
+
+        self.jobs: Dict[str, IngestionJob] = OrderedDict()
+        self._lock = Lock()
+
+    def submit_pdf(
+        self, data: bytes, name: str, on_finish: Optional[Callable[[IngestionJob], None]] = None
+    ) -> IngestionJob:
+        """Queue a PDF (as bytes) for ingestion, `on_finish` is called with the job once it is done or failed."""
+        job = self._create_job(name=name, source_type="pdf")
+        self.job_pool.submit(self._run_job, job, on_finish, self._parse_pdf, data, name)
+        return job
+
+    def submit_url(
+        self,
+        url: str,
+        max_pages: Optional[int] = None,
+        max_depth: Optional[int] = None,
+        on_finish: Optional[Callable[[IngestionJob], None]] = None,
+    ) -> IngestionJob:
+        """Queue a website for ingestion, the limits default to the crawl settings."""
+        job = self._create_job(name=url, source_type="url")
+        self.job_pool.submit(self._run_job, job, on_finish, self._parse_url, url, max_pages, max_depth)
+        return job
+
+    def get_jobs(self) -> List[IngestionJob]:
+        with self._lock:
+            return list(self.jobs.values())
+
+    def get_job(self, job_id: str) -> Optional[IngestionJob]:
+        """Return the job, or None if it is unknown or was forgotten."""
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.job_pool.shutdown(wait=wait)
+        self.crawl_pool.shutdown(wait=wait)
+        self.embed_pool.shutdown(wait=wait)
+        self.parse_pool.shutdown(wait=wait)
+
+    def _create_job(self, name: str, source_type: str) -> IngestionJob:
+        job = IngestionJob(job_id=str(uuid4()), name=name, source_type=source_type, created_at=time())
+        with self._lock:
+            self.jobs[job.job_id] = job
+            # Forget the oldest finished jobs
+            finished = [j.job_id for j in self.jobs.values() if j.status in ("done", "failed")]
+            for job_id in finished[: max(0, len(finished) - self.max_finished_jobs)]:
+                del self.jobs[job_id]
+        return job
+
+    def _parse_pdf(self, job: IngestionJob, stream: IngestionStream, data: bytes, name: str) -> Dict[Future, int]:
+        """Submit the parsing tasks for a PDF, returns the number of pages read by each task."""
+        job.pages = self.parse_pool.submit(count_pdf_pages, data).result()
+        futures: Dict[Future, int] = {}
+        for start in range(0, job.pages, self.pages_per_task):
+            end = min(start + self.pages_per_task, job.pages)
+            futures[self.parse_pool.submit(read_pdf_pages, data, name, start, end, self.chunk_size)] = end - start
+        return futures
+
+    def _parse_url(
+        self, job: IngestionJob, stream: IngestionStream, url: str, max_pages: Optional[int], max_depth: Optional[int]
+    ) -> Dict[Future, int]:
+        """Submit the crawl of a website, the chunks of each changed page are streamed to the job."""
+        reader = Reader(chunk_size=self.chunk_size)
+
+        def on_page(page: CrawledPage) -> None:
+            if page.status in ("changed", "not_modified", "unchanged"):
+                job.pages += 1
+                job.pages_read = job.pages
+            if page.status in ("not_modified", "unchanged"):
+                job.pages_unchanged += 1
+            if page.status != "changed" or page.content is None or page.state is None:
+                return
+            # Chunked with the same ids and meta_data as the WebsiteReader
+            documents = reader.chunk_document(
+                Document(name=url, id=page.url, meta_data={"url": page.url}, content=page.content)
+            )
+            page.state.chunks = len(documents)
+            stream.put(documents)
+
+        def crawl() -> List[Document]:
+            try:
+                pages = self.crawler.crawl(url, on_page=on_page, max_pages=max_pages, max_depth=max_depth)
+            finally:
+                stream.open = False
+            stream.on_done(lambda: self._finish_crawl(pages))
+            # The chunks were streamed to the job page by page
+            return []
+
+        stream.open = True
+        return {self.crawl_pool.submit(crawl): 0}
+
+    def _finish_crawl(self, pages: List[CrawledPage]) -> None:
+        """Delete the chunks changed pages no longer have, and store the crawl state once the pages are written."""
+        vector_db = self.knowledge_base.vector_db
+        stale_ids: List[str] = []
+        for page in pages:
+            if page.status == "changed" and page.previous is not None and page.state is not None:
+                stale_ids.extend(f"{page.url}_{n}" for n in range(page.state.chunks + 1, page.previous.chunks + 1))
+        if len(stale_ids) > 0 and isinstance(vector_db, PgVectorStore):
+            vector_db.delete_documents(stale_ids)
+        # Failed pages are crawled again next time
+        self.crawler.crawl_state.set_many([page.state for page in pages if page.state is not None])
+
+    def _embed_batch(self, documents: List[Document]) -> List[Document]:
+        """Embed a batch of chunks, returns the chunks that need to be written."""
+        vector_db = self.knowledge_base.vector_db
+        if vector_db is None:
+            return documents
+        if isinstance(vector_db, PgVectorStore):
+            return vector_db.embed_documents(vector_db.filter_unchanged(documents))
+        return embed_documents(vector_db.embedder, documents)  # type: ignore
+
+    def _write_batch(self, documents: List[Document]) -> None:
+        vector_db = self.knowledge_base.vector_db
+        if vector_db is None:
+            return
+        if isinstance(vector_db, PgVectorStore):
+            vector_db.upsert_embedded(documents)
+        else:
+            vector_db.upsert(documents)
+
+    def _run_job(self, job: IngestionJob, on_finish: Optional[Callable[[IngestionJob], None]], parse, *args) -> None:
+        job.status = "running"
+        job.started_at = time()
+        try:
+            if self.knowledge_base.vector_db is None:
+                raise ValueError("No vector db provided")
+            self.knowledge_base.vector_db.create()
+
+            stream = IngestionStream()
+            parse_futures: Dict[Future, int] = parse(job, stream, *args)
+            pending: Set[Future] = set(parse_futures)
+            # Number of chunks sent in each embedding task
+            embed_futures: Dict[Future, int] = {}
+            write_buffer: List[Document] = []
+            while pending or not stream.futures.empty():
+                # Chunks streamed by the parsing tasks are picked up as they come
+                while not stream.futures.empty():
+                    future = stream.futures.get()
+                    parse_futures[future] = 0
+                    pending.add(future)
+                done, pending = wait(pending, timeout=0.05 if stream.open else None, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in parse_futures:
+                        # Parsed chunks are embedded in batches as soon as they are available
+                        documents: List[Document] = future.result()
+                        if job.source_type != "url":
+                            job.pages_read += parse_futures[future]
+                        job.chunks += len(documents)
+                        for start in range(0, len(documents), self.embed_batch_size):
+                            batch = documents[start : start + self.embed_batch_size]
+                            embed_future = self.embed_pool.submit(self._embed_batch, batch)
+                            embed_futures[embed_future] = len(batch)
+                            pending.add(embed_future)
+                    else:
+                        # Embedded chunks are written once a write batch fills up
+                        embedded: List[Document] = future.result()
+                        job.chunks_embedded += len(embedded)
+                        job.chunks_unchanged += embed_futures.pop(future) - len(embedded)
+                        write_buffer.extend(embedded)
+                        if len(write_buffer) >= self.write_batch_size:
+                            self._write_batch(write_buffer)
+                            job.chunks_written += len(write_buffer)
+                            write_buffer = []
+            if len(write_buffer) > 0:
+                self._write_batch(write_buffer)
+                job.chunks_written += len(write_buffer)
+            if job.chunks == 0 and job.pages_unchanged == 0:
+                raise ValueError(f"Could not read {job.name}")
+            for callback in stream.callbacks:
+                callback()
+            job.status = "done"
+            logger.info(f"Ingested {job.name}: {job.stats()}")
+        except Exception as e:
+            logger.error(f"Failed to ingest {job.name}: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time()
+        if on_finish is not None:
+            try:
+                on_finish(job)
+            except Exception as e:
+                logger.warning(f"Could not record the outcome of {job.name}: {e}")
+
+        vector_db = self.knowledge_base.vector_db
+        if job.status == "done" and job.chunks_written > 0 and isinstance(vector_db, PgVectorStore):
+            # Build the ANN index once the collection is large enough, or rebuild it if it is out of date
+            try:
+                vector_db.ensure_index()
+            except Exception as e:
+                logger.warning(f"Could not update the index on {vector_db.collection}: {e}")
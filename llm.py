@@ -0,0 +1,261 @@
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from contextvars import ContextVar, copy_context
+from os import getenv
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from phi.llm.anthropic import Claude
+from phi.llm.message import Message
+from phi.tools.function import FunctionCall
+from phi.utils.log import logger
+from phi.utils.timer import Timer
+
+from context import ContextBudget, system_prompt_breakpoint  # type: ignore
+from resources import resource_pool  # type: ignore
+from tracing import tracer  # type: ignore
+
+
+# Nesting level of the tool calls running in this context: a team member's tool calls run one level below the
+# delegation that runs its turn
+_tool_call_depth: ContextVar[int] = ContextVar("llm_os_tool_call_depth", default=0)
+
+
+def get_tool_call_pool(depth: int = 0) -> ThreadPoolExecutor:
+    # Shared by every assistant in the process, this bounds the number of tool calls running at the same time.
+    # Each nesting level has its own pool: a delegation waits on its team member's tool calls, which would deadlock
+    # if they queued behind other delegations on the same pool.
+    return resource_pool.get(
+        ("tool_call_pool", depth),
+        lambda: ThreadPoolExecutor(
+            max_workers=int(getenv("LLM_OS_TOOL_CALL_WORKERS", "16")), thread_name_prefix=f"tool-call-{depth}"
+        ),
+    )
+
+
+def run_function_call(function_call: FunctionCall, depth: int) -> float:
+    """Run a function call at nesting level `depth`, returns the time spent in the function call."""
+
+    _tool_call_depth.set(depth + 1)
+    timer = Timer()
+    timer.start()
+    with tracer.span("tool", tool=function_call.function.name):
+        function_call.execute()
+    timer.stop()
+    return timer.elapsed
+
+
+def submit_after(pool: ThreadPoolExecutor, after: Optional[Future], fn: Callable[..., Any], *args: Any) -> Future:
+    """Submit `fn` to `pool` once `after` is done, without holding a worker while it waits."""
+
+    if after is None:
+        return pool.submit(fn, *args)
+    chained: Future = Future()
+
+    def copy_outcome(future: Future) -> None:
+        if future.cancelled():
+            chained.cancel()
+        elif future.exception() is not None:
+            chained.set_exception(future.exception())  # type: ignore
+        else:
+            chained.set_result(future.result())
+
+    def start(_: Future) -> None:
+        # Not started if the caller stopped waiting in the meantime
+        if not chained.set_running_or_notify_cancel():
+            return
+        try:
+            pool.submit(fn, *args).add_done_callback(copy_outcome)
+        except RuntimeError as e:
+            chained.set_exception(e)
+
+    after.add_done_callback(start)
+    return chained
+
+
+class TracedStream:
+    """Wraps the response stream of the Anthropic client to record its time to first token and token usage."""
+
+    def __init__(self, stream_manager: Any, model: str, on_usage: Optional[Callable[[Any], None]] = None):
+        self.stream_manager = stream_manager
+        self.model = model
+        self.on_usage = on_usage
+        self.stream: Any = None
+
+    def __enter__(self) -> "TracedStream":
+        # The request is sent when the stream is entered
+        self.span_context = tracer.span("llm", model=self.model)
+        self.llm_span = self.span_context.__enter__()
+        self.started = perf_counter()
+        self.stream = self.stream_manager.__enter__()
+        return self
+
+    @property
+    def text_stream(self) -> Iterator[str]:
+        first = True
+        for text in self.stream.text_stream:
+            if first:
+                self.llm_span.set(time_to_first_token=perf_counter() - self.started)
+                first = False
+            yield text
+
+    def __exit__(self, *args: Any) -> None:
+        try:
+            usage = self.stream.get_final_message().usage
+            self.llm_span.set(input_tokens=usage.input_tokens, output_tokens=usage.output_tokens)
+            if self.on_usage is not None:
+                self.on_usage(usage)
+        except Exception:
+            pass
+        try:
+            self.stream_manager.__exit__(*args)
+        finally:
+            self.span_context.__exit__(*args)
+
+
+class ParallelClaude(Claude):
+    """Claude that can run the tool calls of one response at the same time.
+
+    Tool calls (and delegations to team members) are mostly network bound, so running them on a thread pool
+    makes a turn take as long as its slowest call instead of the sum of all calls. Results are returned to the
+    model in the order the calls were made. Calls delegating to the same team member run one after the other,
+    as an assistant can only work on one task at a time.
+    """
+
+    # Run the tool calls of a response in parallel
+    parallel_tool_calls: bool = False
+    # Seconds (from when the calls are dispatched) after which a tool call is reported to the model as timed out
+    tool_call_timeout: Optional[float] = None
+
+    # Truncates tool outputs and marks the stable part of the system prompt for prompt caching
+    context_budget: Optional[ContextBudget] = None
+
+    def get_system(self, system_prompt: Optional[str]) -> Any:
+        if system_prompt is None or system_prompt_breakpoint not in system_prompt:
+            return system_prompt
+        prefix, tail = system_prompt.split(system_prompt_breakpoint, 1)
+        if self.context_budget is None or not self.context_budget.settings.prompt_caching:
+            return f"{prefix}\n{tail}"
+        # The prefix is cached by Anthropic, so later requests with the same prefix only process the tail
+        return [
+            {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": tail},
+        ]
+
+    def get_request(self, messages: List[Message]) -> Dict[str, Any]:
+        """Return the arguments of the Messages API request for `messages`."""
+
+        api_kwargs: Dict[str, Any] = self.api_kwargs
+        api_messages: List[dict] = []
+        for m in messages:
+            if m.role == "system":
+                api_kwargs["system"] = self.get_system(m.content)  # type: ignore
+            else:
+                api_messages.append({"role": m.role, "content": m.content or ""})
+        if isinstance(api_kwargs.get("system"), list):
+            api_kwargs["extra_headers"] = {
+                **api_kwargs.get("extra_headers", {}),
+                "anthropic-beta": "prompt-caching-2024-07-31",
+            }
+        return {"model": self.model, "messages": api_messages, **api_kwargs}
+
+    def invoke(self, messages: List[Message]) -> Any:
+        with tracer.span("llm", model=self.model) as span:
+            response = self.client.messages.create(**self.get_request(messages))
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                span.set(input_tokens=usage.input_tokens, output_tokens=usage.output_tokens)
+                if self.context_budget is not None:
+                    self.context_budget.record_usage(usage)
+            return response
+
+    def invoke_stream(self, messages: List[Message]) -> Any:
+        stream_manager = self.client.messages.stream(**self.get_request(messages))
+        if not tracer.enabled and self.context_budget is None:
+            return stream_manager
+        on_usage = self.context_budget.record_usage if self.context_budget is not None else None
+        return TracedStream(stream_manager, model=self.model, on_usage=on_usage)
+
+    def run_function_calls(self, function_calls: List[FunctionCall], role: str = "tool") -> List[Message]:
+        function_call_results = self.run_function_calls_in_order(function_calls, role=role)
+        if self.context_budget is not None:
+            for message in function_call_results:
+                # Team members' answers (like reports) are returned to the user as is, and the chat history is
+                # already kept within its own budget (history_tokens), so they are not truncated
+                name = message.tool_call_name or ""
+                if isinstance(message.content, str) and not (
+                    name.startswith("delegate_task_to_") or name == "get_chat_history"
+                ):
+                    message.content = self.context_budget.truncate_tool_output(message.content)
+        return function_call_results
+
+    def run_function_calls_in_order(self, function_calls: List[FunctionCall], role: str = "tool") -> List[Message]:
+        """Run the function calls, in parallel if enabled, and return their results in the order of the calls."""
+
+        if not self.parallel_tool_calls or (len(function_calls) <= 1 and self.tool_call_timeout is None):
+            # Run the calls one at a time, so each one is traced
+            function_call_results: List[Message] = []
+            for function_call in function_calls:
+                with tracer.span("tool", tool=function_call.function.name):
+                    function_call_results.extend(super().run_function_calls([function_call], role=role))
+                if len(self.function_call_stack or []) >= self.function_call_limit:
+                    break
+            return function_call_results
+
+        if self.function_call_stack is None:
+            self.function_call_stack = []
+        # Like the sequential path, stop once the function call limit is reached
+        function_calls = function_calls[: max(self.function_call_limit - len(self.function_call_stack), 1)]
+
+        depth = _tool_call_depth.get()
+        pool = get_tool_call_pool(depth)
+        dispatched_at = perf_counter()
+        futures: List[Future] = []
+        last_delegation: Dict[str, Future] = {}
+        for function_call in function_calls:
+            name = function_call.function.name
+            after = last_delegation.get(name) if name.startswith("delegate_task_to_") else None
+            # Tool calls run in a copy of the turn's context, so their spans belong to the turn
+            future = submit_after(pool, after, copy_context().run, run_function_call, function_call, depth)
+            if name.startswith("delegate_task_to_"):
+                last_delegation[name] = future
+            futures.append(future)
+
+        function_call_results: List[Message] = []
+        for function_call, future in zip(function_calls, futures):
+            name = function_call.function.name
+            timeout = None
+            if self.tool_call_timeout is not None:
+                timeout = max(self.tool_call_timeout - (perf_counter() - dispatched_at), 0)
+            try:
+                elapsed = future.result(timeout=timeout)
+                content = function_call.result
+            except TimeoutError:
+                # A call that has not started is dropped, a running one keeps its worker until it returns
+                future.cancel()
+                logger.warning(f"Tool call timed out after {self.tool_call_timeout}s: {function_call.get_call_str()}")
+                elapsed = self.tool_call_timeout or 0.0
+                content = f"Error: {name} did not finish within {self.tool_call_timeout} seconds."
+            except Exception as e:
+                logger.warning(f"Tool call failed: {function_call.get_call_str()}: {e}")
+                elapsed = perf_counter() - dispatched_at
+                content = f"Error: {e}"
+
+            function_call_results.append(
+                Message(
+                    role=role,
+                    content=content,
+                    tool_call_id=function_call.call_id,
+                    tool_call_name=name,
+                    metrics={"time": elapsed},
+                )
+            )
+            if "tool_call_times" not in self.metrics:
+                self.metrics["tool_call_times"] = {}
+            if name not in self.metrics["tool_call_times"]:
+                self.metrics["tool_call_times"][name] = []
+            self.metrics["tool_call_times"][name].append(elapsed)
+            self.function_call_stack.append(function_call)
+
+        if len(self.function_call_stack) >= self.function_call_limit:
+            self.deactivate_function_calls()
+        return function_call_results
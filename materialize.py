@@ -0,0 +1,200 @@
+import json
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Any, Dict, List, Optional
+from urllib.request import Request, urlopen
+
+import duckdb
+from pydantic import BaseModel
+
+from phi.utils.log import logger
+from phi.utils.timer import Timer
+
+
+class MaterializedTable(BaseModel):
+    """A semantic model table copied to a local Parquet file."""
+
+    name: str
+    source: str
+    path: str
+    # Fingerprint of the source when it was copied: ETag/Last-Modified/size for URLs, size/mtime for local files
+    fingerprint: str
+    rows: int = 0
+    materialized_at: float = 0.0
+    # Seconds spent copying the source
+    materialize_time: float = 0.0
+
+
+def get_source_fingerprint(source: str, checksum: bool = False) -> Optional[str]:
+    """Return a fingerprint that changes when the source changes, or None if the source can not be reached.
+
+    :param checksum: Hash the contents of local files instead of using their size and mtime.
+    """
+
+    if source.startswith(("http://", "https://")):
+        try:
+            with urlopen(Request(source, method="HEAD"), timeout=10) as response:
+                headers = response.headers
+                return "|".join(headers.get(header, "") for header in ("ETag", "Last-Modified", "Content-Length"))
+        except Exception as e:
+            logger.warning(f"Could not check {source}: {e}")
+            return None
+
+    path = Path(source)
+    if not path.exists():
+        return None
+    if checksum:
+        digest = sha256()
+        with path.open("rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    stat = path.stat()
+    return f"{stat.st_size}|{stat.st_mtime_ns}"
+
+
+class TableMaterializer:
+    """Copies the tables of a DuckDbAssistant semantic model to local Parquet files.
+
+    Remote CSVs are read and parsed once, later queries scan the columnar copy. Copies are made in the background:
+    until a table is copied the assistant keeps using its source. Sources are checked for changes at most every
+    `refresh_interval` seconds, and a changed source is copied again while the old copy keeps serving queries.
+    Copies are written to a temporary file and renamed, so processes sharing `data_dir` never see a partial file.
+
+    :param data_dir: Directory the Parquet files are written to.
+    :param refresh_interval: Seconds between two checks of a source for changes.
+    :param checksum: Hash local sources instead of comparing their size and mtime.
+    """
+
+    def __init__(self, data_dir: Path, refresh_interval: float = 5 * 60, checksum: bool = False):
+        data_dir.mkdir(parents=True, exist_ok=True)
+        self.data_dir = data_dir
+        self.refresh_interval = refresh_interval
+        self.checksum = checksum
+        self.pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="materialize")
+        self._lock = Lock()
+        self._in_progress: Dict[str, Future] = {}
+        # Table name -> time its source was last checked
+        self._checked_at: Dict[str, float] = {}
+
+    def get_paths(self, name: str) -> Dict[str, Path]:
+        return {
+            "data": self.data_dir.joinpath(f"{name}.parquet"),
+            "meta": self.data_dir.joinpath(f"{name}.json"),
+        }
+
+    def get_table(self, name: str) -> Optional[MaterializedTable]:
+        paths = self.get_paths(name)
+        if not paths["data"].exists() or not paths["meta"].exists():
+            return None
+        try:
+            return MaterializedTable.model_validate_json(paths["meta"].read_text())
+        except Exception:
+            return None
+
+    def materialize(self, name: str, source: str, fingerprint: Optional[str] = None) -> MaterializedTable:
+        """Copy `source` to a local Parquet file, blocking until it is done."""
+
+        paths = self.get_paths(name)
+        tmp_path = paths["data"].with_suffix(f".{os.getpid()}.tmp")
+        fingerprint = fingerprint or get_source_fingerprint(source, checksum=self.checksum) or ""
+        timer = Timer()
+        timer.start()
+        logger.info(f"Materializing table {name} from {source}")
+        with duckdb.connect() as connection:
+            escaped_source = source.replace("'", "''")
+            connection.execute(
+                f"COPY (SELECT * FROM '{escaped_source}') TO '{tmp_path}' (FORMAT PARQUET, COMPRESSION ZSTD)"
+            )
+            rows = connection.execute(f"SELECT count(*) FROM read_parquet('{tmp_path}')").fetchone()[0]  # type: ignore
+        timer.stop()
+        os.replace(tmp_path, paths["data"])
+        table = MaterializedTable(
+            name=name,
+            source=source,
+            path=str(paths["data"]),
+            fingerprint=fingerprint,
+            rows=rows,
+            materialized_at=time(),
+            materialize_time=timer.elapsed,
+        )
+        paths["meta"].write_text(table.model_dump_json())
+        logger.info(f"Materialized table {name}: {rows} rows in {timer.elapsed:.2f}s")
+        return table
+
+    def refresh(self, name: str, source: str) -> MaterializedTable:
+        """Copy the source again if it changed since the last copy, or was never copied."""
+
+        table = self.get_table(name)
+        fingerprint = get_source_fingerprint(source, checksum=self.checksum)
+        if table is not None and table.source == source and (fingerprint is None or fingerprint == table.fingerprint):
+            # Unchanged, or can not be checked right now
+            return table
+        return self.materialize(name, source, fingerprint=fingerprint)
+
+    def schedule_refresh(self, name: str, source: str, force: bool = False) -> Optional[Future]:
+        """Refresh the table in the background, unless it was checked recently or is being refreshed."""
+
+        with self._lock:
+            if name in self._in_progress:
+                return self._in_progress[name]
+            if not force and time() - self._checked_at.get(name, 0) < self.refresh_interval:
+                return None
+            self._checked_at[name] = time()
+            future = self.pool.submit(self.refresh, name, source)
+            self._in_progress[name] = future
+
+        def _done(f: Future) -> None:
+            with self._lock:
+                self._in_progress.pop(name, None)
+            if f.exception() is not None:
+                logger.error(f"Could not materialize table {name}: {f.exception()}")
+
+        future.add_done_callback(_done)
+        return future
+
+    def get_local_tables(self, semantic_model: Dict[str, Any], wait: bool = False) -> Dict[str, MaterializedTable]:
+        """Return the tables of `semantic_model` that have an up to date local copy, refreshing them as needed.
+
+        :param wait: Wait for missing tables to be copied instead of copying them in the background.
+        """
+
+        local_tables: Dict[str, MaterializedTable] = {}
+        for table in semantic_model.get("tables", []):
+            name, source = table.get("name"), table.get("path")
+            if name is None or source is None:
+                continue
+            existing = self.get_table(name)
+            if existing is not None and existing.source != source:
+                existing = None
+            future = self.schedule_refresh(name, source, force=existing is None)
+            if existing is None and wait and future is not None:
+                existing = future.result()
+            if existing is not None:
+                local_tables[name] = existing
+        return local_tables
+
+    def connect(self, semantic_model: Dict[str, Any], wait: bool = False) -> duckdb.DuckDBPyConnection:
+        """Return an in-memory DuckDB connection with a view over the local copy of each table."""
+
+        connection = duckdb.connect()
+        for name, table in self.get_local_tables(semantic_model, wait=wait).items():
+            connection.execute(f"CREATE VIEW \"{name}\" AS SELECT * FROM read_parquet('{table.path}')")
+        return connection
+
+    def localize_semantic_model(self, semantic_model: Dict[str, Any], connection: duckdb.DuckDBPyConnection) -> str:
+        """Return the semantic model as JSON, pointing the tables that are views in `connection` at their copy."""
+
+        views = {row[0] for row in connection.execute("SELECT view_name FROM duckdb_views()").fetchall()}
+        tables: List[Dict[str, Any]] = []
+        for table in semantic_model.get("tables", []):
+            if table.get("name") in views:
+                table = {**table, "path": str(self.get_paths(table["name"])["data"])}
+                loaded = f"Already loaded as the `{table['name']}` view."
+                table["description"] = f"{table['description']} {loaded}" if table.get("description") else loaded
+            tables.append(table)
+        return json.dumps({**semantic_model, "tables": tables})
@@ -0,0 +1,523 @@
+import atexit
+import json
+import os
+import subprocess
+import sys
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
+from os import getenv
+from pathlib import Path
+from threading import Lock
+from time import monotonic, perf_counter
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from pydantic import BaseModel
+from phi.tools.python import PythonTools
+from phi.utils.log import logger
+
+from tracing import tracer  # type: ignore
+
+sandbox_path = Path(__file__).parent.joinpath("sandbox.py")
+
+
+class PythonWorkerSettings(BaseModel):
+    """Python Assistant worker pool settings."""
+
+    # Worker processes started ahead of time, ready for the next run that executes code
+    warm_workers: int = int(getenv("LLM_OS_PYTHON_WARM_WORKERS", "1"))
+    # Worker processes at most, one per run: past this, the run that executed code least recently loses its worker
+    max_workers: int = int(getenv("LLM_OS_PYTHON_MAX_WORKERS", "4"))
+    # Modules the workers import before they are ready
+    preimport: List[str] = [
+        module.strip() for module in getenv("LLM_OS_PYTHON_PREIMPORT", "numpy,pandas").split(",") if module.strip()
+    ]
+    # CPU seconds one execution can use
+    cpu_seconds: int = int(getenv("LLM_OS_PYTHON_CPU_SECONDS", "60"))
+    # Address space of a worker in MB, 0 for no limit
+    memory_mb: int = int(getenv("LLM_OS_PYTHON_MEMORY_MB", "2048"))
+    # Seconds one execution can take before its worker is stopped
+    timeout: float = float(getenv("LLM_OS_PYTHON_TIMEOUT", "120"))
+    # Seconds the worker of a run is kept after its last execution
+    idle_ttl: float = float(getenv("LLM_OS_PYTHON_IDLE_TTL", "1800"))
+    # Characters of output, and of the returned variable, sent back to the assistant
+    output_chars: int = int(getenv("LLM_OS_PYTHON_OUTPUT_CHARS", "10000"))
+    # Seconds a pip install can take
+    pip_timeout: float = float(getenv("LLM_OS_PYTHON_PIP_TIMEOUT", "600"))
+
+
+class Execution(BaseModel):
+    """The outcome of running code in a worker."""
+
+    ok: bool
+    result: Optional[str] = None
+    output: str = ""
+    error: Optional[str] = None
+    # Seconds the code ran for, and the CPU seconds it used
+    elapsed: float = 0.0
+    cpu_time: float = 0.0
+    # Seconds from the call to the response, including the wait for a worker
+    latency: float = 0.0
+    # First execution of the run, in a fresh namespace
+    first: bool = False
+    # The run got a worker that was started ahead of time (or already had one)
+    warm: bool = True
+
+
+def is_installed(package: str) -> bool:
+    from importlib.metadata import PackageNotFoundError, version
+    from packaging.requirements import Requirement
+
+    try:
+        requirement = Requirement(package)
+        return requirement.specifier.contains(version(requirement.name), prereleases=True)
+    except (PackageNotFoundError, ValueError):
+        return False
+
+
+class PythonWorker:
+    """A sandbox.py process, and the pipes to send it code and receive the results.
+
+    :param settings: Limits and modules to import, passed to the process.
+    :param base_dir: Working directory of the process.
+    :param wheel_dir: Local wheel cache, used by pip in the process.
+    """
+
+    def __init__(self, settings: PythonWorkerSettings, base_dir: Path, wheel_dir: Path):
+        start = perf_counter()
+        parent_read, child_write = os.pipe()
+        child_read, parent_write = os.pipe()
+        sandbox_settings = settings.model_dump(include={"preimport", "cpu_seconds", "memory_mb", "output_chars"})
+        env = {**os.environ, "PIP_FIND_LINKS": str(wheel_dir), "MPLBACKEND": "Agg"}
+        try:
+            self.process: subprocess.Popen = subprocess.Popen(
+                [sys.executable, str(sandbox_path), str(child_read), str(child_write), json.dumps(sandbox_settings)],
+                cwd=str(base_dir),
+                env=env,
+                pass_fds=(child_read, child_write),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+        except BaseException:
+            os.close(parent_read)
+            os.close(parent_write)
+            raise
+        finally:
+            os.close(child_read)
+            os.close(child_write)
+        self.reader = Connection(parent_read, writable=False)
+        self.writer = Connection(parent_write, readable=False)
+        # One execution at a time
+        self.lock = Lock()
+        # Calls that acquired the worker and did not finish their execution yet, changed under the pool lock.
+        # Busy workers are not stopped by eviction.
+        self.busy: int = 0
+        self.executions: int = 0
+        self.last_used: float = monotonic()
+        try:
+            if not self.reader.poll(settings.timeout):
+                raise TimeoutError(f"Python worker not ready after {settings.timeout}s")
+            ready: Dict[str, Any] = self.reader.recv()
+        except BaseException:
+            self.stop()
+            raise
+        self.pid: int = ready["pid"]
+        self.imported: List[str] = ready["imported"]
+        self.startup: float = perf_counter() - start
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def run(self, request: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        """Send code to the process and wait for the result, raises TimeoutError or EOFError if it does not come."""
+
+        self.writer.send(request)
+        if not self.reader.poll(timeout):
+            raise TimeoutError(f"Execution timed out after {timeout}s")
+        return self.reader.recv()
+
+    def stop(self) -> None:
+        for connection in (self.reader, self.writer):
+            try:
+                connection.close()
+            except (AttributeError, OSError):
+                pass
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+
+class PythonWorkerPool:
+    """Worker processes that run the code of the Python Assistant, one per run.
+
+    `warm_workers` processes are started ahead of time and import the common libraries (pandas, numpy), so the
+    first execution of a run does not wait for an interpreter to start. A run keeps its worker, and the namespace in
+    it, for its later executions until it is idle for `idle_ttl` seconds, is the least recently used run when
+    `max_workers` is reached, or is released. Each execution is limited in CPU time and memory in the worker, and
+    in wall time by the pool. Packages are installed from a local wheel cache shared by all runs and processes.
+
+    :param base_dir: Working directory of the workers, where the assistant saves its files.
+    :param wheel_dir: Directory of the wheel cache.
+    :param settings: Pool size and limits.
+    """
+
+    def __init__(self, base_dir: Path, wheel_dir: Path, settings: Optional[PythonWorkerSettings] = None):
+        self.settings = settings or PythonWorkerSettings()
+        self.base_dir = base_dir
+        self.wheel_dir = wheel_dir
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self.wheel_dir.mkdir(parents=True, exist_ok=True)
+        self.idle: List[PythonWorker] = []
+        # run -> worker, least recently used first
+        self.assigned: "OrderedDict[str, PythonWorker]" = OrderedDict()
+        self.spawning: int = 0
+        self.closed: bool = False
+        self._lock = Lock()
+        self._install_lock = Lock()
+        self.spawn_pool = ThreadPoolExecutor(
+            max_workers=max(1, self.settings.warm_workers), thread_name_prefix="python-worker"
+        )
+        # Latency counters
+        self.first_executions: int = 0
+        self.first_latency: float = 0.0
+        self.later_executions: int = 0
+        self.later_latency: float = 0.0
+        self.cold_starts: int = 0
+        self.workers_started: int = 0
+        self.startup_time: float = 0.0
+        self.refill()
+        atexit.register(self.close)
+
+    ###########################################################################
+    # Workers
+    ###########################################################################
+
+    def start_worker(self) -> PythonWorker:
+        worker = PythonWorker(settings=self.settings, base_dir=self.base_dir, wheel_dir=self.wheel_dir)
+        with self._lock:
+            self.workers_started += 1
+            self.startup_time += worker.startup
+        logger.debug(f"Started python worker {worker.pid} in {worker.startup:.4f}s, imported: {worker.imported}")
+        return worker
+
+    def refill(self) -> None:
+        """Start workers in the background until `warm_workers` are ready."""
+
+        with self._lock:
+            if self.closed:
+                return
+            missing = self.settings.warm_workers - len(self.idle) - self.spawning
+            self.spawning += max(0, missing)
+        for _ in range(missing):
+            self.spawn_pool.submit(self._start_idle_worker)
+
+    def _start_idle_worker(self) -> None:
+        worker: Optional[PythonWorker] = None
+        try:
+            worker = self.start_worker()
+        except Exception as e:
+            logger.warning(f"Could not start a python worker: {e}")
+        finally:
+            with self._lock:
+                self.spawning -= 1
+                if worker is not None and not self.closed:
+                    self.idle.append(worker)
+                    worker = None
+        if worker is not None:
+            worker.stop()
+
+    def acquire(self, run: str) -> Tuple[PythonWorker, bool]:
+        """Return the worker of `run` and whether it was ready, giving it a worker if it does not have one.
+
+        The worker is returned busy, so it is not evicted before the execution: `done` must be called after it.
+        """
+
+        to_stop: List[PythonWorker] = []
+        worker: Optional[PythonWorker] = None
+        with self._lock:
+            to_stop.extend(self._evict_idle())
+            worker = self.assigned.get(run)
+            if worker is not None and worker.alive:
+                self.assigned.move_to_end(run)
+                worker.busy += 1
+                return worker, True
+            if worker is not None:
+                del self.assigned[run]
+            # Workers running code are not stopped, the pool can go past max_workers while they finish
+            for lru_run, lru_worker in list(self.assigned.items()):
+                if len(self.assigned) < self.settings.max_workers:
+                    break
+                if lru_worker.busy == 0:
+                    del self.assigned[lru_run]
+                    to_stop.append(lru_worker)
+            worker = None
+            while self.idle and worker is None:
+                worker = self.idle.pop()
+                if not worker.alive:
+                    to_stop.append(worker)
+                    worker = None
+        for stopped in to_stop:
+            stopped.stop()
+
+        warm = worker is not None
+        if worker is None:
+            with self._lock:
+                self.cold_starts += 1
+            worker = self.start_worker()
+        with self._lock:
+            current = self.assigned.get(run)
+            if current is not None and current.alive:
+                # Another call of the run got a worker meanwhile
+                self.idle.append(worker)
+                worker = current
+            self.assigned[run] = worker
+            worker.busy += 1
+        self.refill()
+        return worker, warm
+
+    def _evict_idle(self) -> List[PythonWorker]:
+        now = monotonic()
+        evicted = [
+            run
+            for run, worker in self.assigned.items()
+            if now - worker.last_used > self.settings.idle_ttl and worker.busy == 0
+        ]
+        return [self.assigned.pop(run) for run in evicted]
+
+    def done(self, worker: PythonWorker) -> None:
+        """Mark the execution of a worker returned by `acquire` as finished."""
+
+        with self._lock:
+            worker.busy -= 1
+            worker.last_used = monotonic()
+
+    def release(self, run: str) -> None:
+        """Stop the worker of `run`, and its namespace with it."""
+
+        with self._lock:
+            worker = self.assigned.pop(run, None)
+        if worker is not None:
+            logger.debug(f"Released python worker {worker.pid} of run {run}")
+            worker.stop()
+
+    def _discard(self, run: str, worker: PythonWorker) -> None:
+        with self._lock:
+            if self.assigned.get(run) is worker:
+                del self.assigned[run]
+        worker.stop()
+
+    ###########################################################################
+    # Execution
+    ###########################################################################
+
+    def execute(
+        self, run: str, code: str, file_name: Optional[str] = None, variable_to_return: Optional[str] = None
+    ) -> Execution:
+        """Run `code` in the namespace of `run`."""
+
+        with tracer.span("python_exec", file=file_name) as span:
+            start = perf_counter()
+            worker, warm = self.acquire(run)
+            try:
+                with worker.lock:
+                    first = worker.executions == 0
+                    request = {"code": code, "file_name": file_name, "variable_to_return": variable_to_return}
+                    try:
+                        response = worker.run(request, timeout=self.settings.timeout)
+                    except TimeoutError as e:
+                        self._discard(run, worker)
+                        response = {"ok": False, "error": f"{e}, the namespace of the run was reset"}
+                    except (EOFError, OSError):
+                        self._discard(run, worker)
+                        response = {
+                            "ok": False,
+                            "error": "The python worker stopped (it may have run out of memory or CPU time), "
+                            "the namespace of the run was reset",
+                        }
+                    worker.executions += 1
+            finally:
+                self.done(worker)
+            execution = Execution(**response, latency=perf_counter() - start, first=first, warm=warm)
+
+            with self._lock:
+                if first:
+                    self.first_executions += 1
+                    self.first_latency += execution.latency
+                else:
+                    self.later_executions += 1
+                    self.later_latency += execution.latency
+            span.set(
+                first=first,
+                warm=warm,
+                worker=worker.pid,
+                ok=execution.ok,
+                cpu_time=round(execution.cpu_time, 4),
+                overhead=round(execution.latency - execution.elapsed, 4),
+            )
+            logger.debug(
+                f"Python execution of run {run} took {execution.latency:.4f}s "
+                f"({'first' if first else 'later'} execution, {'warm' if warm else 'cold'} worker)"
+            )
+            return execution
+
+    def install(self, package: str) -> str:
+        """Install `package` in the environment of the workers, through the wheel cache."""
+
+        with tracer.span("pip_install", package=package) as span, self._install_lock:
+            if is_installed(package):
+                span.set(cached=True)
+                return f"Package {package} is already installed"
+            pip = [sys.executable, "-m", "pip"]
+            install = pip + ["install", "--no-index", "--find-links", str(self.wheel_dir), package]
+            # Installed from the cache without reaching the package index if its wheels were downloaded before
+            if subprocess.run(install, capture_output=True, timeout=self.settings.pip_timeout).returncode == 0:
+                span.set(cached=True)
+                return f"successfully installed package {package} from the wheel cache"
+            span.set(cached=False)
+            download = pip + ["wheel", "--wheel-dir", str(self.wheel_dir), "--find-links", str(self.wheel_dir), package]
+            for command in (download, install):
+                result = subprocess.run(command, capture_output=True, text=True, timeout=self.settings.pip_timeout)
+                if result.returncode != 0:
+                    raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "pip failed")
+            return f"successfully installed package {package}"
+
+    ###########################################################################
+    # Stats
+    ###########################################################################
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "idle_workers": len(self.idle),
+                "assigned_workers": len(self.assigned),
+                "workers_started": self.workers_started,
+                "cold_starts": self.cold_starts,
+                "avg_startup_ms": round(self.startup_time / self.workers_started * 1000, 3)
+                if self.workers_started > 0
+                else None,
+                "first_executions": self.first_executions,
+                "avg_first_latency_ms": round(self.first_latency / self.first_executions * 1000, 3)
+                if self.first_executions > 0
+                else None,
+                "later_executions": self.later_executions,
+                "avg_later_latency_ms": round(self.later_latency / self.later_executions * 1000, 3)
+                if self.later_executions > 0
+                else None,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self.closed = True
+            workers = self.idle + list(self.assigned.values())
+            self.idle, self.assigned = [], OrderedDict()
+        for worker in workers:
+            worker.stop()
+        # Workers being started are stopped once ready
+        self.spawn_pool.shutdown(wait=True, cancel_futures=True)
+
+
+class PooledPythonTools(PythonTools):
+    """PythonTools running the code in a worker of a PythonWorkerPool instead of the app process.
+
+    The toolkit is a run of the pool: the code it runs shares one namespace, which is released with the toolkit.
+
+    :param pool: Worker pool shared by the Python Assistants.
+    """
+
+    def __init__(self, pool: PythonWorkerPool, **kwargs: Any):
+        super().__init__(base_dir=pool.base_dir, **kwargs)
+        self.pool = pool
+        self.run = str(uuid4())
+        weakref.finalize(self, pool.release, self.run)
+
+    def format_execution(self, execution: Execution, variable_to_return: Optional[str], success: str) -> str:
+        if not execution.ok:
+            message = f"Error running python code: {execution.error}"
+            return f"{message}\nOutput:\n{execution.output}" if execution.output else message
+        if variable_to_return:
+            return execution.result or ""
+        return f"{success}\nOutput:\n{execution.output}" if execution.output else success
+
+    def save_to_file_and_run(
+        self, file_name: str, code: str, variable_to_return: Optional[str] = None, overwrite: bool = True
+    ) -> str:
+        """This function saves Python code to a file called `file_name` and then runs it.
+        If successful, returns the value of `variable_to_return` if provided otherwise returns a success message.
+        If failed, returns an error message.
+
+        Make sure the file_name ends with `.py`
+
+        :param file_name: The name of the file the code will be saved to.
+        :param code: The code to save and run.
+        :param variable_to_return: The variable to return.
+        :param overwrite: Overwrite the file if it already exists.
+        :return: if run is successful, the value of `variable_to_return` if provided else file name.
+        """
+        try:
+            file_path = self.base_dir.joinpath(file_name)
+            if not file_path.parent.exists():
+                file_path.parent.mkdir(parents=True, exist_ok=True)
+            if file_path.exists() and not overwrite:
+                return f"File {file_name} already exists"
+            file_path.write_text(code)
+            logger.info(f"Running {file_path}")
+            execution = self.pool.execute(self.run, code, str(file_path), variable_to_return)
+            return self.format_execution(execution, variable_to_return, f"successfully ran {file_path}")
+        except Exception as e:
+            logger.error(f"Error saving and running code: {e}")
+            return f"Error saving and running code: {e}"
+
+    def run_python_file_return_variable(self, file_name: str, variable_to_return: Optional[str] = None) -> str:
+        """This function runs code in a Python file.
+        If successful, returns the value of `variable_to_return` if provided otherwise returns a success message.
+        If failed, returns an error message.
+
+        :param file_name: The name of the file to run.
+        :param variable_to_return: The variable to return.
+        :return: if run is successful, the value of `variable_to_return` if provided else file name.
+        """
+        try:
+            file_path = self.base_dir.joinpath(file_name)
+            logger.info(f"Running {file_path}")
+            execution = self.pool.execute(self.run, file_path.read_text(), str(file_path), variable_to_return)
+            return self.format_execution(execution, variable_to_return, f"successfully ran {file_path}")
+        except Exception as e:
+            logger.error(f"Error running file: {e}")
+            return f"Error running file: {e}"
+
+    def run_python_code(self, code: str, variable_to_return: Optional[str] = None) -> str:
+        """This function to runs Python code in the current environment.
+        If successful, returns the value of `variable_to_return` if provided otherwise returns a success message.
+        If failed, returns an error message.
+
+        Returns the value of `variable_to_return` if successful, otherwise returns an error message.
+
+        :param code: The code to run.
+        :param variable_to_return: The variable to return.
+        :return: value of `variable_to_return` if successful, otherwise returns an error message.
+        """
+        try:
+            execution = self.pool.execute(self.run, code, variable_to_return=variable_to_return)
+            return self.format_execution(execution, variable_to_return, "successfully ran python code")
+        except Exception as e:
+            logger.error(f"Error running python code: {e}")
+            return f"Error running python code: {e}"
+
+    def pip_install_package(self, package_name: str) -> str:
+        """This function installs a package using pip in the current environment.
+        If successful, returns a success message.
+        If failed, returns an error message.
+
+        :param package_name: The name of the package to install.
+        :return: success message if successful, otherwise returns an error message.
+        """
+        try:
+            logger.debug(f"Installing package {package_name}")
+            return self.pool.install(package_name)
+        except Exception as e:
+            logger.error(f"Error installing package {package_name}: {e}")
+            return f"Error installing package {package_name}: {e}"
@@ -0,0 +1,109 @@
+from concurrent.futures import Future
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from phi.utils.log import logger
+from phi.utils.timer import Timer
+
+
+class ResourcePool:
+    """Process-wide cache for the immutable parts of the LLM OS.
+
+    LLM clients, the embedder, the vector db, the storage and the toolkits do not hold any
+    per-run state, so they are built once per key and shared across sessions.
+    Assistants (which hold the run_id, user_id and memory) are always built fresh.
+
+    Resources are built outside the pool lock, so a slow build only blocks the callers waiting for the same key.
+    """
+
+    def __init__(self):
+        self._resources: Dict[Hashable, Any] = {}
+        # key -> result of the build in progress, shared by the callers that ask for the key meanwhile
+        self._building: Dict[Hashable, Future] = {}
+        self._lock = Lock()
+        # Cache counters
+        self.hits: int = 0
+        self.misses: int = 0
+        # Time spent building resources on a cache miss
+        self.build_time: float = 0.0
+        # Number of get_llm_os calls and the time spent in them
+        self.constructions: int = 0
+        self.construction_time: float = 0.0
+        self.last_construction_time: Optional[float] = None
+
+    def get(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """Return the resource for `key`, building it with `factory` on the first call."""
+
+        with self._lock:
+            if key in self._resources:
+                self.hits += 1
+                return self._resources[key]
+            building = self._building.get(key)
+            if building is None:
+                self.misses += 1
+                build: Future = Future()
+                self._building[key] = build
+            else:
+                self.hits += 1
+        if building is not None:
+            # Another thread is building it, raises if that build fails
+            return building.result()
+
+        build_timer = Timer()
+        build_timer.start()
+        try:
+            resource = factory()
+        except BaseException as e:
+            with self._lock:
+                del self._building[key]
+            build.set_exception(e)
+            raise
+        build_timer.stop()
+        with self._lock:
+            self.build_time += build_timer.elapsed
+            self._resources[key] = resource
+            del self._building[key]
+        build.set_result(resource)
+        logger.debug(f"Built resource {key} in {build_timer.elapsed:.4f}s")
+        return resource
+
+    def record_construction(self, elapsed: float) -> None:
+        with self._lock:
+            self.constructions += 1
+            self.construction_time += elapsed
+            self.last_construction_time = elapsed
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "resources": len(self._resources),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hit_rate, 4),
+                "build_time": round(self.build_time, 4),
+                "constructions": self.constructions,
+                "last_construction_time": round(self.last_construction_time, 4)
+                if self.last_construction_time is not None
+                else None,
+                "avg_construction_time": round(self.construction_time / self.constructions, 4)
+                if self.constructions > 0
+                else None,
+            }
+
+    def clear(self, key: Optional[Hashable] = None) -> None:
+        """Drop one cached resource, or all of them if no key is provided."""
+
+        with self._lock:
+            if key is None:
+                self._resources.clear()
+            else:
+                self._resources.pop(key, None)
+
+
+# Shared by every get_llm_os call in this process
+resource_pool = ResourcePool()
@@ -0,0 +1,117 @@
+"""Code execution loop of a Python worker process, started by PythonWorkerPool (see python_workers.py).
+
+Usage:
+    python sandbox.py <read_fd> <write_fd> <settings_json>
+
+The worker imports the preloaded libraries, applies the memory limit and reports ready, then runs the code it
+receives in one persistent namespace, so variables, functions and imports are kept between executions. Only the
+standard library is imported here, the worker starts with what it preloads and nothing else.
+"""
+
+import contextlib
+import importlib
+import io
+import json
+import os
+import resource
+import signal
+import sys
+import traceback
+from multiprocessing.connection import Connection
+from time import perf_counter
+from typing import Any, Dict
+
+
+class CPUTimeExceeded(Exception):
+    pass
+
+
+def on_cpu_limit(signum: int, frame: Any) -> None:
+    raise CPUTimeExceeded("CPU time limit exceeded")
+
+
+def get_cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def truncate(output: str, max_chars: int) -> str:
+    if len(output) <= max_chars:
+        return output
+    return output[:max_chars] + f"\n... [truncated {len(output) - max_chars} characters]"
+
+
+def execute(namespace: Dict[str, Any], request: Dict[str, Any], settings: Dict[str, Any]) -> Dict[str, Any]:
+    code: str = request["code"]
+    file_name = request.get("file_name")
+    variable_to_return = request.get("variable_to_return")
+    max_chars: int = settings["output_chars"]
+
+    # Packages installed since the last execution can be imported
+    importlib.invalidate_caches()
+    output = io.StringIO()
+    start, cpu_start = perf_counter(), get_cpu_time()
+    # The CPU limit applies to this execution: the soft limit is moved past the CPU time used so far
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_CPU)
+    soft_limit = int(cpu_start) + int(settings["cpu_seconds"]) + 1
+    if hard_limit != resource.RLIM_INFINITY:
+        soft_limit = min(soft_limit, hard_limit)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft_limit, hard_limit))
+    response: Dict[str, Any] = {"ok": True}
+    try:
+        namespace["__name__"] = "__main__"
+        namespace["__file__"] = file_name or "<python_assistant>"
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            exec(compile(code, file_name or "<python_assistant>", "exec"), namespace)
+        if variable_to_return:
+            if namespace.get(variable_to_return) is None:
+                response["result"] = f"Variable {variable_to_return} not found"
+            else:
+                response["result"] = truncate(str(namespace[variable_to_return]), max_chars)
+    except (Exception, SystemExit) as e:
+        response["ok"] = False
+        # The traceback starts at the executed code, without the frame of this loop
+        lines = traceback.format_exception(type(e), e, e.__traceback__.tb_next if e.__traceback__ else None)
+        response["error"] = truncate("".join(lines).strip(), max_chars)
+    finally:
+        resource.setrlimit(resource.RLIMIT_CPU, (hard_limit, hard_limit))
+    response["output"] = truncate(output.getvalue(), max_chars)
+    response["elapsed"] = perf_counter() - start
+    response["cpu_time"] = get_cpu_time() - cpu_start
+    return response
+
+
+def main(read_fd: int, write_fd: int, settings: Dict[str, Any]) -> None:
+    start = perf_counter()
+    reader, writer = Connection(read_fd, writable=False), Connection(write_fd, readable=False)
+    # Files saved by the assistant in the working directory can be imported
+    sys.path.insert(0, os.getcwd())
+    imported = []
+    for module in settings["preimport"]:
+        try:
+            importlib.import_module(module)
+            imported.append(module)
+        except Exception:
+            pass
+    # The memory limit covers the preloaded libraries, which are part of every execution
+    if settings.get("memory_mb"):
+        limit = int(settings["memory_mb"]) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    signal.signal(signal.SIGXCPU, on_cpu_limit)
+    namespace: Dict[str, Any] = {"__builtins__": __builtins__}
+    writer.send({"ready": True, "pid": os.getpid(), "imported": imported, "startup": perf_counter() - start})
+
+    while True:
+        try:
+            request = reader.recv()
+        except EOFError:
+            break
+        try:
+            response = execute(namespace, request, settings)
+        except MemoryError:
+            response = {"ok": False, "error": "MemoryError: memory limit exceeded", "output": ""}
+        writer.send(response)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]), int(sys.argv[2]), json.loads(sys.argv[3]))
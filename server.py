@@ -0,0 +1,529 @@
+"""Headless HTTP API for the LLM OS, serving many concurrent clients from one process.
+
+Usage:
+    LLM_OS_SERVER_API_TOKEN=... python server.py --port 8000
+
+Clients send the token as `Authorization: Bearer <token>`. The server listens on 127.0.0.1 unless given `--host`.
+
+Endpoints:
+    POST /v1/runs                      {"user_id": "...", "options": {"ddg_search": true, ...}} -> {"run_id": "..."}
+    GET  /v1/runs                      ?user_id=&search=&limit=&offset= -> {"run_ids": [...]}
+    POST /v1/runs/<run_id>/messages    {"message": "..."} -> text/event-stream of {"delta": "..."} (and `event: shell`
+                                       with the output of shell commands as they run), then `event: done`
+    POST /v1/runs/<run_id>/cancel      Stops the response being generated for the run
+    POST /v1/knowledge/urls            {"url": "...", "max_pages": 50} -> ingestion job
+    POST /v1/knowledge/pdfs?name=...   PDF bytes as the request body -> ingestion job
+    GET  /v1/knowledge/jobs/<job_id>   -> ingestion job
+    GET  /v1/stats                     -> server and resource pool statistics
+    GET  /metrics                      -> turn timings and token counts in the Prometheus text format
+"""
+
+import argparse
+import asyncio
+import hmac
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from os import getenv
+from threading import Event, Lock
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+import tornado.web
+from pydantic import BaseModel
+from tornado.iostream import StreamClosedError
+
+from phi.assistant import Assistant
+from phi.utils.log import logger
+
+from ingestion import IngestionJob, IngestionQueue  # type: ignore
+from resources import resource_pool  # type: ignore
+from shell_tools import ShellEvent, stream_shell_output  # type: ignore
+from storage import PgRunStorage  # type: ignore
+from tracing import tracer  # type: ignore
+
+# get_llm_os flags a client can set when creating a run
+llm_os_options = [
+    "calculator",
+    "ddg_search",
+    "file_tools",
+    "shell_tools",
+    "data_analyst",
+    "python_assistant",
+    "research_assistant",
+    "investment_assistant",
+    "parallel_tool_calls",
+]
+
+# Options that run commands, code or file operations on the host, off unless the operator allows them
+host_access_options = ["file_tools", "shell_tools", "python_assistant"]
+
+# Builds the assistant for a run: (run_id, user_id, options) -> Assistant
+AssistantFactory = Callable[[Optional[str], Optional[str], Dict[str, Any]], Assistant]
+
+
+class ServerSettings(BaseModel):
+    """Limits of the API server."""
+
+    # Number of responses generated at the same time, each one holds a worker thread
+    max_concurrent_runs: int = int(getenv("LLM_OS_SERVER_MAX_RUNS", "32"))
+    # Number of responses waiting for a worker, requests above this are rejected with a 503
+    max_queued_runs: int = int(getenv("LLM_OS_SERVER_MAX_QUEUED_RUNS", "64"))
+    # Number of chunks buffered per response, the LLM stream is paused while a slow client catches up
+    stream_buffer: int = int(getenv("LLM_OS_SERVER_STREAM_BUFFER", "64"))
+    # Number of assistants kept in memory, others are rebuilt from storage
+    max_sessions: int = int(getenv("LLM_OS_SERVER_MAX_SESSIONS", "256"))
+    # Seconds an assistant waits for a parallel tool call or team delegation
+    tool_call_timeout: float = float(getenv("LLM_OS_SERVER_TOOL_CALL_TIMEOUT", "120"))
+    # Options clients can enable when creating a run, comma separated
+    allowed_options: List[str] = [
+        option.strip()
+        for option in getenv(
+            "LLM_OS_SERVER_ALLOWED_OPTIONS",
+            ",".join(option for option in llm_os_options if option not in host_access_options),
+        ).split(",")
+        if option.strip()
+    ]
+    # Token clients send as `Authorization: Bearer <token>`, the API is open to any client when it is not set
+    api_token: Optional[str] = getenv("LLM_OS_SERVER_API_TOKEN") or None
+
+
+class RunNotFound(Exception):
+    pass
+
+
+class OptionNotAllowed(Exception):
+    pass
+
+
+class LLMOSServer:
+    """Creates runs, streams responses and loads documents for API clients.
+
+    Responses are generated by the (synchronous) assistants on a bounded thread pool and bridged to the event loop
+    through a bounded queue per response. A response is cancelled when its client disconnects or calls the cancel
+    endpoint: the LLM stream is closed, which also closes the request to the LLM provider.
+
+    :param assistant_factory: Builds the assistant for a run, defaults to get_llm_os.
+    :param storage: Storage used to list runs and rebuild assistants that are not in memory.
+    :param ingestion_queue: Queue documents are loaded with, defaults to the LLM OS ingestion queue.
+    """
+
+    def __init__(
+        self,
+        assistant_factory: Optional[AssistantFactory] = None,
+        storage: Optional[PgRunStorage] = None,
+        ingestion_queue: Optional[IngestionQueue] = None,
+        settings: ServerSettings = ServerSettings(),
+    ):
+        self.assistant_factory: AssistantFactory = assistant_factory or get_llm_os_assistant
+        self.storage = storage
+        self._ingestion_queue = ingestion_queue
+        self.settings = settings
+        self.run_pool = ThreadPoolExecutor(max_workers=settings.max_concurrent_runs, thread_name_prefix="llm-os-run")
+
+        self._lock = Lock()
+        # run_id -> assistant, least recently used first
+        self.sessions: "OrderedDict[str, Assistant]" = OrderedDict()
+        # run_id -> cancel event of the response being generated
+        self.active_runs: Dict[str, Event] = {}
+        # Responses being generated or waiting for a worker
+        self.pending_runs: int = 0
+        # Server counters
+        self.messages: int = 0
+        self.cancelled: int = 0
+        self.rejected: int = 0
+
+    @property
+    def ingestion_queue(self) -> IngestionQueue:
+        if self._ingestion_queue is None:
+            from assistant import get_ingestion_queue  # type: ignore
+
+            self._ingestion_queue = get_ingestion_queue()
+        return self._ingestion_queue
+
+    ###########################################################################
+    # Runs
+    ###########################################################################
+
+    def remember(self, assistant: Assistant) -> None:
+        with self._lock:
+            self.sessions[assistant.run_id] = assistant  # type: ignore
+            self.sessions.move_to_end(assistant.run_id)  # type: ignore
+            while len(self.sessions) > self.settings.max_sessions:
+                self.sessions.popitem(last=False)
+
+    def create_run(self, user_id: Optional[str], options: Dict[str, Any]) -> str:
+        options = {key: bool(value) for key, value in options.items() if key in llm_os_options}
+        not_allowed = [key for key, value in options.items() if value and key not in self.settings.allowed_options]
+        if len(not_allowed) > 0:
+            raise OptionNotAllowed(", ".join(not_allowed))
+        assistant = self.assistant_factory(None, user_id, options)
+        # The options are stored with the run, so the assistant can be rebuilt by any server process
+        assistant.run_data = {**(assistant.run_data or {}), "llm_os_options": options}
+        assistant.create_run()
+        self.remember(assistant)
+        return assistant.run_id  # type: ignore
+
+    def get_assistant(self, run_id: str) -> Assistant:
+        with self._lock:
+            assistant = self.sessions.get(run_id)
+            if assistant is not None:
+                self.sessions.move_to_end(run_id)
+                return assistant
+
+        # The messages are read when the assistant loads the run
+        row = self.storage.read(run_id, messages=False) if self.storage is not None else None
+        if row is None:
+            raise RunNotFound(run_id)
+        options = (row.run_data or {}).get("llm_os_options", {})
+        # Options the operator disallowed since the run was created are not enabled again
+        options = {key: value for key, value in options.items() if key in self.settings.allowed_options}
+        assistant = self.assistant_factory(run_id, row.user_id, options)
+        # Loads the memory of the run
+        assistant.create_run()
+        self.remember(assistant)
+        return assistant
+
+    def get_run_ids(self, user_id: Optional[str], search: Optional[str], limit: int, offset: int) -> List[str]:
+        if self.storage is not None:
+            return self.storage.get_run_ids(user_id=user_id, limit=limit, offset=offset, search=search)
+        with self._lock:
+            run_ids = [
+                run_id
+                for run_id, assistant in reversed(self.sessions.items())
+                if (user_id is None or assistant.user_id == user_id) and (not search or search in run_id)
+            ]
+        return run_ids[offset : offset + limit]
+
+    ###########################################################################
+    # Messages
+    ###########################################################################
+
+    def start_message(self, run_id: str) -> Event:
+        """Reserve a worker for a response, raises an HTTPError if the run is busy or the server is overloaded."""
+
+        with self._lock:
+            if run_id in self.active_runs:
+                raise tornado.web.HTTPError(409, reason="A response is already being generated for this run")
+            if self.pending_runs >= self.settings.max_concurrent_runs + self.settings.max_queued_runs:
+                self.rejected += 1
+                raise tornado.web.HTTPError(503, reason="Too many responses in progress")
+            cancel = Event()
+            self.active_runs[run_id] = cancel
+            self.pending_runs += 1
+            self.messages += 1
+        return cancel
+
+    def cancel_message(self, run_id: str) -> bool:
+        with self._lock:
+            cancel = self.active_runs.get(run_id)
+        if cancel is None:
+            return False
+        cancel.set()
+        return True
+
+    async def stream_message(self, run_id: str, message: str, cancel: Event) -> AsyncIterator[Any]:
+        """Yield the response to `message`, and the ShellEvents of its shell commands.
+
+        The run must be reserved with start_message.
+        """
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.settings.stream_buffer)
+        done = object()
+
+        def put(item: Any) -> bool:
+            # Wait while the queue is full, the client is reading slower than the LLM writes
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            while True:
+                try:
+                    future.result(timeout=0.5)
+                    return True
+                except TimeoutError:
+                    if cancel.is_set():
+                        future.cancel()
+                        return False
+
+        def generate() -> None:
+            try:
+                if cancel.is_set():
+                    return
+                # The output of shell commands is sent to the client while they run
+                with tracer.trace("turn", run_id=run_id), stream_shell_output(put):
+                    assistant = self.get_assistant(run_id)
+                    stream = assistant.run(message, stream=True)
+                    try:
+                        for chunk in stream:  # type: ignore
+                            if cancel.is_set() or not put(chunk):
+                                break
+                    finally:
+                        # Closes the LLM stream if the response was cancelled
+                        stream.close()  # type: ignore
+            except Exception as e:
+                logger.error(f"Could not generate a response for run {run_id}: {e}")
+                put(e)
+            finally:
+                with self._lock:
+                    self.active_runs.pop(run_id, None)
+                    self.pending_runs -= 1
+                    if cancel.is_set():
+                        self.cancelled += 1
+                if not cancel.is_set():
+                    put(done)
+                else:
+                    # The remaining chunks are dropped, the consumer only needs to stop waiting
+                    loop.call_soon_threadsafe(finish_cancelled)
+
+        def finish_cancelled() -> None:
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(done)
+
+        loop.run_in_executor(self.run_pool, generate)
+        complete = False
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    complete = True
+                    return
+                if isinstance(item, Exception):
+                    complete = True
+                    raise item
+                yield item
+        finally:
+            # Stops the response if the client went away before it was complete
+            if not complete:
+                cancel.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": len(self.sessions),
+                "active_runs": len(self.active_runs),
+                "pending_runs": self.pending_runs,
+                "messages": self.messages,
+                "cancelled": self.cancelled,
+                "rejected": self.rejected,
+                "resource_pool": resource_pool.stats(),
+            }
+
+    ###########################################################################
+    # Application
+    ###########################################################################
+
+    def make_app(self) -> tornado.web.Application:
+        return tornado.web.Application(
+            [
+                (r"/v1/runs", RunsHandler),
+                (r"/v1/runs/([^/]+)/messages", MessagesHandler),
+                (r"/v1/runs/([^/]+)/cancel", CancelHandler),
+                (r"/v1/knowledge/urls", KnowledgeUrlsHandler),
+                (r"/v1/knowledge/pdfs", KnowledgePdfsHandler),
+                (r"/v1/knowledge/jobs/([^/]+)", KnowledgeJobHandler),
+                (r"/v1/stats", StatsHandler),
+                (r"/metrics", MetricsHandler),
+            ],
+            server=self,
+        )
+
+
+def get_llm_os_assistant(run_id: Optional[str], user_id: Optional[str], options: Dict[str, Any]) -> Assistant:
+    from assistant import get_llm_os  # type: ignore
+
+    return get_llm_os(
+        run_id=run_id,
+        user_id=user_id,
+        debug_mode=False,
+        tool_call_timeout=ServerSettings().tool_call_timeout,
+        **options,
+    )
+
+
+###########################################################################
+# Handlers
+###########################################################################
+
+
+class BaseHandler(tornado.web.RequestHandler):
+    @property
+    def server(self) -> LLMOSServer:
+        return self.settings["server"]
+
+    def prepare(self) -> None:
+        api_token = self.server.settings.api_token
+        if api_token is None:
+            return
+        authorization = self.request.headers.get("Authorization", "")
+        if not hmac.compare_digest(authorization.encode(), f"Bearer {api_token}".encode()):
+            raise tornado.web.HTTPError(401, reason="A valid bearer token is required")
+
+    def get_json_body(self) -> Dict[str, Any]:
+        if not self.request.body:
+            return {}
+        try:
+            body = json.loads(self.request.body)
+        except json.JSONDecodeError:
+            raise tornado.web.HTTPError(400, reason="Request body is not valid JSON")
+        if not isinstance(body, dict):
+            raise tornado.web.HTTPError(400, reason="Request body must be a JSON object")
+        return body
+
+    def get_int_argument(self, name: str, value: Any, minimum: int = 0) -> Optional[int]:
+        """Parse an integer query or body argument, raises a 400 HTTPError if it is not one."""
+        if value is None:
+            return None
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            raise tornado.web.HTTPError(400, reason=f"{name} must be an integer")
+        if isinstance(value, float) and value != number:
+            raise tornado.web.HTTPError(400, reason=f"{name} must be an integer")
+        if number < minimum:
+            raise tornado.web.HTTPError(400, reason=f"{name} must be at least {minimum}")
+        return number
+
+    def write_error(self, status_code: int, **kwargs: Any) -> None:
+        if status_code == 503:
+            self.set_header("Retry-After", "1")
+        if status_code == 401:
+            self.set_header("WWW-Authenticate", "Bearer")
+        self.finish({"error": self._reason})
+
+    async def run_blocking(self, function: Callable, *args: Any) -> Any:
+        # Storage and ingestion calls block, so they run off the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+class RunsHandler(BaseHandler):
+    async def post(self) -> None:
+        body = self.get_json_body()
+        options = body.get("options") or {}
+        if not isinstance(options, dict):
+            raise tornado.web.HTTPError(400, reason="options must be a JSON object")
+        try:
+            run_id = await self.run_blocking(self.server.create_run, body.get("user_id"), options)
+        except OptionNotAllowed as e:
+            raise tornado.web.HTTPError(403, reason=f"Options not allowed on this server: {e}")
+        self.set_status(201)
+        self.write({"run_id": run_id})
+
+    async def get(self) -> None:
+        limit = min(self.get_int_argument("limit", self.get_query_argument("limit", "20"), minimum=1), 100)
+        offset = self.get_int_argument("offset", self.get_query_argument("offset", "0"))
+        run_ids = await self.run_blocking(
+            self.server.get_run_ids,
+            self.get_query_argument("user_id", None),
+            self.get_query_argument("search", None),
+            limit,
+            offset,
+        )
+        self.write({"run_ids": run_ids})
+
+
+class MessagesHandler(BaseHandler):
+    cancel: Optional[Event] = None
+
+    async def post(self, run_id: str) -> None:
+        message = self.get_json_body().get("message")
+        if not message:
+            raise tornado.web.HTTPError(400, reason="message is required")
+        if run_id not in self.server.sessions:
+            try:
+                await self.run_blocking(self.server.get_assistant, run_id)
+            except RunNotFound:
+                raise tornado.web.HTTPError(404, reason="Run not found")
+
+        self.cancel = self.server.start_message(run_id)
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        try:
+            async for delta in self.server.stream_message(run_id, message, self.cancel):
+                if isinstance(delta, ShellEvent):
+                    event = delta.model_dump(exclude_none=True, exclude={"result": {"stdout", "stderr"}})
+                    self.write(f"event: shell\ndata: {json.dumps(event)}\n\n")
+                else:
+                    self.write(f"data: {json.dumps({'delta': delta})}\n\n")
+                await self.flush()
+            self.write("event: cancelled\ndata: {}\n\n" if self.cancel.is_set() else "event: done\ndata: {}\n\n")
+        except StreamClosedError:
+            self.cancel.set()
+            return
+        except Exception as e:
+            self.write(f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n")
+        self.finish()
+
+    def on_connection_close(self) -> None:
+        if self.cancel is not None:
+            self.cancel.set()
+
+
+class CancelHandler(BaseHandler):
+    def post(self, run_id: str) -> None:
+        self.write({"cancelled": self.server.cancel_message(run_id)})
+
+
+def job_to_dict(job: IngestionJob) -> Dict[str, Any]:
+    return {**job.model_dump(), "progress": round(job.progress, 4), "stats": job.stats()}
+
+
+class KnowledgeUrlsHandler(BaseHandler):
+    async def post(self) -> None:
+        body = self.get_json_body()
+        if not body.get("url"):
+            raise tornado.web.HTTPError(400, reason="url is required")
+        max_pages = self.get_int_argument("max_pages", body.get("max_pages"), minimum=1)
+        max_depth = self.get_int_argument("max_depth", body.get("max_depth"))
+        job = await self.run_blocking(self.server.ingestion_queue.submit_url, body["url"], max_pages, max_depth)
+        self.set_status(202)
+        self.write(job_to_dict(job))
+
+
+class KnowledgePdfsHandler(BaseHandler):
+    async def post(self) -> None:
+        name = self.get_query_argument("name", None)
+        if not name or not self.request.body:
+            raise tornado.web.HTTPError(400, reason="name and a PDF body are required")
+        job = await self.run_blocking(self.server.ingestion_queue.submit_pdf, self.request.body, name)
+        self.set_status(202)
+        self.write(job_to_dict(job))
+
+
+class KnowledgeJobHandler(BaseHandler):
+    def get(self, job_id: str) -> None:
+        for job in self.server.ingestion_queue.get_jobs():
+            if job.job_id == job_id:
+                self.write(job_to_dict(job))
+                return
+        raise tornado.web.HTTPError(404, reason="Job not found")
+
+
+class StatsHandler(BaseHandler):
+    def get(self) -> None:
+        self.write(self.server.stats())
+
+
+class MetricsHandler(BaseHandler):
+    def get(self) -> None:
+        # Prometheus text format, turns are only traced when LLM_OS_TRACING is true
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(tracer.metrics.render())
+
+
+async def serve(host: str, port: int) -> None:
+    from assistant import get_storage  # type: ignore
+
+    settings = ServerSettings()
+    if settings.api_token is None:
+        raise SystemExit("Set LLM_OS_SERVER_API_TOKEN, clients send it as `Authorization: Bearer <token>`")
+    server = LLMOSServer(storage=get_storage(), settings=settings)
+    server.make_app().listen(port, address=host, max_body_size=100 * 1024 * 1024)
+    logger.info(f"LLM OS API listening on http://{host}:{port}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the LLM OS over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
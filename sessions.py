@@ -0,0 +1,150 @@
+from os import getenv
+from threading import Lock
+from typing import Any, Dict, Hashable, Optional
+from uuid import uuid4
+
+from pydantic import BaseModel, Field, field_validator
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.schema import Column, MetaData, Table
+from sqlalchemy.sql.expression import select, text
+from sqlalchemy.types import DateTime, String
+
+from phi.utils.log import logger
+
+
+class SessionSettings(BaseModel):
+    """Settings of the app sessions kept in memory."""
+
+    # Assistants kept in memory by each app process, the least recently used one is dropped first
+    max_assistants: int = int(getenv("LLM_OS_APP_MAX_ASSISTANTS", "64"))
+    # Seconds an assistant is kept in memory after its session was last used
+    idle_ttl: float = float(getenv("LLM_OS_APP_SESSION_IDLE_TTL", str(30 * 60)))
+
+
+class IngestedSource(BaseModel):
+    """The last ingestion of a document by a session."""
+
+    name: str
+    job_id: str
+    # queued, done or failed: the outcome is recorded when the job finishes
+    status: str = "queued"
+    error: Optional[str] = None
+    finished_at: Optional[float] = None
+
+
+class SessionDescriptor(BaseModel):
+    """Everything needed to rebuild the LLM OS of an app session, in any app process.
+
+    The assistant itself is rebuilt with get_llm_os from the flags and the run_id, and loads its memory from the run
+    storage. The ingestion registry keeps a document from being loaded twice by the same session, in any process.
+    """
+
+    session_id: str = Field(default_factory=lambda: uuid4().hex)
+    llm_id: str = "claude-3-5-sonnet-20240620"
+    run_id: Optional[str] = None
+    user_id: Optional[str] = None
+    # get_llm_os flag -> enabled
+    options: Dict[str, bool] = {}
+    # Document (url:<url> or pdf:<sha256 of the file>) -> its last ingestion
+    ingested: Dict[str, IngestedSource] = {}
+
+    @field_validator("ingested", mode="before")
+    @classmethod
+    def upgrade_ingested(cls, ingested: Dict[str, Any]) -> Dict[str, Any]:
+        # Sessions saved before the outcome was recorded only have the job id, those documents were submitted once
+        return {
+            key: {"name": key.split(":", 1)[-1], "job_id": value, "status": "done"} if isinstance(value, str) else value
+            for key, value in (ingested or {}).items()
+        }
+
+    def assistant_key(self) -> Hashable:
+        """Key of the assistant built from this descriptor, it changes when the assistant has to be rebuilt."""
+        return (self.session_id, self.llm_id, self.run_id, tuple(sorted(self.options.items())))
+
+
+class PgSessionStore:
+    """Session descriptors stored in a postgres table next to the runs, so a session can continue in any process."""
+
+    def __init__(self, db_engine: Engine, table_name: str = "llm_os_sessions", schema: Optional[str] = "ai"):
+        self.table_name: str = table_name
+        self.schema: Optional[str] = schema
+        self.db_engine: Engine = db_engine
+        self.metadata: MetaData = MetaData(schema=self.schema)
+        self.Session: sessionmaker[Session] = sessionmaker(bind=self.db_engine)
+        self.table: Table = Table(
+            self.table_name,
+            self.metadata,
+            Column("session_id", String, primary_key=True),
+            Column("run_id", String),
+            Column("user_id", String),
+            Column("descriptor", postgresql.JSONB),
+            Column("created_at", DateTime(timezone=True), server_default=text("now()")),
+            Column("updated_at", DateTime(timezone=True), server_default=text("now()"), onupdate=text("now()")),
+            extend_existing=True,
+        )
+        self._lock = Lock()
+        self._created: bool = False
+
+    def create(self) -> None:
+        with self._lock:
+            if self._created:
+                return
+            if not inspect(self.db_engine).has_table(self.table_name, schema=self.schema):
+                if self.schema is not None:
+                    with self.Session() as sess, sess.begin():
+                        sess.execute(text(f"create schema if not exists {self.schema};"))
+                logger.debug(f"Creating table: {self.table_name}")
+                self.table.create(self.db_engine, checkfirst=True)
+            self._created = True
+
+    def get(self, session_id: str) -> Optional[SessionDescriptor]:
+        self.create()
+        with self.Session() as sess, sess.begin():
+            row = sess.execute(select(self.table.c.descriptor).where(self.table.c.session_id == session_id)).first()
+        if row is None:
+            return None
+        return SessionDescriptor.model_validate(row.descriptor)
+
+    def save(self, descriptor: SessionDescriptor) -> None:
+        self.create()
+        row: Dict[str, Any] = {
+            "session_id": descriptor.session_id,
+            "run_id": descriptor.run_id,
+            "user_id": descriptor.user_id,
+            "descriptor": descriptor.model_dump(),
+        }
+        stmt = postgresql.insert(self.table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["session_id"],
+            set_=dict(
+                run_id=stmt.excluded.run_id,
+                user_id=stmt.excluded.user_id,
+                descriptor=stmt.excluded.descriptor,
+                updated_at=text("now()"),
+            ),
+        )
+        with self.Session() as sess, sess.begin():
+            sess.execute(stmt, row)
+
+    def set_ingested(self, session_id: str, key: str, source: IngestedSource) -> None:
+        """Record the outcome of an ingestion job, unless the session submitted the document again since."""
+
+        self.create()
+        with self.Session() as sess, sess.begin():
+            sess.execute(
+                text(
+                    f"UPDATE {self.table.fullname} "
+                    "SET descriptor = jsonb_set(descriptor, ARRAY['ingested', :key], CAST(:source AS jsonb)), "
+                    "updated_at = now() "
+                    "WHERE session_id = :session_id AND descriptor -> 'ingested' -> :key ->> 'job_id' = :job_id"
+                ),
+                {"session_id": session_id, "key": key, "source": source.model_dump_json(), "job_id": source.job_id},
+            )
+
+    def delete(self, session_id: str) -> None:
+        self.create()
+        with self.Session() as sess, sess.begin():
+            sess.execute(self.table.delete().where(self.table.c.session_id == session_id))
@@ -0,0 +1,447 @@
+import asyncio
+import atexit
+import codecs
+import json
+import os
+import shlex
+import signal
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from os import getenv
+from pathlib import Path
+from queue import SimpleQueue
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Union
+
+from pydantic import BaseModel
+from phi.tools import Toolkit
+from phi.utils.log import logger
+
+from tracing import tracer  # type: ignore
+
+
+class ShellSettings(BaseModel):
+    """Shell tools settings."""
+
+    # Seconds a command can run before it is stopped
+    timeout: float = float(getenv("LLM_OS_SHELL_TIMEOUT", "60"))
+    # Seconds between asking a command to stop and killing it
+    kill_grace: float = float(getenv("LLM_OS_SHELL_KILL_GRACE", "2"))
+    # Characters of output sent to the assistant per command, the start and the end of longer outputs are kept
+    output_chars: int = int(getenv("LLM_OS_SHELL_OUTPUT_CHARS", "8000"))
+    # Bytes of output kept in memory per command and stream, the middle of longer outputs is only counted
+    max_output_bytes: int = int(getenv("LLM_OS_SHELL_MAX_OUTPUT_BYTES", str(1024 * 1024)))
+    # Commands running at the same time in the process, the others wait for a slot
+    max_concurrent: int = int(getenv("LLM_OS_SHELL_MAX_CONCURRENT", "4"))
+
+
+class ShellEvent(BaseModel):
+    """Progress of a command, sent to the output sink of the turn while the command runs."""
+
+    command_id: int
+    # "start", "stdout", "stderr" or "end"
+    kind: str
+    command: str = ""
+    text: str = ""
+    result: Optional["CommandResult"] = None
+
+
+class CommandResult(BaseModel):
+    """The outcome of a shell command."""
+
+    command: str
+    returncode: Optional[int] = None
+    stdout: str = ""
+    stderr: str = ""
+    # Bytes the command wrote, including the bytes that were not kept
+    stdout_bytes: int = 0
+    stderr_bytes: int = 0
+    # Part of the output was dropped to stay within max_output_bytes
+    truncated: bool = False
+    timed_out: bool = False
+    error: Optional[str] = None
+    # Seconds waiting for a slot, and seconds from the start of the command to its exit
+    queued: float = 0.0
+    elapsed: float = 0.0
+
+
+ShellEvent.model_rebuild()
+
+# Receives the events of the commands run in this context, see stream_shell_output
+_output_sink: ContextVar[Optional[Callable[[ShellEvent], None]]] = ContextVar("llm_os_shell_output", default=None)
+
+
+@contextmanager
+def stream_shell_output(sink: Callable[[ShellEvent], None]) -> Iterator[None]:
+    """Send the output of the shell commands run in this context (like a turn) to `sink` as it is written.
+
+    The sink is called from the thread that called the tool, which is a tool call thread when tool calls run in
+    parallel, so it has to be thread safe.
+    """
+
+    token = _output_sink.set(sink)
+    try:
+        yield
+    finally:
+        _output_sink.reset(token)
+
+
+class OutputBuffer:
+    """The output of a command stream, keeping its first and last bytes up to `max_bytes` and counting the rest."""
+
+    def __init__(self, max_bytes: int):
+        self.head_bytes: int = max_bytes // 4
+        self.tail_bytes: int = max_bytes - self.head_bytes
+        self.head = bytearray()
+        self.tail: Deque[bytes] = deque()
+        self.tail_size: int = 0
+        self.total: int = 0
+
+    def write(self, data: bytes) -> None:
+        self.total += len(data)
+        if len(self.head) < self.head_bytes:
+            taken = data[: self.head_bytes - len(self.head)]
+            self.head.extend(taken)
+            data = data[len(taken) :]
+        if not data:
+            return
+        self.tail.append(data)
+        self.tail_size += len(data)
+        while self.tail_size - len(self.tail[0]) >= self.tail_bytes:
+            self.tail_size -= len(self.tail.popleft())
+
+    @property
+    def dropped(self) -> int:
+        return self.total - len(self.head) - self.tail_size
+
+    def text(self) -> str:
+        head = self.head.decode(errors="replace")
+        tail = b"".join(self.tail)
+        if self.dropped <= 0:
+            return (bytes(self.head) + tail).decode(errors="replace")
+        # The tail starts within a chunk, drop its partial first line
+        tail = tail[-self.tail_bytes :]
+        tail = tail[tail.find(b"\n") + 1 :] if b"\n" in tail else tail
+        return f"{head}\n[... {self.dropped} bytes not kept ...]\n{tail.decode(errors='replace')}"
+
+
+def truncate_output(text: str, max_chars: int, max_lines: Optional[int] = None) -> str:
+    """Keep the last `max_lines` lines of an output, and its start and end when it is longer than `max_chars`."""
+
+    if max_lines is not None and max_lines > 0:
+        lines = text.split("\n")
+        if len(lines) > max_lines:
+            text = f"[... {len(lines) - max_lines} lines truncated ...]\n" + "\n".join(lines[-max_lines:])
+    if len(text) <= max_chars:
+        return text
+    # The end of a command's output (errors, summaries, the latest lines of a log) is usually the most relevant
+    head = max_chars // 4
+    tail = max_chars - head
+    return f"{text[:head]}\n[... {len(text) - head - tail} characters truncated ...]\n{text[-tail:]}"
+
+
+class ShellRunner:
+    """Runs shell commands as asyncio subprocesses on an event loop thread shared by the process.
+
+    The output of a command is read as it is written: it is sent to the output sink of the turn and kept up to
+    max_output_bytes, so a chatty command does not fill the memory. A command that runs for longer than its
+    timeout is stopped with its child processes. At most max_concurrent commands run at the same time.
+    """
+
+    def __init__(self, settings: Optional[ShellSettings] = None):
+        self.settings: ShellSettings = settings or ShellSettings()
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever, name="shell-runner", daemon=True)
+        self.thread.start()
+        self.semaphore = asyncio.Semaphore(max(1, self.settings.max_concurrent))
+        self.processes: Dict[int, asyncio.subprocess.Process] = {}
+        self._lock = Lock()
+        self._next_id: int = 0
+        # Counters
+        self.commands: int = 0
+        self.timeouts: int = 0
+        self.bytes_read: int = 0
+        self.running: int = 0
+        atexit.register(self.close)
+
+    def run(self, args: List[str], cwd: Optional[Path] = None, timeout: Optional[float] = None) -> CommandResult:
+        """Run a command from any thread, returns once it exits or is stopped."""
+
+        return self.run_many([args], cwd=cwd, timeout=timeout)[0]
+
+    def run_many(
+        self, commands: List[List[str]], cwd: Optional[Path] = None, timeout: Optional[float] = None
+    ) -> List[CommandResult]:
+        """Run commands at the same time (within max_concurrent), returns their results in order."""
+
+        sink = _output_sink.get()
+        events: Optional[SimpleQueue] = SimpleQueue() if sink is not None else None
+        # The commands run in copies of the caller's context, so their spans belong to the current turn
+        context = copy_context()
+        future = asyncio.run_coroutine_threadsafe(
+            self._run_all(commands, cwd, timeout or self.settings.timeout, events, context), self.loop
+        )
+        if sink is None or events is None:
+            return future.result()
+        # Events are sent to the sink from this thread, as it is the thread the sink was set in
+        future.add_done_callback(lambda _: events.put(None))
+        finished = False
+        while not finished:
+            pending = [events.get()]
+            while not events.empty():
+                pending.append(events.get_nowait())
+            if pending[-1] is None:
+                pending.pop()
+                finished = True
+            for event in self.coalesce(pending):
+                try:
+                    sink(event)
+                except Exception as e:
+                    logger.warning(f"Could not stream shell output: {e}")
+        return future.result()
+
+    def coalesce(self, events: List[ShellEvent]) -> List[ShellEvent]:
+        """Merge the consecutive output events of a stream, keeping their last output_chars characters.
+
+        A chatty command writes faster than a client can render, so the sink gets one event per stream and batch.
+        """
+
+        merged: List[ShellEvent] = []
+        for event in events:
+            previous = merged[-1] if merged else None
+            if (
+                previous is not None
+                and event.kind in ("stdout", "stderr")
+                and (previous.command_id, previous.kind) == (event.command_id, event.kind)
+            ):
+                previous.text = (previous.text + event.text)[-self.settings.output_chars :]
+            else:
+                merged.append(event)
+        return merged
+
+    async def _run_all(
+        self,
+        commands: List[List[str]],
+        cwd: Optional[Path],
+        timeout: float,
+        events: Optional[SimpleQueue],
+        context: Any,
+    ) -> List[CommandResult]:
+        tasks = [
+            self.loop.create_task(self._run(args, cwd, timeout, events), context=context.copy()) for args in commands
+        ]
+        return list(await asyncio.gather(*tasks))
+
+    async def _run(
+        self, args: List[str], cwd: Optional[Path], timeout: float, events: Optional[SimpleQueue]
+    ) -> CommandResult:
+        with self._lock:
+            self._next_id += 1
+            command_id = self._next_id
+        command = shlex.join(args)
+        stdout = OutputBuffer(self.settings.max_output_bytes)
+        stderr = OutputBuffer(self.settings.max_output_bytes)
+        result = CommandResult(command=command)
+        queued_at = perf_counter()
+        with tracer.span("shell_command", command=command[:200]) as span:
+            async with self.semaphore:
+                result.queued = perf_counter() - queued_at
+                if events is not None:
+                    events.put(ShellEvent(command_id=command_id, kind="start", command=command))
+                start = perf_counter()
+                self.running += 1
+                try:
+                    await self._execute(command_id, args, cwd, timeout, stdout, stderr, result, events)
+                except Exception as e:
+                    logger.warning(f"Failed to run shell command: {e}")
+                    result.error = str(e)
+                finally:
+                    self.running -= 1
+                result.elapsed = perf_counter() - start
+
+            result.stdout, result.stderr = stdout.text(), stderr.text()
+            result.stdout_bytes, result.stderr_bytes = stdout.total, stderr.total
+            result.truncated = stdout.dropped > 0 or stderr.dropped > 0
+            self.commands += 1
+            self.timeouts += int(result.timed_out)
+            self.bytes_read += stdout.total + stderr.total
+            span.set(
+                returncode=result.returncode,
+                latency=round(result.elapsed, 4),
+                queued=round(result.queued, 4),
+                stdout_bytes=stdout.total,
+                stderr_bytes=stderr.total,
+                truncated=result.truncated,
+                timed_out=result.timed_out,
+            )
+        if events is not None:
+            events.put(ShellEvent(command_id=command_id, kind="end", command=command, result=result))
+        return result
+
+    async def _execute(
+        self,
+        command_id: int,
+        args: List[str],
+        cwd: Optional[Path],
+        timeout: float,
+        stdout: OutputBuffer,
+        stderr: OutputBuffer,
+        result: CommandResult,
+        events: Optional[SimpleQueue],
+    ) -> None:
+        logger.info(f"Running shell command: {args}")
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            cwd=cwd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            # In its own process group, so the command is stopped with its child processes
+            start_new_session=True,
+        )
+        self.processes[command_id] = process
+        try:
+            readers = asyncio.gather(
+                self._read(command_id, process.stdout, stdout, "stdout", events),
+                self._read(command_id, process.stderr, stderr, "stderr", events),
+            )
+            exited = asyncio.gather(readers, process.wait())
+            # Retrieved here, as the readers are cancelled when they outlive the command
+            exited.add_done_callback(lambda future: future.cancelled() or future.exception())
+            try:
+                _, result.returncode = await asyncio.wait_for(asyncio.shield(exited), timeout)
+            except asyncio.TimeoutError:
+                result.timed_out = True
+                logger.warning(f"Shell command did not finish within {timeout}s: {args}")
+                result.returncode = await self._stop(process)
+                # Child processes that left the process group can keep the pipes open
+                try:
+                    await asyncio.wait_for(readers, self.settings.kill_grace)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.processes.pop(command_id, None)
+
+    async def _read(
+        self,
+        command_id: int,
+        stream: Optional[asyncio.StreamReader],
+        buffer: OutputBuffer,
+        kind: str,
+        events: Optional[SimpleQueue],
+    ) -> None:
+        if stream is None:
+            return
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            data = await stream.read(64 * 1024)
+            if not data:
+                break
+            buffer.write(data)
+            if events is not None:
+                events.put(ShellEvent(command_id=command_id, kind=kind, text=decoder.decode(data)))
+
+    async def _stop(self, process: asyncio.subprocess.Process) -> Optional[int]:
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(process.pid, sig)
+            except ProcessLookupError:
+                pass
+            try:
+                return await asyncio.wait_for(process.wait(), self.settings.kill_grace)
+            except asyncio.TimeoutError:
+                continue
+        return process.returncode
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "commands": self.commands,
+            "running": self.running,
+            "timeouts": self.timeouts,
+            "bytes_read": self.bytes_read,
+        }
+
+    def close(self) -> None:
+        if self.loop.is_closed():
+            return
+        for process in list(self.processes.values()):
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+        if not self.thread.is_alive():
+            self.loop.close()
+
+
+class StreamingShellTools(Toolkit):
+    """Shell tools that run commands on a ShellRunner, with a timeout and a cap on the output sent to the assistant.
+
+    :param runner: The ShellRunner of the process.
+    :param base_dir: The directory the commands run in.
+    """
+
+    def __init__(self, runner: ShellRunner, base_dir: Optional[Union[Path, str]] = None):
+        super().__init__(name="shell_tools")
+
+        self.runner: ShellRunner = runner
+        self.base_dir: Optional[Path] = Path(base_dir) if base_dir is not None else None
+
+        self.register(self.run_shell_command)
+        self.register(self.run_shell_commands)
+
+    def format_result(self, result: CommandResult, tail: int) -> str:
+        settings = self.runner.settings
+        if result.error is not None:
+            return f"Error: {result.error}"
+        output = truncate_output(result.stdout.rstrip("\n"), settings.output_chars, tail)
+        notes = []
+        if result.timed_out:
+            notes.append(f"[stopped after {settings.timeout:g} seconds, the output is partial]")
+        if result.truncated or len(output) < len(result.stdout.rstrip("\n")):
+            notes.append(f"[output truncated, the command wrote {result.stdout_bytes} bytes]")
+        if result.returncode != 0 and not result.timed_out:
+            errors = truncate_output(result.stderr.rstrip("\n"), settings.output_chars, tail)
+            output = f"Error (exit code {result.returncode}): {errors}" + (f"\n{output}" if output.strip() else "")
+        return "\n".join([output] + notes)
+
+    @staticmethod
+    def parse_args(args: Union[List[str], str]) -> List[str]:
+        # Claude passes tool arguments as strings: a JSON list, or a command line
+        if isinstance(args, str):
+            try:
+                parsed = json.loads(args)
+            except ValueError:
+                return shlex.split(args)
+            return [str(arg) for arg in parsed] if isinstance(parsed, list) else shlex.split(args)
+        return args
+
+    def run_shell_command(self, args: Union[List[str], str], tail: int = 100) -> str:
+        """Runs a shell command and returns the output or error.
+
+        Args:
+            args (List[str]): The command to run as a list of strings.
+            tail (int): The number of lines to return from the output.
+        Returns:
+            str: The output of the command.
+        """
+
+        return self.format_result(self.runner.run(self.parse_args(args), cwd=self.base_dir), tail)
+
+    def run_shell_commands(self, commands: Union[List[List[str]], str], tail: int = 100) -> str:
+        """Runs several independent shell commands at the same time and returns the output or error of each.
+
+        Args:
+            commands (List[List[str]]): The commands to run, each as a list of strings.
+            tail (int): The number of lines to return from the output of each command.
+        Returns:
+            str: The output of each command, in order.
+        """
+
+        if isinstance(commands, str):
+            commands = json.loads(commands)
+        results = self.runner.run_many([self.parse_args(args) for args in commands], cwd=self.base_dir)
+        return "\n\n".join(f"$ {result.command}\n{self.format_result(result, tail)}" for result in results)
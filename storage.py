@@ -0,0 +1,466 @@
+import atexit
+from os import getenv
+from threading import Condition, Lock, Thread
+from time import sleep
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import Column, Index, Table
+from sqlalchemy.sql.expression import delete, or_, select, text
+from sqlalchemy.types import BigInteger, DateTime, String
+
+from phi.assistant.run import AssistantRun
+from phi.storage.assistant.postgres import PgAssistantStorage
+from phi.utils.log import logger
+
+from tracing import tracer  # type: ignore
+
+# Memory fields that grow with the conversation, stored in the message log with one row per entry
+logged_fields = ("chat_history", "llm_messages", "references")
+
+
+class StorageSettings(BaseModel):
+    """Run storage settings."""
+
+    # Store the messages of a run in an append-only log, one row per message, so a turn only writes its new messages
+    message_log: bool = getenv("LLM_OS_MESSAGE_LOG", "true").lower() == "true"
+    # Write runs from a background thread after the turn, batching the writes of turns that finish meanwhile
+    async_writes: bool = getenv("LLM_OS_STORAGE_ASYNC_WRITES", "true").lower() == "true"
+    # Seconds the background thread waits for more writes before writing a batch
+    flush_interval: float = float(getenv("LLM_OS_STORAGE_FLUSH_INTERVAL", "0.2"))
+    # Messages inserted per statement
+    batch_size: int = int(getenv("LLM_OS_STORAGE_BATCH_SIZE", "500"))
+    # Background writes of a run that fail this many times in a row are dropped and reported
+    max_write_attempts: int = int(getenv("LLM_OS_STORAGE_MAX_WRITE_ATTEMPTS", "5"))
+
+
+class PendingWrite:
+    """The latest row of a run, and the log entries of the run that are not written yet."""
+
+    def __init__(self, row: AssistantRun, entries: List[Dict[str, Any]], rewrite: bool = False):
+        self.row = row
+        self.entries = entries
+        # Delete the logged entries of the run first, its memory was replaced
+        self.rewrite = rewrite
+        # Failed attempts to write the run
+        self.attempts: int = 0
+
+    def merge(self, later: "PendingWrite") -> None:
+        self.row = later.row
+        self.entries = later.entries if later.rewrite else self.entries + later.entries
+        self.rewrite = self.rewrite or later.rewrite
+
+
+class PgRunStorage(PgAssistantStorage):
+    """PgAssistantStorage with an indexed, paged run listing and an append-only message log for the LLM OS app.
+
+    With the message log, the chat history, LLM messages and references of a run are stored in the
+    `{table_name}_messages` table, one row per entry keyed by (run_id, seq), and the run row only keeps the number
+    of entries of each field. A turn appends its new entries and rewrites the (small) run row, so its write cost
+    does not grow with the conversation. Runs stored before the message log are moved to it on their next write.
+
+    :param settings: Message log and write settings.
+    """
+
+    def __init__(self, *args, settings: Optional[StorageSettings] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.settings: StorageSettings = settings or StorageSettings()
+        self.log_table: Table = self.get_log_table()
+        self.indexes_created: bool = False
+
+        # run_id -> number of entries of each logged field written (or queued) by this process
+        self.logged: Dict[str, Dict[str, int]] = {}
+        self._log_lock = Lock()
+        # Runs waiting for the background writer, by run_id
+        self._pending: Dict[str, PendingWrite] = {}
+        # Runs being written by the background thread
+        self._writing: Set[str] = set()
+        self._flush_requested: bool = False
+        self._condition = Condition()
+        self._writer: Optional[Thread] = None
+        # run_id -> error of the runs whose background writes were dropped after max_write_attempts
+        self.failed_writes: Dict[str, str] = {}
+
+    def get_table(self) -> Table:
+        table = super().get_table()
+        # Indexes used to list the most recent runs, optionally for a user
+        Index(f"{self.table_name}_created_at_idx", table.c.created_at.desc())
+        Index(f"{self.table_name}_user_id_created_at_idx", table.c.user_id, table.c.created_at.desc())
+        return table
+
+    def get_log_table(self) -> Table:
+        return Table(
+            f"{self.table_name}_messages",
+            self.metadata,
+            # The primary key is the (run_id, seq) index used to read a run's entries in order
+            Column("run_id", String, primary_key=True),
+            # Position of the entry in the run, across fields
+            Column("seq", BigInteger, primary_key=True),
+            # Memory field of the entry: chat_history, llm_messages or references
+            Column("field", String, nullable=False),
+            Column("entry", postgresql.JSONB),
+            Column("created_at", DateTime(timezone=True), server_default=text("now()")),
+            extend_existing=True,
+        )
+
+    def create_indexes(self) -> None:
+        """Create the indexes used to list runs. Also runs against tables created before the indexes existed."""
+
+        if self.indexes_created:
+            return
+        try:
+            for index in self.table.indexes:
+                logger.debug(f"Creating index: {index.name}")
+                index.create(self.db_engine, checkfirst=True)
+            self.indexes_created = True
+        except Exception as e:
+            logger.warning(f"Could not create indexes for {self.table_name}: {e}")
+
+    def create(self) -> None:
+        super().create()
+        if self.settings.message_log:
+            logger.debug(f"Creating table: {self.log_table.name}")
+            self.log_table.create(self.db_engine, checkfirst=True)
+        self.create_indexes()
+
+    def delete(self) -> None:
+        with self._condition:
+            self._pending = {}
+        with self._log_lock:
+            self.logged = {}
+        logger.debug(f"Deleting table: {self.log_table.name}")
+        self.log_table.drop(self.db_engine, checkfirst=True)
+        super().delete()
+
+    ####################################################
+    ## Read
+    ####################################################
+
+    def read(
+        self, run_id: str, known_counts: Optional[Dict[str, int]] = None, messages: bool = True
+    ) -> Optional[AssistantRun]:
+        """Read a run, with the entries of its message log added to its memory.
+
+        :param run_id: The run to read.
+        :param known_counts: Number of entries of each logged field the caller holds. If the log has the same
+            number of entries, they are not read and the memory of the run is returned without them.
+        :param messages: Read the entries of the message log.
+        """
+        # Writes of the run queued by this process are visible to its reads
+        self.flush(run_id)
+        with tracer.span("storage_read", table=self.table_name) as span:
+            row = super().read(run_id)
+            counts = (row.memory or {}).get("message_log") if row is not None else None
+            if row is None or counts is None:
+                # Runs stored before the message log keep their messages in the memory column
+                return row
+            with self._log_lock:
+                self.logged[run_id] = counts
+            if not messages or counts == known_counts:
+                return row
+            entries = self.read_entries(run_id)
+            row.memory.update(entries)  # type: ignore
+            span.set(messages=sum(len(field_entries) for field_entries in entries.values()))
+            return row
+
+    def read_entries(self, run_id: str) -> Dict[str, List[Dict[str, Any]]]:
+        entries: Dict[str, List[Dict[str, Any]]] = {field: [] for field in logged_fields}
+        with self.Session() as sess, sess.begin():
+            stmt = (
+                select(self.log_table.c.field, self.log_table.c.entry)
+                .where(self.log_table.c.run_id == run_id)
+                .order_by(self.log_table.c.seq)
+            )
+            for row in sess.execute(stmt):
+                entries.setdefault(row.field, []).append(row.entry)
+        return entries
+
+    def get_messages(
+        self,
+        run_id: str,
+        field: str = "chat_history",
+        limit: int = 20,
+        before_seq: Optional[int] = None,
+    ) -> List[Tuple[int, Dict[str, Any]]]:
+        """Return a page of the entries of a run as (seq, entry) pairs, the most recent page first, oldest entry first.
+
+        :param run_id: The run to read.
+        :param field: The logged memory field to read.
+        :param limit: Maximum number of entries to return.
+        :param before_seq: Only return entries before this seq, pass the seq of the first entry of a page to get
+            the page before it.
+        """
+        self.flush(run_id)
+        page: List[Tuple[int, Dict[str, Any]]] = []
+        try:
+            with self.Session() as sess, sess.begin():
+                stmt = select(self.log_table.c.seq, self.log_table.c.entry).where(
+                    self.log_table.c.run_id == run_id, self.log_table.c.field == field
+                )
+                if before_seq is not None:
+                    stmt = stmt.where(self.log_table.c.seq < before_seq)
+                stmt = stmt.order_by(self.log_table.c.seq.desc()).limit(limit)
+                page = [(row.seq, row.entry) for row in sess.execute(stmt)]
+        except Exception:
+            logger.debug(f"Table does not exist: {self.log_table.name}")
+        page.reverse()
+        return page
+
+    def get_run_ids(
+        self,
+        user_id: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0,
+        search: Optional[str] = None,
+    ) -> List[str]:
+        """Return a page of run_ids ordered by most recent first.
+
+        Unlike get_all_run_ids, only the run_id column is read, so the memory column is never loaded.
+
+        :param user_id: Only return runs for this user.
+        :param limit: Maximum number of run_ids to return.
+        :param offset: Number of run_ids to skip.
+        :param search: Only return runs where the run_id or run_name contains this text.
+        """
+        if not self.indexes_created and self.table_exists():
+            self.create_indexes()
+
+        run_ids: List[str] = []
+        try:
+            with self.Session() as sess, sess.begin():
+                stmt = select(self.table.c.run_id)
+                if user_id is not None:
+                    stmt = stmt.where(self.table.c.user_id == user_id)
+                if search:
+                    pattern = f"%{search}%"
+                    stmt = stmt.where(or_(self.table.c.run_id.ilike(pattern), self.table.c.run_name.ilike(pattern)))
+                stmt = stmt.order_by(self.table.c.created_at.desc()).limit(limit).offset(offset)
+                for row in sess.execute(stmt).fetchall():
+                    if row.run_id is not None:
+                        run_ids.append(row.run_id)
+        except Exception:
+            logger.debug(f"Table does not exist: {self.table.name}")
+        return run_ids
+
+    ####################################################
+    ## Write
+    ####################################################
+
+    def upsert(self, row: AssistantRun) -> Optional[AssistantRun]:
+        if not self.settings.message_log:
+            with tracer.span("storage_write", table=self.table_name):
+                return super().upsert(row)
+
+        with self._log_lock:
+            # The first write of a run in this process, and the next write of a run whose writes were dropped, are
+            # written before returning, so the caller sees an error when the run can not be stored
+            known = row.run_id in self.logged and row.run_id not in self.failed_writes
+            write = self.split_row(row)
+        with tracer.span("storage_write", table=self.table_name, messages=len(write.entries)):
+            if self.settings.async_writes and known:
+                self.enqueue(write)
+            else:
+                try:
+                    self.write([write])
+                except Exception:
+                    with self._log_lock:
+                        self.logged.pop(row.run_id, None)
+                    raise
+                self.failed_writes.pop(row.run_id, None)
+        # The row is not read back, the caller already holds its memory
+        return row
+
+    def split_row(self, row: AssistantRun) -> PendingWrite:
+        """Split a run into the row to store, without the logged fields, and the log entries not written yet."""
+
+        memory = dict(row.memory or {})
+        fields = {field: memory.pop(field, None) or [] for field in logged_fields}
+        counts = {field: len(field_entries) for field, field_entries in fields.items()}
+        memory["message_log"] = counts
+
+        logged = self.get_logged(row.run_id)
+        # Rewrite the log when the memory of the run was replaced, or the log was not used for its last write
+        rewrite = logged is None or any(counts[field] < logged.get(field, 0) for field in logged_fields)
+        if rewrite:
+            logged = {}
+
+        entries: List[Dict[str, Any]] = []
+        seq = sum(logged.values())  # type: ignore
+        for field, field_entries in fields.items():
+            for entry in field_entries[logged.get(field, 0) :]:  # type: ignore
+                entries.append({"run_id": row.run_id, "seq": seq, "field": field, "entry": entry})
+                seq += 1
+        self.logged[row.run_id] = counts
+        return PendingWrite(row.model_copy(update={"memory": memory}), entries, rewrite=rewrite)
+
+    def get_logged(self, run_id: str) -> Optional[Dict[str, int]]:
+        """Return the number of logged entries of each field of a run, or None if the log is not used for the run."""
+
+        if run_id in self.logged:
+            return self.logged[run_id]
+        try:
+            with self.Session() as sess, sess.begin():
+                stmt = select(self.table.c.memory["message_log"].label("counts")).where(self.table.c.run_id == run_id)
+                existing = sess.execute(stmt).first()
+        except Exception:
+            return {}
+        if existing is None:
+            # A new run
+            return {}
+        return existing.counts
+
+    def write(self, writes: List[PendingWrite]) -> None:
+        try:
+            self.write_runs(writes)
+        except Exception:
+            if self.table_exists() and (not self.settings.message_log or self.log_table_exists()):
+                raise
+            # Create the tables and try again
+            self.create()
+            self.write_runs(writes)
+
+    def log_table_exists(self) -> bool:
+        try:
+            return inspect(self.db_engine).has_table(self.log_table.name, schema=self.schema)
+        except Exception:
+            return False
+
+    def write_runs(self, writes: List[PendingWrite]) -> None:
+        """Write runs and their new log entries in one transaction."""
+
+        with self.Session() as sess, sess.begin():
+            for write in writes:
+                if write.rewrite:
+                    sess.execute(delete(self.log_table).where(self.log_table.c.run_id == write.row.run_id))
+                for i in range(0, len(write.entries), self.settings.batch_size):
+                    # Entries another writer of the run already logged are skipped
+                    sess.execute(
+                        postgresql.insert(self.log_table).on_conflict_do_nothing(),
+                        write.entries[i : i + self.settings.batch_size],
+                    )
+                self.upsert_row(sess, write.row)
+
+    def upsert_row(self, sess: Session, row: AssistantRun) -> None:
+        values = dict(
+            name=row.name,
+            run_name=row.run_name,
+            user_id=row.user_id,
+            llm=row.llm,
+            memory=row.memory,
+            assistant_data=row.assistant_data,
+            run_data=row.run_data,
+            user_data=row.user_data,
+            task_data=row.task_data,
+        )
+        stmt = postgresql.insert(self.table).values(run_id=row.run_id, **values)
+        sess.execute(stmt.on_conflict_do_update(index_elements=["run_id"], set_=values))
+
+    ####################################################
+    ## Background writes
+    ####################################################
+
+    def enqueue(self, write: PendingWrite) -> None:
+        with self._condition:
+            pending = self._pending.get(write.row.run_id)
+            if pending is None:
+                self._pending[write.row.run_id] = write
+            else:
+                pending.merge(write)
+            if self._writer is None:
+                self._writer = Thread(target=self.write_pending, name="run-storage-writer", daemon=True)
+                self._writer.start()
+                # Runs queued when the process exits are written before it does
+                atexit.register(self.flush)
+            self._condition.notify_all()
+
+    def write_pending(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._pending) > 0)
+                # Wait for the writes of other turns, unless a reader is waiting
+                self._condition.wait_for(lambda: self._flush_requested, timeout=self.settings.flush_interval)
+                self._flush_requested = False
+                writes = list(self._pending.values())
+                self._pending = {}
+                self._writing = {write.row.run_id for write in writes}
+
+            failed: List[PendingWrite] = []
+            try:
+                with tracer.span("storage_flush", table=self.table_name, runs=len(writes)) as span:
+                    try:
+                        self.write(writes)
+                    except Exception as e:
+                        # Write the runs one by one, so a run that can not be written does not hold back the others
+                        logger.warning(f"Could not write {len(writes)} runs to {self.table_name}, writing each: {e}")
+                        failed = self.write_each(writes)
+                        span.set(failed=len(failed))
+            finally:
+                with self._condition:
+                    self.requeue(failed)
+                    self._writing = set()
+                    self._condition.notify_all()
+            if failed:
+                sleep(1)
+
+    def write_each(self, writes: List[PendingWrite]) -> List[PendingWrite]:
+        """Write runs in a transaction each, returns the writes that failed and can be tried again."""
+
+        failed: List[PendingWrite] = []
+        for write in writes:
+            run_id = write.row.run_id
+            try:
+                self.write([write])
+                self.failed_writes.pop(run_id, None)
+            except Exception as e:
+                # Connection errors are retried until the database is back, other errors count as attempts
+                if not isinstance(e, OperationalError):
+                    write.attempts += 1
+                if write.attempts < self.settings.max_write_attempts:
+                    failed.append(write)
+                    continue
+                logger.error(f"Dropped the writes of run {run_id} after {write.attempts} attempts: {e}")
+                self.failed_writes[run_id] = str(e)
+                with self._log_lock:
+                    # The next write of the run rewrites it from the counts stored in the database
+                    self.logged.pop(run_id, None)
+        return failed
+
+    def requeue(self, failed: List[PendingWrite]) -> None:
+        # Keep the failed writes in order before the writes queued meanwhile
+        for write in failed:
+            later = self._pending.pop(write.row.run_id, None)
+            if later is not None:
+                write.merge(later)
+        self._pending = {**{write.row.run_id: write for write in failed}, **self._pending}
+
+    def flush(self, run_id: Optional[str] = None, timeout: Optional[float] = 10.0) -> bool:
+        """Wait until the runs queued by this process (or only `run_id`) are written, returns False otherwise.
+
+        A run whose last write failed is not waited for, as the writer only tries again after a pause.
+        """
+
+        with self._condition:
+            if self._writer is None:
+                return True
+
+            def written() -> bool:
+                if run_id is None:
+                    return not self._pending and not self._writing
+                return run_id not in self._pending and run_id not in self._writing
+
+            def failing() -> bool:
+                pending = self._pending.get(run_id) if run_id is not None else None
+                return pending is not None and pending.attempts > 0
+
+            if written():
+                return True
+            self._flush_requested = True
+            self._condition.notify_all()
+            done = self._condition.wait_for(lambda: written() or failing(), timeout=timeout) and written()
+            if not done:
+                logger.warning(f"Reading {run_id or 'runs'} from {self.table_name} before its queued writes")
+            return done
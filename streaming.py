@@ -0,0 +1,189 @@
+from collections import deque
+from threading import Lock
+from time import perf_counter
+from typing import Any, Callable, Deque, Dict, List
+
+
+class MarkdownStreamRenderer:
+    """Renders a streamed markdown response into a streamlit container.
+
+    Deltas are collected in a list and rendered on a time and size budget, instead of re-rendering the
+    whole response on every delta. Completed markdown blocks (text up to a blank line outside a code fence,
+    followed by an unindented line) are written to their own element once and never re-sent, so only the
+    block being streamed is re-rendered.
+    Partial lines are held back until the line completes, so half-written table rows and code fences
+    do not flicker.
+
+    :param container: A streamlit container (or anything with an `empty()` method returning a placeholder
+        with a `markdown()` method).
+    :param min_interval: Minimum seconds between two flushes.
+    :param min_chars: Flush as soon as this many characters were written, even if min_interval has not passed.
+    :param max_delay: Render pending text even if it ends mid-line once this many seconds have passed.
+    :param clock: Function returning the current time in seconds.
+    """
+
+    def __init__(
+        self,
+        container: Any,
+        min_interval: float = 0.05,
+        min_chars: int = 200,
+        max_delay: float = 0.5,
+        clock: Callable[[], float] = perf_counter,
+    ):
+        self.container = container
+        self.min_interval = min_interval
+        self.min_chars = min_chars
+        self.max_delay = max_delay
+        self.clock = clock
+
+        # Deltas of the block currently being streamed
+        self._parts: List[str] = []
+        # Characters written since the last flush
+        self._pending_chars: int = 0
+        self._last_flush: float = self.clock()
+        # Completed blocks, kept to return the full response
+        self._blocks: List[str] = []
+        # Placeholder the current block is rendered into
+        self._placeholder: Any = None
+        # Length of the current block text that has been rendered
+        self._rendered_chars: int = 0
+        self._last_render: float = self.clock()
+
+        # Render stats
+        self.render_calls: int = 0
+        self.bytes_sent: int = 0
+
+    @property
+    def text(self) -> str:
+        return "".join(self._blocks) + "".join(self._parts)
+
+    def write(self, delta: str) -> None:
+        if not delta:
+            return
+        self._parts.append(delta)
+        self._pending_chars += len(delta)
+        if self._pending_chars >= self.min_chars or self.clock() - self._last_flush >= self.min_interval:
+            self.flush()
+
+    def flush(self, final: bool = False) -> None:
+        self._pending_chars = 0
+        self._last_flush = self.clock()
+        block = "".join(self._parts)
+        self._parts = [block] if block else []
+
+        # Move completed blocks out of the live placeholder
+        boundary = self._last_block_boundary(block)
+        if boundary > 0:
+            if self._rendered_chars != boundary:
+                self._render(block[:boundary])
+            self._blocks.append(block[:boundary])
+            self._placeholder = None
+            self._rendered_chars = 0
+            block = block[boundary:]
+            self._parts = [block] if block else []
+
+        # Render the block being streamed up to the last complete line
+        render_upto = len(block) if final else block.rfind("\n") + 1
+        if render_upto <= self._rendered_chars and self.clock() - self._last_render >= self.max_delay:
+            render_upto = len(block)
+        if render_upto > self._rendered_chars:
+            self._render(block[:render_upto])
+            self._rendered_chars = render_upto
+
+    def close(self) -> str:
+        """Render any remaining text and return the full response."""
+        self.flush(final=True)
+        return self.text
+
+    def _render(self, text: str) -> None:
+        if self._placeholder is None:
+            self._placeholder = self.container.empty()
+        self._placeholder.markdown(text)
+        self.render_calls += 1
+        self.bytes_sent += len(text.encode())
+        self._last_render = self.clock()
+
+    @staticmethod
+    def _last_block_boundary(text: str) -> int:
+        """Return the start of the last top-level block that follows a blank line outside a code fence, or 0.
+
+        Blocks followed by an indented line are not split, as the indented line may continue a list item.
+        """
+        boundary = 0
+        in_fence = False
+        previous_blank = False
+        position = 0
+        for line in text.splitlines(keepends=True):
+            stripped = line.strip()
+            if not in_fence and previous_blank and stripped != "" and not line[0].isspace():
+                boundary = position
+            if stripped.startswith("```") or stripped.startswith("~~~"):
+                in_fence = not in_fence
+            previous_blank = stripped == "" and line.endswith("\n")
+            position += len(line)
+        return boundary
+
+
+class ShellOutputRenderer:
+    """Renders the output of the shell commands of a turn into a streamlit container while they run.
+
+    Each command gets a status element showing the last lines of its output, re-rendered on a time budget. Events
+    (see shell_tools.ShellEvent) can come from several tool call threads at the same time.
+
+    :param container: A streamlit container (or anything with a `status()` method returning an element with
+        `empty()` and `update()` methods).
+    :param max_lines: Lines of output shown per command.
+    :param min_interval: Minimum seconds between two renders of a command's output.
+    :param clock: Function returning the current time in seconds.
+    """
+
+    def __init__(
+        self, container: Any, max_lines: int = 20, min_interval: float = 0.1, clock: Callable[[], float] = perf_counter
+    ):
+        self.container = container
+        self.max_lines = max_lines
+        self.min_interval = min_interval
+        self.clock = clock
+
+        # Command id -> status element, output placeholder, last lines and time of the last render
+        self._status: Dict[int, Any] = {}
+        self._placeholders: Dict[int, Any] = {}
+        self._lines: Dict[int, Deque[str]] = {}
+        self._last_render: Dict[int, float] = {}
+        self._lock = Lock()
+
+        # Render stats
+        self.render_calls: int = 0
+
+    def __call__(self, event: Any) -> None:
+        with self._lock:
+            if event.kind == "start":
+                status = self.container.status(f"`$ {event.command}`", expanded=True)
+                self._status[event.command_id] = status
+                self._placeholders[event.command_id] = status.empty()
+                self._lines[event.command_id] = deque([""], maxlen=self.max_lines)
+                self._last_render[event.command_id] = self.clock()
+            elif event.kind in ("stdout", "stderr") and event.command_id in self._lines:
+                lines = self._lines[event.command_id]
+                first, *rest = event.text.split("\n")
+                lines[-1] += first
+                lines.extend(rest)
+                if self.clock() - self._last_render[event.command_id] >= self.min_interval:
+                    self._render(event.command_id)
+            elif event.kind == "end" and event.command_id in self._status:
+                self._render(event.command_id)
+                result = event.result
+                if result.error is not None:
+                    label, state = f"`$ {result.command}` failed: {result.error}", "error"
+                elif result.timed_out:
+                    label, state = f"`$ {result.command}` stopped after {result.elapsed:.1f}s", "error"
+                else:
+                    label = f"`$ {result.command}` exited with {result.returncode} in {result.elapsed:.1f}s"
+                    state = "complete" if result.returncode == 0 else "error"
+                size = result.stdout_bytes + result.stderr_bytes
+                self._status[event.command_id].update(label=f"{label}, {size} bytes", state=state, expanded=False)
+
+    def _render(self, command_id: int) -> None:
+        self._placeholders[command_id].code("\n".join(self._lines[command_id]), language="text")
+        self._last_render[command_id] = self.clock()
+        self.render_calls += 1
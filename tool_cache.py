@@ -0,0 +1,308 @@
+import json
+import sqlite3
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.schema import Column, MetaData, Table
+from sqlalchemy.sql.expression import select, text
+from sqlalchemy.types import DateTime, Float, String
+
+from phi.tools import Toolkit
+from phi.utils.log import logger
+from phi.utils.timer import Timer
+
+from cache import TTLCache  # type: ignore
+
+# Seconds the result of each tool is cached for, stock prices change quickly while company info rarely does
+default_tool_ttls: Dict[str, float] = {
+    # YFinanceTools
+    "get_current_stock_price": 60,
+    "get_historical_stock_prices": 60 * 60,
+    "get_technical_indicators": 60 * 60,
+    "get_company_news": 30 * 60,
+    "get_analyst_recommendations": 6 * 60 * 60,
+    "get_company_info": 24 * 60 * 60,
+    "get_stock_fundamentals": 24 * 60 * 60,
+    "get_income_statements": 24 * 60 * 60,
+    "get_key_financial_ratios": 24 * 60 * 60,
+    # DuckDuckGo
+    "duckduckgo_news": 15 * 60,
+    "duckduckgo_search": 60 * 60,
+    # ExaTools
+    "search_exa": 60 * 60,
+}
+
+
+###########################################################################
+# Persistent stores, shared across processes
+###########################################################################
+
+
+class ToolCacheStore(ABC):
+    """Base class for the persistent tool result store."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        """Return the result for `key` and the seconds it stays valid, or None."""
+
+    @abstractmethod
+    def set(self, key: str, tool: str, result: str, ttl: float) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        ...
+
+
+class LocalToolCacheStore(ToolCacheStore):
+    """Tool results stored in a local sqlite file, shared by the processes on this machine."""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = Lock()
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("pragma journal_mode=wal")
+            self._connection.execute(
+                "create table if not exists tool_cache (key text primary key, tool text, result text, expires_at real)"
+            )
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            row = self._connection.execute(
+                "select result, expires_at from tool_cache where key = ? and expires_at > ?", (key, time())
+            ).fetchone()
+        return (row[0], row[1] - time()) if row is not None else None
+
+    def set(self, key: str, tool: str, result: str, ttl: float) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("delete from tool_cache where expires_at <= ?", (time(),))
+            self._connection.execute(
+                "insert or replace into tool_cache (key, tool, result, expires_at) values (?, ?, ?, ?)",
+                (key, tool, result, time() + ttl),
+            )
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("delete from tool_cache")
+
+
+class PgToolCacheStore(ToolCacheStore):
+    """Tool results stored in a postgres table, shared by all processes."""
+
+    def __init__(self, db_engine: Engine, table_name: str = "llm_os_tool_cache", schema: Optional[str] = "ai"):
+        self.table_name: str = table_name
+        self.schema: Optional[str] = schema
+        self.db_engine: Engine = db_engine
+        self.metadata: MetaData = MetaData(schema=self.schema)
+        self.Session: sessionmaker[Session] = sessionmaker(bind=self.db_engine)
+        self.table: Table = Table(
+            self.table_name,
+            self.metadata,
+            # Hash of the tool name and arguments
+            Column("key", String, primary_key=True),
+            Column("tool", String),
+            Column("result", postgresql.TEXT),
+            # Epoch seconds after which the result is stale
+            Column("expires_at", Float, index=True),
+            Column("created_at", DateTime(timezone=True), server_default=text("now()")),
+            extend_existing=True,
+        )
+        self._created: bool = False
+        self._lock = Lock()
+
+    def create(self) -> None:
+        with self._lock:
+            if self._created:
+                return
+            if not inspect(self.db_engine).has_table(self.table_name, schema=self.schema):
+                if self.schema is not None:
+                    with self.Session() as sess, sess.begin():
+                        sess.execute(text(f"create schema if not exists {self.schema};"))
+                logger.debug(f"Creating table: {self.table_name}")
+                self.table.create(self.db_engine, checkfirst=True)
+            self._created = True
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        self.create()
+        with self.Session() as sess, sess.begin():
+            row = sess.execute(
+                select(self.table.c.result, self.table.c.expires_at).where(
+                    self.table.c.key == key, self.table.c.expires_at > time()
+                )
+            ).first()
+        return (row.result, row.expires_at - time()) if row is not None else None
+
+    def set(self, key: str, tool: str, result: str, ttl: float) -> None:
+        self.create()
+        stmt = postgresql.insert(self.table).values(key=key, tool=tool, result=result, expires_at=time() + ttl)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["key"],
+            set_=dict(result=stmt.excluded.result, expires_at=stmt.excluded.expires_at),
+        )
+        with self.Session() as sess, sess.begin():
+            sess.execute(self.table.delete().where(self.table.c.expires_at <= time()))
+            sess.execute(stmt)
+
+    def clear(self) -> None:
+        self.create()
+        with self.Session() as sess, sess.begin():
+            sess.execute(self.table.delete())
+
+
+###########################################################################
+# Tool result cache
+###########################################################################
+
+
+class ToolResultCache:
+    """Caches the results of toolkit functions that call external services.
+
+    Results are kept in a bounded in-memory LRU and, if a store is provided, in a store shared across
+    processes. Identical calls made while the first one is still running wait for its result instead of
+    calling the service again. Errors and results larger than `max_result_chars` are not cached.
+
+    :param ttls: Seconds the result of each tool (by function name) is cached for, 0 to disable caching.
+    :param default_ttl: Seconds results of tools not in `ttls` are cached for.
+    :param maxsize: Maximum number of results kept in memory.
+    :param max_result_chars: Results longer than this are not cached.
+    :param store: Persistent store shared across processes.
+    """
+
+    def __init__(
+        self,
+        ttls: Optional[Dict[str, float]] = None,
+        default_ttl: float = 10 * 60,
+        maxsize: int = 512,
+        max_result_chars: int = 100000,
+        store: Optional[ToolCacheStore] = None,
+    ):
+        self.ttls: Dict[str, float] = ttls if ttls is not None else default_tool_ttls
+        self.default_ttl = default_ttl
+        self.max_result_chars = max_result_chars
+        self.store = store
+        self.memory = TTLCache(maxsize=maxsize, ttl=default_ttl)
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = Lock()
+        # Cache counters
+        self.calls: int = 0
+        self.store_hits: int = 0
+        self.shared_calls: int = 0
+
+    def get_ttl(self, tool: str) -> float:
+        return self.ttls.get(tool, self.default_ttl)
+
+    @staticmethod
+    def get_key(tool: str, arguments: Dict[str, Any]) -> str:
+        normalized = {k: v.strip() if isinstance(v, str) else v for k, v in arguments.items()}
+        return sha256(json.dumps([tool, normalized], sort_keys=True, default=str).encode()).hexdigest()
+
+    def is_cacheable(self, result: Any) -> bool:
+        return (
+            isinstance(result, str)
+            and len(result) <= self.max_result_chars
+            and not result.startswith(("Error", "Could not"))
+        )
+
+    def call(self, tool: str, function: Callable[..., Any], arguments: Dict[str, Any]) -> Any:
+        """Return the cached result of `function(**arguments)`, calling it on a miss."""
+
+        ttl = self.get_ttl(tool)
+        if ttl <= 0:
+            return function(**arguments)
+
+        key = self.get_key(tool, arguments)
+        # Only the first of several identical calls runs, the others wait for its result
+        with self._lock:
+            result = self.memory.get(key)
+            if result is not None:
+                return result
+            future = self._in_flight.get(key)
+            leader = future is None
+            if future is None:
+                future = Future()
+                self._in_flight[key] = future
+        if not leader:
+            self.shared_calls += 1
+            return future.result()
+
+        try:
+            stored = self.get_from_store(key)
+            if stored is not None:
+                result, remaining_ttl = stored
+                self.store_hits += 1
+                self.memory.set(key, result, ttl=remaining_ttl)
+            else:
+                self.calls += 1
+                timer = Timer()
+                timer.start()
+                result = function(**arguments)
+                timer.stop()
+                if self.is_cacheable(result):
+                    self.memory.set(key, result, cost=timer.elapsed, ttl=ttl)
+                    self.set_in_store(key, tool, result, ttl)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def get_from_store(self, key: str) -> Optional[Tuple[str, float]]:
+        if self.store is None:
+            return None
+        try:
+            return self.store.get(key)
+        except Exception as e:
+            logger.warning(f"Could not read the tool cache: {e}")
+            return None
+
+    def set_in_store(self, key: str, tool: str, result: str, ttl: float) -> None:
+        if self.store is None:
+            return
+        try:
+            self.store.set(key, tool, result, ttl)
+        except Exception as e:
+            logger.warning(f"Could not write the tool cache: {e}")
+
+    def wrap(self, toolkit: Toolkit) -> Toolkit:
+        """Route the functions of `toolkit` through the cache, returns the same toolkit."""
+
+        for function in toolkit.functions.values():
+            if function.entrypoint is None:
+                continue
+            function.entrypoint = self.wrap_function(function.name, function.entrypoint)
+        return toolkit
+
+    def wrap_function(self, tool: str, entrypoint: Callable[..., Any]) -> Callable[..., Any]:
+        def cached_entrypoint(*args, **kwargs) -> Any:
+            if args:
+                return entrypoint(*args, **kwargs)
+            return self.call(tool, entrypoint, kwargs)
+
+        return cached_entrypoint
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.store is not None:
+            self.store.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.memory.stats(),
+            "calls": self.calls,
+            "store_hits": self.store_hits,
+            "shared_calls": self.shared_calls,
+        }
@@ -0,0 +1,307 @@
+import json
+import os
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from pathlib import Path
+from threading import Lock
+from time import perf_counter, time
+from typing import Any, ContextManager, Deque, Dict, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+from pydantic import BaseModel, Field
+
+from phi.utils.log import logger
+
+
+class TraceSettings(BaseModel):
+    """Tracing settings, tracing is off unless LLM_OS_TRACING is true."""
+
+    enabled: bool = os.getenv("LLM_OS_TRACING", "false").lower() == "true"
+    # Spans are appended to this file as JSON lines, with the field names of OpenTelemetry spans
+    trace_file: Optional[str] = os.getenv("LLM_OS_TRACE_FILE")
+    # Metrics are written to this file in the Prometheus text format after each turn
+    metrics_file: Optional[str] = os.getenv("LLM_OS_METRICS_FILE")
+    # Number of finished traces kept in memory
+    max_traces: int = int(os.getenv("LLM_OS_MAX_TRACES", "100"))
+
+
+class Span(BaseModel):
+    """A timed stage of a turn: an LLM request, a tool call, an embedding, a vector search or a storage access."""
+
+    name: str
+    span_id: str = Field(default_factory=lambda: uuid4().hex[:16])
+    parent_id: Optional[str] = None
+    # Epoch seconds, for exporting
+    start_time: float = Field(default_factory=time)
+    # perf_counter readings, for durations
+    start: float = Field(default_factory=perf_counter)
+    end: Optional[float] = None
+    attributes: Dict[str, Any] = {}
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else perf_counter()) - self.start
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+
+class NullSpan:
+    """Returned instead of a Span when tracing is off, so instrumented code does not check."""
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+
+class Trace(BaseModel):
+    """The spans of one turn."""
+
+    trace_id: str = Field(default_factory=lambda: uuid4().hex)
+    name: str = "turn"
+    attributes: Dict[str, Any] = {}
+    spans: List[Span] = []
+
+    @property
+    def root(self) -> Span:
+        return self.spans[0]
+
+    def summary(self) -> Dict[str, Any]:
+        """Count, total seconds and token usage of each kind of span, plus the time to the first token of the turn."""
+
+        stages: Dict[str, Dict[str, Any]] = {}
+        for span in self.spans[1:]:
+            stage = stages.setdefault(span.name, {"count": 0, "seconds": 0.0})
+            stage["count"] += 1
+            stage["seconds"] += span.duration
+            for key in ("input_tokens", "output_tokens"):
+                if key in span.attributes:
+                    stage[key] = stage.get(key, 0) + span.attributes[key]
+        for stage in stages.values():
+            stage["seconds"] = round(stage["seconds"], 4)
+        # Streamed LLM responses record when their first token arrived
+        first_tokens = [
+            span.start + span.attributes["time_to_first_token"] - self.root.start
+            for span in self.spans
+            if span.name == "llm" and "time_to_first_token" in span.attributes
+        ]
+        return {
+            "trace_id": self.trace_id,
+            **self.attributes,
+            "seconds": round(self.root.duration, 4),
+            "time_to_first_token": round(min(first_tokens), 4) if first_tokens else None,
+            "stages": stages,
+        }
+
+    def to_otel(self) -> List[Dict[str, Any]]:
+        """Return the spans as dicts with the field names of OpenTelemetry spans."""
+
+        return [
+            {
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent_id,
+                "name": span.name,
+                "startTimeUnixNano": int(span.start_time * 1e9),
+                "endTimeUnixNano": int((span.start_time + span.duration) * 1e9),
+                "attributes": span.attributes,
+            }
+            for span in self.spans
+        ]
+
+
+class Histogram:
+    """Prometheus histogram of span durations, by label values."""
+
+    buckets: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        # labels -> (count per bucket, sum, count)
+        self.values: Dict[Tuple[Tuple[str, str], ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, labels: Tuple[Tuple[str, str], ...], value: float) -> None:
+        counts, total, count = self.values.get(labels, ([0] * len(self.buckets), 0.0, 0))
+        index = bisect_left(self.buckets, value)
+        if index < len(counts):
+            counts[index] += 1
+        self.values[labels] = (counts, total + value, count + 1)
+
+    def render(self, name: str) -> List[str]:
+        lines: List[str] = []
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bucket)),))} {cumulative}")
+            lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return lines
+
+
+def format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = [(key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in labels]
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+class Metrics:
+    """Aggregates finished traces into Prometheus metrics."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.turns: int = 0
+        self.span_seconds = Histogram()
+        self.time_to_first_token = Histogram()
+        # (kind of token, model) -> count
+        self.tokens: Dict[Tuple[Tuple[str, str], ...], int] = {}
+
+    def record(self, trace: Trace) -> None:
+        with self._lock:
+            self.turns += 1
+            self.span_seconds.observe((("span", trace.name),), trace.root.duration)
+            for span in trace.spans[1:]:
+                labels: Tuple[Tuple[str, str], ...] = (("span", span.name),)
+                if span.name == "tool":
+                    labels += (("tool", str(span.attributes.get("tool"))),)
+                self.span_seconds.observe(labels, span.duration)
+                if span.name != "llm":
+                    continue
+                model = str(span.attributes.get("model"))
+                if "time_to_first_token" in span.attributes:
+                    self.time_to_first_token.observe((("model", model),), span.attributes["time_to_first_token"])
+                for key in ("input_tokens", "output_tokens"):
+                    if key in span.attributes:
+                        token_labels = (("type", key.replace("_tokens", "")), ("model", model))
+                        self.tokens[token_labels] = self.tokens.get(token_labels, 0) + span.attributes[key]
+
+    def render(self) -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+
+        with self._lock:
+            lines = [
+                "# HELP llm_os_turns_total Turns traced.",
+                "# TYPE llm_os_turns_total counter",
+                f"llm_os_turns_total {self.turns}",
+                "# HELP llm_os_span_seconds Seconds spent in each stage of a turn.",
+                "# TYPE llm_os_span_seconds histogram",
+                *self.span_seconds.render("llm_os_span_seconds"),
+                "# HELP llm_os_llm_time_to_first_token_seconds Seconds until the LLM streamed its first token.",
+                "# TYPE llm_os_llm_time_to_first_token_seconds histogram",
+                *self.time_to_first_token.render("llm_os_llm_time_to_first_token_seconds"),
+                "# HELP llm_os_llm_tokens_total Tokens sent to and generated by the LLM.",
+                "# TYPE llm_os_llm_tokens_total counter",
+                *(f"llm_os_llm_tokens_total{format_labels(labels)} {count}" for labels, count in self.tokens.items()),
+            ]
+        return "\n".join(lines) + "\n"
+
+
+# Trace of the turn running in this context, and its innermost open span
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("llm_os_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("llm_os_span", default=None)
+_null_span = nullcontext(NullSpan())
+
+
+class Tracer:
+    """Records timing spans for the stages of a turn.
+
+    A turn is traced with `with tracer.trace(...)`, and instrumented code opens spans with `with tracer.span(...)`.
+    Outside of a traced turn, or when tracing is off, `span` returns a shared no-op context, so instrumentation
+    costs a context variable lookup. Spans opened in worker threads belong to the turn if the thread runs in a
+    copy of the turn's context (see `contextvars.copy_context`).
+    """
+
+    def __init__(self, settings: TraceSettings = TraceSettings()):
+        self.settings = settings
+        self.metrics = Metrics()
+        self.traces: Deque[Trace] = deque(maxlen=settings.max_traces)
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.settings.enabled
+
+    @contextmanager
+    def trace(self, name: str = "turn", **attributes: Any) -> Iterator[Optional[Trace]]:
+        """Trace a turn, yields None when tracing is off."""
+
+        if not self.enabled or _current_trace.get() is not None:
+            yield None
+            return
+
+        trace = Trace(name=name, attributes=attributes)
+        root = Span(name=name, attributes=attributes)
+        trace.spans.append(root)
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(root)
+        try:
+            yield trace
+        finally:
+            root.end = perf_counter()
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            self.finish(trace)
+
+    def span(self, name: str, **attributes: Any) -> ContextManager[Any]:
+        """Time a stage of the current turn, yields a Span (or a NullSpan) to add attributes to."""
+
+        trace = _current_trace.get()
+        if trace is None:
+            return _null_span
+        return self._span(trace, name, attributes)
+
+    def annotate(self, **attributes: Any) -> None:
+        """Add attributes to the current turn, they are included in its summary."""
+
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        trace.attributes.update(attributes)
+        trace.root.set(**attributes)
+
+    @contextmanager
+    def _span(self, trace: Trace, name: str, attributes: Dict[str, Any]) -> Iterator[Span]:
+        parent = _current_span.get()
+        span = Span(name=name, parent_id=parent.span_id if parent is not None else None, attributes=attributes)
+        with self._lock:
+            trace.spans.append(span)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.set(error=str(e))
+            raise
+        finally:
+            span.end = perf_counter()
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # A streamed response closed from another context
+                pass
+
+    def finish(self, trace: Trace) -> None:
+        with self._lock:
+            self.traces.append(trace)
+        self.metrics.record(trace)
+        try:
+            if self.settings.trace_file:
+                with open(self.settings.trace_file, "a") as f:
+                    f.writelines(json.dumps(span, default=str) + "\n" for span in trace.to_otel())
+            if self.settings.metrics_file:
+                # Written to a temporary file and renamed, so a scraper never reads a partial file
+                path = Path(self.settings.metrics_file)
+                tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+                tmp_path.write_text(self.metrics.render())
+                os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Could not export trace {trace.trace_id}: {e}")
+
+    def get_traces(self, run_id: Optional[str] = None) -> List[Trace]:
+        with self._lock:
+            return [t for t in self.traces if run_id is None or t.attributes.get("run_id") == run_id]
+
+
+# Shared by every assistant in this process
+tracer = Tracer()
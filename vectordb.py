@@ -0,0 +1,811 @@
+import json
+import re
+from hashlib import md5
+from math import sqrt
+from os import getenv
+from threading import Lock
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from pydantic import BaseModel
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql.expression import Select, func, literal_column, select, text
+from sqlalchemy.types import String
+
+from phi.document import Document
+from phi.utils.log import logger
+from phi.vectordb.distance import Distance
+from phi.vectordb.pgvector import PgVector2
+from phi.vectordb.pgvector.index import HNSW, Ivfflat
+
+from cache import TTLCache  # type: ignore
+from embeddings import EmbeddingCache, embed_documents  # type: ignore
+from rerank import Reranker, get_reranker  # type: ignore
+from tracing import tracer  # type: ignore
+
+
+class IndexSettings(BaseModel):
+    """ANN index settings for the knowledge base collection."""
+
+    # hnsw, ivfflat or none
+    index_type: str = getenv("LLM_OS_INDEX_TYPE", "hnsw").lower()
+    # HNSW: connections per node and candidate list size at build and query time
+    hnsw_m: int = int(getenv("LLM_OS_HNSW_M", "16"))
+    hnsw_ef_construction: int = int(getenv("LLM_OS_HNSW_EF_CONSTRUCTION", "64"))
+    hnsw_ef_search: int = int(getenv("LLM_OS_HNSW_EF_SEARCH", "40"))
+    # IVFFlat: number of lists (0 to size it from the number of rows) and lists scanned at query time
+    ivfflat_lists: int = int(getenv("LLM_OS_IVFFLAT_LISTS", "0"))
+    ivfflat_probes: int = int(getenv("LLM_OS_IVFFLAT_PROBES", "10"))
+    # Below this many rows an exact scan is fast enough, so the index is not built
+    min_rows: int = int(getenv("LLM_OS_INDEX_MIN_ROWS", "10000"))
+
+    def get_index(self) -> Optional[Union[HNSW, Ivfflat]]:
+        if self.index_type == "hnsw":
+            return HNSW(m=self.hnsw_m, ef_construction=self.hnsw_ef_construction, ef_search=self.hnsw_ef_search)
+        if self.index_type == "ivfflat":
+            return Ivfflat(
+                lists=self.ivfflat_lists or 100, probes=self.ivfflat_probes, dynamic_lists=self.ivfflat_lists == 0
+            )
+        if self.index_type == "none":
+            return None
+        raise ValueError(f"Unknown index type: {self.index_type}")
+
+
+class SearchSettings(BaseModel):
+    """Knowledge base search settings."""
+
+    # vector: nearest neighbors of the query embedding
+    # hybrid: also a full-text search on the same rows, the two result lists are merged with reciprocal rank fusion
+    mode: str = getenv("LLM_OS_SEARCH_MODE", "hybrid").lower()
+    # Results taken from each list before merging them
+    candidates: int = int(getenv("LLM_OS_SEARCH_CANDIDATES", "20"))
+    # Reciprocal rank fusion constant, larger values give less weight to the top ranks of each list
+    rrf_k: int = int(getenv("LLM_OS_SEARCH_RRF_K", "60"))
+    # Postgres text search configuration of the full-text index
+    text_search_config: str = getenv("LLM_OS_TEXT_SEARCH_CONFIG", "english")
+    # Reranker applied to the merged results: none, lexical or cross_encoder (needs sentence-transformers)
+    reranker: str = getenv("LLM_OS_RERANKER", "none").lower()
+    reranker_model: Optional[str] = getenv("LLM_OS_RERANKER_MODEL")
+    # Merged results passed to the reranker
+    rerank_top_n: int = int(getenv("LLM_OS_RERANK_TOP_N", "20"))
+
+
+class QuantizationSettings(BaseModel):
+    """Compact vector storage settings for the knowledge base collection."""
+
+    # none: the nearest neighbors are searched on the full precision embeddings
+    # halfvec: candidates are searched on half precision copies of the embeddings (pgvector 0.7+)
+    # binary: candidates are searched on one bit per dimension copies of the embeddings, by hamming distance
+    # The candidates are then re-scored exactly against the full precision embeddings
+    mode: str = getenv("LLM_OS_VECTOR_QUANTIZATION", "none").lower()
+    # Candidates re-scored for each result
+    rescore_factor: int = int(getenv("LLM_OS_VECTOR_RESCORE_FACTOR", "8"))
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Document]], k: int = 60) -> List[Document]:
+    """Merge ranked result lists, scoring each document with the sum of 1 / (k + rank) over the lists it is in."""
+
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for results in result_lists:
+        for rank, document in enumerate(results):
+            key = document.id or md5(document.content.encode()).hexdigest()
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+            documents.setdefault(key, document)
+    return [documents[key] for key in sorted(scores, key=lambda key: scores[key], reverse=True)]
+
+
+class PgVectorStore(PgVector2):
+    """PgVector2 collection used as the LLM OS knowledge base.
+
+    Documents are embedded in batches and written with one multi-row statement per batch,
+    instead of one embedding request and one statement per document.
+    Chunks already stored with the same content are skipped, and chunks embedded before
+    (under any id) are read from the embedding cache instead of being sent to the embedder.
+
+    Searches cache the query embedding and the top-k results. The results cache is cleared whenever
+    this collection is written to or cleared, writes from other processes are picked up once entries expire.
+
+    The ANN index is built once the collection reaches `index_min_rows`, and rebuilt concurrently (next to the
+    old index, which keeps serving searches) when its parameters change or an IVFFlat index outgrows its lists.
+
+    In hybrid search mode, a full-text search (on a GIN index over the content) runs next to the vector search,
+    so exact terms like ticker symbols, product names and error codes are found even when their embeddings are
+    not close to the query's. The results are merged with reciprocal rank fusion and optionally reranked.
+
+    With quantization, the ANN index (or, for binary vectors before pgvector 0.7, a scan) covers compact copies of
+    the embeddings: a half precision expression index (2 bytes per dimension), or a generated column of 1 bit per
+    dimension. The top `limit * rescore_factor` candidates are then ordered by their exact distance to the query,
+    read from the full precision embeddings of those rows only. The full precision index is not built.
+
+    :param index_min_rows: Number of rows at which the ANN index is built.
+    :param embedding_cache: Cache of chunk embeddings, keyed by embedder model, dimensions and content hash.
+    :param query_cache: Cache of query embeddings, these stay valid when the collection changes.
+    :param results_cache: Cache of search results.
+    :param search_settings: Search mode, candidates and reranker.
+    :param reranker: Reranker of the merged results, defaults to the one named in the search settings.
+    :param quantization: Compact storage of the embeddings searched for candidates.
+    """
+
+    def __init__(
+        self,
+        *args,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        query_cache: Optional[TTLCache] = None,
+        results_cache: Optional[TTLCache] = None,
+        index_min_rows: int = 0,
+        search_settings: Optional[SearchSettings] = None,
+        reranker: Optional[Reranker] = None,
+        quantization: Optional[QuantizationSettings] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.embedding_cache: Optional[EmbeddingCache] = embedding_cache
+        self.query_cache: Optional[TTLCache] = query_cache
+        self.results_cache: Optional[TTLCache] = results_cache
+        self.index_min_rows: int = index_min_rows
+        self.search_settings: SearchSettings = search_settings or SearchSettings()
+        if not re.fullmatch(r"\w+", self.search_settings.text_search_config):
+            raise ValueError(f"Invalid text search configuration: {self.search_settings.text_search_config}")
+        if reranker is None and self.search_settings.reranker != "none":
+            reranker = get_reranker(self.search_settings.reranker, self.search_settings.reranker_model)
+        self.reranker: Optional[Reranker] = reranker
+        self.quantization: QuantizationSettings = quantization or QuantizationSettings()
+        if self.quantization.mode not in ("none", "halfvec", "binary"):
+            raise ValueError(f"Unknown quantization mode: {self.quantization.mode}")
+        # Quantization used by searches, once the collection is checked for it
+        self._quantization_mode: Optional[str] = None
+        self._pgvector_version: Optional[Tuple[int, ...]] = None
+        self._create_lock = Lock()
+        self._index_lock = Lock()
+        self._text_index_ready = False
+        self._text_column_found = False
+        # Bumped whenever the cached search results are invalidated
+        self._results_generation: int = 0
+        # Number of chunks skipped because they are stored with the same content
+        self.unchanged_skipped: int = 0
+        # Called when the collection is cleared or deleted, to drop the state kept about its documents elsewhere
+        # (like the crawl state of the websites loaded into it)
+        self.on_clear: List[Callable[[], None]] = []
+
+    def create(self) -> None:
+        # The collection is shared by sessions and ingestion jobs, so only one of them creates it
+        with self._create_lock:
+            super().create()
+            if self.search_settings.mode == "hybrid":
+                self.ensure_text_index()
+            self.ensure_quantization()
+
+    def get_row(self, document: Document) -> Dict[str, Any]:
+        cleaned_content = document.content.replace("\x00", "\ufffd")
+        content_hash = md5(cleaned_content.encode()).hexdigest()
+        return {
+            "id": document.id or content_hash,
+            "name": document.name,
+            "meta_data": document.meta_data,
+            "content": cleaned_content,
+            "embedding": document.embedding,
+            "usage": document.usage,
+            "content_hash": content_hash,
+        }
+
+    def filter_unchanged(self, documents: List[Document]) -> List[Document]:
+        """Return the documents that are not stored yet, or are stored with a different content."""
+
+        if len(documents) == 0:
+            return documents
+        rows = [self.get_row(document) for document in documents]
+        with self.Session() as sess, sess.begin():
+            stmt = select(self.table.c.id, self.table.c.content_hash).where(
+                self.table.c.id.in_({row["id"] for row in rows})
+            )
+            stored = {row.id: row.content_hash for row in sess.execute(stmt).fetchall()}
+        changed = [document for document, row in zip(documents, rows) if stored.get(row["id"]) != row["content_hash"]]
+        self.unchanged_skipped += len(documents) - len(changed)
+        return changed
+
+    def embed_documents(self, documents: List[Document]) -> List[Document]:
+        """Embed documents in place, reading previously embedded chunks from the embedding cache."""
+        return embed_documents(self.embedder, documents, cache=self.embedding_cache)
+
+    def upsert_embedded(self, documents: List[Document]) -> int:
+        """Upsert documents that are already embedded in one statement. Returns the number of rows written."""
+
+        # A row can only be updated once per statement, so keep the last document for each id
+        rows: Dict[str, Dict[str, Any]] = {}
+        for document in documents:
+            row = self.get_row(document)
+            rows[row["id"]] = row
+        if len(rows) == 0:
+            return 0
+
+        stmt = postgresql.insert(self.table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["id"],
+            # Rows stored with the same content are left untouched
+            where=self.table.c.content_hash.is_distinct_from(stmt.excluded.content_hash),
+            set_=dict(
+                name=stmt.excluded.name,
+                meta_data=stmt.excluded.meta_data,
+                content=stmt.excluded.content,
+                embedding=stmt.excluded.embedding,
+                usage=stmt.excluded.usage,
+                content_hash=stmt.excluded.content_hash,
+            ),
+        )
+        with self.Session() as sess, sess.begin():
+            sess.execute(stmt, list(rows.values()))
+        self.invalidate_results()
+        logger.info(f"Upserted {len(rows)} documents")
+        return len(rows)
+
+    def delete_documents(self, ids: List[str]) -> int:
+        """Delete documents by id, like the chunks a page no longer has. Returns the number of rows deleted."""
+
+        if len(ids) == 0:
+            return 0
+        with self.Session() as sess, sess.begin():
+            deleted = sess.execute(self.table.delete().where(self.table.c.id.in_(ids))).rowcount
+        self.invalidate_results()
+        return deleted
+
+    def upsert(self, documents: List[Document], batch_size: int = 100) -> None:
+        """
+        Upsert documents into the database.
+
+        Args:
+            documents (List[Document]): List of documents to upsert
+            batch_size (int): Number of documents embedded and written together
+        """
+        for start in range(0, len(documents), batch_size):
+            batch = self.filter_unchanged(documents[start : start + batch_size])
+            self.embed_documents(batch)
+            self.upsert_embedded(batch)
+
+    def insert(self, documents: List[Document], batch_size: int = 10) -> None:
+        super().insert(documents, batch_size=batch_size)
+        self.invalidate_results()
+
+    def clear(self) -> bool:
+        cleared = super().clear()
+        self.invalidate_results()
+        self.run_on_clear()
+        return cleared
+
+    def delete(self) -> None:
+        super().delete()
+        self.invalidate_results()
+        self.run_on_clear()
+
+    def run_on_clear(self) -> None:
+        for callback in self.on_clear:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Could not clear the state of {self.collection}: {e}")
+
+    def invalidate_results(self) -> None:
+        # Searches running meanwhile do not cache their results
+        self._results_generation += 1
+        if self.results_cache is not None:
+            self.results_cache.clear()
+
+    ###########################################################################
+    # ANN index
+    ###########################################################################
+
+    def get_index_name(self) -> str:
+        if self.index is not None and self.index.name is not None:
+            return self.index.name
+        return f"{self.collection}_{'ivfflat' if isinstance(self.index, Ivfflat) else 'hnsw'}_index"
+
+    def get_qualified_name(self, name: str) -> str:
+        return f"{self.schema}.{name}" if self.schema is not None else name
+
+    def get_index_ops(self) -> Optional[str]:
+        """Return the operator class of the ANN index, or None if the quantization mode can not be indexed."""
+
+        mode = self.get_quantization_mode()
+        if mode == "binary":
+            # pgvector indexes bit strings from 0.7, before that the bits are scanned
+            return "bit_hamming_ops" if self.get_pgvector_version() >= (0, 7) else None
+        prefix = "halfvec" if mode == "halfvec" else "vector"
+        if self.distance == Distance.l2:
+            return f"{prefix}_l2_ops"
+        if self.distance == Distance.max_inner_product:
+            return f"{prefix}_ip_ops"
+        return f"{prefix}_cosine_ops"
+
+    def get_index_expression(self) -> str:
+        mode = self.get_quantization_mode()
+        if mode == "binary":
+            return "embedding_bits"
+        if mode == "halfvec":
+            return f"((embedding)::halfvec({self.dimensions}))"
+        return "embedding"
+
+    def get_index_options(self, num_rows: int) -> Dict[str, int]:
+        """Return the build parameters of the index for a collection with `num_rows` rows."""
+
+        if isinstance(self.index, HNSW):
+            return {"m": self.index.m, "ef_construction": self.index.ef_construction}
+        if isinstance(self.index, Ivfflat):
+            if not self.index.dynamic_lists:
+                return {"lists": self.index.lists}
+            # Same sizing as PgVector2.optimize: rows / 1000 up to 1M rows, sqrt(rows) after that
+            lists = num_rows // 1000 if num_rows < 1000000 else int(sqrt(num_rows))
+            return {"lists": max(lists, 1)}
+        return {}
+
+    def get_ann_indexes(self) -> Dict[str, Tuple[str, bool]]:
+        """Return the hnsw and ivfflat indexes on the collection, as index name -> (index definition, valid).
+
+        An interrupted CREATE INDEX CONCURRENTLY leaves an invalid index, which queries do not use.
+        """
+
+        with self.Session() as sess, sess.begin():
+            rows = sess.execute(
+                text(
+                    "SELECT i.indexname, i.indexdef, x.indisvalid FROM pg_indexes i "
+                    "JOIN pg_namespace n ON n.nspname = i.schemaname "
+                    "JOIN pg_class c ON c.relname = i.indexname AND c.relnamespace = n.oid "
+                    "JOIN pg_index x ON x.indexrelid = c.oid "
+                    "WHERE i.schemaname = :schema AND i.tablename = :table AND i.indexdef ~ 'USING (hnsw|ivfflat)'"
+                ),
+                {"schema": self.schema or "public", "table": self.collection},
+            ).fetchall()
+        return {row.indexname: (row.indexdef, row.indisvalid) for row in rows}
+
+    @staticmethod
+    def parse_index_definition(definition: str) -> Tuple[Optional[str], Optional[str], Dict[str, int]]:
+        """Return the access method, operator class and build parameters of an index definition."""
+
+        method = re.search(r"USING (\w+)", definition)
+        ops = re.search(r"(\w+_ops)\)", definition)
+        with_clause = re.search(r"WITH \((.*)\)", definition)
+        options_text = with_clause.group(1) if with_clause else ""
+        options = {key: int(value) for key, value in re.findall(r"(\w+)='?(\d+)'?", options_text)}
+        return method.group(1) if method else None, ops.group(1) if ops else None, options
+
+    def index_needs_rebuild(self, definition: str, num_rows: int) -> bool:
+        method, ops, options = self.parse_index_definition(definition)
+        if method != ("ivfflat" if isinstance(self.index, Ivfflat) else "hnsw") or ops != self.get_index_ops():
+            return True
+        if isinstance(self.index, Ivfflat) and self.index.dynamic_lists:
+            # Rebuild once the collection needs at least twice the lists the index was built with
+            return self.get_index_options(num_rows)["lists"] >= 2 * options.get("lists", 1)
+        return options != self.get_index_options(num_rows)
+
+    def build_index(self, name: str, num_rows: int) -> None:
+        """Build the index without blocking writes to the collection (CREATE INDEX CONCURRENTLY)."""
+
+        if self.index is None:
+            return
+        method = "ivfflat" if isinstance(self.index, Ivfflat) else "hnsw"
+        options = ", ".join(f"{key} = {value}" for key, value in self.get_index_options(num_rows).items())
+        logger.info(f"Building {method} index {name} on {self.table} with {options} for {num_rows} rows")
+        # Concurrent index builds can not run inside a transaction
+        with self.db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            try:
+                for key, value in self.index.configuration.items():
+                    connection.execute(text(f"SET {key} = '{value}'"))
+                # A failed concurrent build leaves an invalid index behind
+                connection.execute(text(f"DROP INDEX IF EXISTS {self.get_qualified_name(name)}"))
+                connection.execute(
+                    text(
+                        f"CREATE INDEX CONCURRENTLY {name} ON {self.table} "
+                        f"USING {method} ({self.get_index_expression()} {self.get_index_ops()}) WITH ({options})"
+                    )
+                )
+            finally:
+                for key in self.index.configuration:
+                    connection.execute(text(f"RESET {key}"))
+
+    def ensure_index(self, force_rebuild: bool = False, min_rows: Optional[int] = None) -> Optional[str]:
+        """Create the ANN index once the collection is large enough, and rebuild it when it is out of date.
+
+        Searches keep using the old index while the new one is built. Returns "created", "rebuilt", "dropped" or
+        None. The index is dropped when binary vectors are scanned instead (pgvector before 0.7).
+
+        :param force_rebuild: Rebuild the index even if its parameters are up to date, e.g. after a bulk load.
+        :param min_rows: Build the index only if the collection has this many rows, defaults to index_min_rows.
+        """
+
+        if self.index is None or not self.table_exists():
+            return None
+        with self._index_lock:
+            num_rows = self.get_count()
+            indexes = self.get_ann_indexes()
+            name = self.get_index_name()
+            if self.get_index_ops() is None:
+                if len(indexes) == 0:
+                    return None
+                with self.db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                    for index_name in indexes:
+                        connection.execute(
+                            text(f"DROP INDEX CONCURRENTLY IF EXISTS {self.get_qualified_name(index_name)}")
+                        )
+                logger.info(f"Dropped the ANN indexes on {self.table}, the binary vectors are scanned instead")
+                return "dropped"
+            if len(indexes) == 0:
+                if num_rows < (min_rows if min_rows is not None else self.index_min_rows):
+                    return None
+                action = "created"
+            elif force_rebuild or any(
+                not valid or self.index_needs_rebuild(definition, num_rows) for definition, valid in indexes.values()
+            ):
+                action = "rebuilt"
+            else:
+                return None
+
+            # Only one process builds the index at a time
+            lock_key = int(md5(f"{self.table}".encode()).hexdigest()[:15], 16)
+            with self.db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_connection:
+                if not lock_connection.execute(text(f"SELECT pg_try_advisory_lock({lock_key})")).scalar():
+                    logger.info(f"Index on {self.table} is being built by another process")
+                    return None
+                try:
+                    if action == "created":
+                        self.build_index(name, num_rows)
+                    else:
+                        # Build the new index next to the old one, then swap them in one transaction
+                        new_name = f"{name}_rebuild"
+                        self.build_index(new_name, num_rows)
+                        with self.Session() as sess, sess.begin():
+                            for index_name in [index_name for index_name in indexes if index_name != new_name]:
+                                sess.execute(text(f"DROP INDEX IF EXISTS {self.get_qualified_name(index_name)}"))
+                            sess.execute(text(f"ALTER INDEX {self.get_qualified_name(new_name)} RENAME TO {name}"))
+                finally:
+                    lock_connection.execute(text(f"SELECT pg_advisory_unlock({lock_key})"))
+            logger.info(f"Index {name} {action} on {self.table}")
+            return action
+
+    def optimize(self) -> None:
+        self.ensure_index(min_rows=0)
+
+    ###########################################################################
+    # Full-text index
+    ###########################################################################
+
+    def get_text_search_column(self) -> str:
+        return f"content_tsv_{self.search_settings.text_search_config}"
+
+    def ensure_text_index(self) -> None:
+        """Add the full-text column and index used by hybrid search, if the collection does not have them yet.
+
+        The tsvector of each row is stored in a generated column, so ranking the matches of a query does not parse
+        their content again. Adding the column to an existing collection rewrites the table once, so this runs when
+        the collection is created or loaded into, never from a search.
+        """
+
+        if self._text_index_ready or not self.table_exists():
+            return
+        column = self.get_text_search_column()
+        name = f"{self.collection}_{column}_index"
+        config = self.search_settings.text_search_config
+        try:
+            with self.db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                connection.execute(
+                    text(
+                        f"ALTER TABLE {self.table} ADD COLUMN IF NOT EXISTS {column} tsvector "
+                        f"GENERATED ALWAYS AS (to_tsvector('{config}'::regconfig, content)) STORED"
+                    )
+                )
+                if self.get_index_valid(name) is False:
+                    # A failed or interrupted CREATE INDEX CONCURRENTLY leaves an invalid index behind, which
+                    # IF NOT EXISTS would keep
+                    logger.info(f"Rebuilding invalid full-text index: {name}")
+                    connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {self.get_qualified_name(name)}"))
+                connection.execute(
+                    text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {self.table} USING gin ({column})")
+                )
+            self._text_index_ready = True
+        except Exception as e:
+            # Another process may be building it, the next create or load tries again
+            logger.warning(f"Could not create the full-text index {name}: {e}")
+
+    def get_index_valid(self, name: str) -> Optional[bool]:
+        """Return whether the index can be used by queries, None if the collection has no such index."""
+
+        with self.Session() as sess, sess.begin():
+            return sess.execute(
+                text(
+                    "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                    "JOIN pg_namespace n ON n.oid = c.relnamespace WHERE n.nspname = :schema AND c.relname = :name"
+                ),
+                {"schema": self.schema or "public", "name": name},
+            ).scalar()
+
+    def has_text_search_column(self) -> bool:
+        """Return whether the collection has the full-text column, without adding it."""
+
+        if self._text_index_ready or self._text_column_found:
+            return True
+        with self.Session() as sess, sess.begin():
+            found = sess.execute(
+                text(
+                    "SELECT 1 FROM information_schema.columns "
+                    "WHERE table_schema = :schema AND table_name = :table AND column_name = :column"
+                ),
+                {"schema": self.schema or "public", "table": self.collection, "column": self.get_text_search_column()},
+            ).scalar()
+        self._text_column_found = found is not None
+        return self._text_column_found
+
+    ###########################################################################
+    # Quantization
+    ###########################################################################
+
+    def get_pgvector_version(self) -> Tuple[int, ...]:
+        if self._pgvector_version is None:
+            with self.Session() as sess, sess.begin():
+                version = sess.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+            self._pgvector_version = tuple(int(part) for part in re.findall(r"\d+", version or "0"))
+        return self._pgvector_version
+
+    def get_quantization_mode(self) -> str:
+        self.ensure_quantization()
+        return self._quantization_mode or "none"
+
+    def ensure_quantization(self) -> None:
+        """Add the compact copies of the embeddings searched for candidates, if the collection does not have them.
+
+        Half precision vectors are cast in the index expression, so they need no column. Binary vectors are stored
+        in a generated column, which rewrites the table once when it is added to an existing collection.
+        """
+
+        if self._quantization_mode is not None:
+            return
+        if self.quantization.mode == "none":
+            self._quantization_mode = "none"
+            return
+        if not self.table_exists():
+            return
+        version = self.get_pgvector_version()
+        if self.quantization.mode == "halfvec":
+            if version < (0, 7):
+                logger.warning(
+                    f"Half precision vectors need pgvector 0.7 or later, found {'.'.join(map(str, version))}: "
+                    f"searching the full precision embeddings of {self.table}"
+                )
+                self._quantization_mode = "none"
+            else:
+                self._quantization_mode = "halfvec"
+            return
+
+        if version >= (0, 7):
+            quantize = "binary_quantize"
+        else:
+            quantize = self.get_qualified_name("llm_os_binary_quantize")
+        try:
+            with self.db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                if version < (0, 7):
+                    # Same as pgvector's binary_quantize: 1 for the dimensions above 0
+                    connection.execute(
+                        text(
+                            f"CREATE OR REPLACE FUNCTION {quantize}(v vector) RETURNS varbit "
+                            "LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$ "
+                            "SELECT string_agg(CASE WHEN x > 0 THEN '1' ELSE '0' END, '' ORDER BY i)::varbit "
+                            "FROM unnest(v::real[]) WITH ORDINALITY AS t(x, i) $$"
+                        )
+                    )
+                connection.execute(
+                    text(
+                        f"ALTER TABLE {self.table} ADD COLUMN IF NOT EXISTS embedding_bits bit({self.dimensions}) "
+                        f"GENERATED ALWAYS AS ({quantize}(embedding)::bit({self.dimensions})) STORED"
+                    )
+                )
+            self._quantization_mode = "binary"
+        except Exception as e:
+            # Another process may be adding it, the next search tries again
+            logger.warning(f"Could not add the binary vectors to {self.table}: {e}")
+
+    def get_candidate_distance(self, query_embedding: List[float]) -> Any:
+        """Return the distance of the compact copy of each embedding to the query, to order candidates by."""
+
+        if self.get_quantization_mode() == "binary":
+            bits = "".join("1" if value > 0 else "0" for value in query_embedding)
+            query_bits = literal_column(f"B'{bits}'")
+            if self.get_pgvector_version() >= (0, 7):
+                # The hamming distance operator, which the ANN index supports
+                return literal_column("embedding_bits").op("<~>")(query_bits)
+            return func.bit_count(literal_column("embedding_bits").op("#")(query_bits))
+        if self.distance == Distance.l2:
+            operator = "<->"
+        elif self.distance == Distance.max_inner_product:
+            operator = "<#>"
+        else:
+            operator = "<=>"
+        query_vector = ",".join(str(float(value)) for value in query_embedding)
+        return literal_column(self.get_index_expression()).op(operator)(
+            literal_column(f"'[{query_vector}]'::halfvec({self.dimensions})")
+        )
+
+    ###########################################################################
+    # Search
+    ###########################################################################
+
+    def get_query_embedding(self, query: str) -> Optional[List[float]]:
+        with tracer.span("embedding", model=getattr(self.embedder, "model", None), cached=True) as span:
+
+            def _embed() -> Optional[List[float]]:
+                span.set(cached=False)
+                return self.embedder.get_embedding(query)
+
+            if self.query_cache is None:
+                return _embed()
+            key = (getattr(self.embedder, "model", None), self.dimensions, normalize_query(query))
+            return self.query_cache.get_or_set(key, _embed)
+
+    def search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        with tracer.span("knowledge_search", limit=limit, cached=self.results_cache is not None) as span:
+            if self.results_cache is None:
+                results = self.search_uncached(query, limit=limit, filters=filters)
+            else:
+                key = (normalize_query(query), limit, json.dumps(filters, sort_keys=True, default=str))
+                generation = self._results_generation
+                results = self.results_cache.get(key)
+                if results is None:
+                    span.set(cached=False)
+                    start = perf_counter()
+                    results = self.search_uncached(query, limit=limit, filters=filters)
+                    # Results of a search that ran while the collection was written to may miss the write, so they
+                    # are not cached. Checked again after caching them, in case the write happened in between.
+                    if results is not None and generation == self._results_generation:
+                        self.results_cache.set(key, results, cost=perf_counter() - start)
+                        if generation != self._results_generation:
+                            self.results_cache.pop(key)
+            if results is None:
+                return []
+            span.set(results=len(results))
+            # Return copies, so callers can not change the cached documents (or their meta_data and embedding)
+            return [document.model_copy(deep=True) for document in results]
+
+    def search_uncached(
+        self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None
+    ) -> Optional[List[Document]]:
+        """Vector or hybrid search, using the query embedding cache. Returns None if the search failed."""
+
+        query_embedding = self.get_query_embedding(query)
+        if query_embedding is None:
+            logger.error(f"Error getting embedding for Query: {query}")
+            return []
+        if self.search_settings.mode != "hybrid":
+            return self.search_by_embedding(query_embedding, limit=limit, filters=filters)
+
+        if not self.has_text_search_column():
+            # The full-text column is added when the collection is created or loaded into
+            logger.warning(f"{self.table} has no full-text column yet, searching the embeddings only")
+            return self.search_by_embedding(query_embedding, limit=limit, filters=filters)
+
+        candidates = max(limit, self.search_settings.candidates)
+        vector_results = self.search_by_embedding(query_embedding, limit=candidates, filters=filters)
+        text_results = self.search_text(query, limit=candidates, filters=filters)
+        if vector_results is None or text_results is None:
+            return None
+        results = reciprocal_rank_fusion([vector_results, text_results], k=self.search_settings.rrf_k)
+        if self.reranker is not None:
+            top_n = max(limit, self.search_settings.rerank_top_n)
+            with tracer.span("rerank", results=len(results[:top_n])):
+                results = self.reranker.rerank(query, results[:top_n])
+        return results[:limit]
+
+    def search_text(
+        self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None
+    ) -> Optional[List[Document]]:
+        """Return the documents matching any term of `query`, best first. Returns None if the search failed."""
+
+        config = literal_column(f"'{self.search_settings.text_search_config}'::regconfig")
+        # plainto_tsquery requires every term, so its terms are combined with OR instead
+        ts_query = func.to_tsquery(config, func.replace(func.plainto_tsquery(config, query).cast(String), "&", "|"))
+        ts_vector = literal_column(self.get_text_search_column())
+        stmt = self.apply_filters(self.select_documents(), filters)
+        # ts_rank weighs the frequency of the query terms, normalized by the log of the document length (1).
+        # It is several times faster than ts_rank_cd on queries matching many rows.
+        rank = func.ts_rank(ts_vector, ts_query, 1)
+        stmt = stmt.where(ts_vector.op("@@")(ts_query)).order_by(rank.desc())
+        stmt = stmt.limit(limit=limit)
+        try:
+            with tracer.span("text_search", limit=limit), self.Session() as sess, sess.begin():
+                rows = sess.execute(stmt).fetchall() or []
+        except Exception as e:
+            logger.error(f"Error searching for documents: {e}")
+            return None
+        return self.get_documents(rows)
+
+    def select_documents(self) -> Select:
+        return select(
+            self.table.c.id,
+            self.table.c.name,
+            self.table.c.meta_data,
+            self.table.c.content,
+            self.table.c.embedding,
+            self.table.c.usage,
+        )
+
+    def apply_filters(self, stmt: Select, filters: Optional[Dict[str, Any]]) -> Select:
+        if filters is not None:
+            for key, value in filters.items():
+                if hasattr(self.table.c, key):
+                    stmt = stmt.where(getattr(self.table.c, key) == value)
+        return stmt
+
+    def get_documents(self, rows: List[Any]) -> List[Document]:
+        return [
+            Document(
+                id=row.id,
+                name=row.name,
+                meta_data=row.meta_data,
+                content=row.content,
+                embedder=self.embedder,
+                embedding=row.embedding,
+                usage=row.usage,
+            )
+            for row in rows
+        ]
+
+    def search_by_embedding(
+        self,
+        query_embedding: List[float],
+        limit: int = 5,
+        filters: Optional[Dict[str, Any]] = None,
+        exact: bool = False,
+    ) -> Optional[List[Document]]:
+        """Return the documents nearest to `query_embedding`, or None if the search failed.
+
+        :param exact: Scan the whole collection instead of using the ANN index, on the full precision embeddings.
+        """
+
+        if self.distance == Distance.l2:
+            distance = self.table.c.embedding.l2_distance(query_embedding)
+        elif self.distance == Distance.max_inner_product:
+            distance = self.table.c.embedding.max_inner_product(query_embedding)
+        else:
+            distance = self.table.c.embedding.cosine_distance(query_embedding)
+        mode = "none" if exact else self.get_quantization_mode()
+        candidates = limit
+        if mode == "none":
+            stmt = self.apply_filters(self.select_documents(), filters)
+        else:
+            # The candidates are found on the compact vectors, then only their full precision embeddings are read
+            candidates = limit * self.quantization.rescore_factor
+            candidates_query = (
+                self.apply_filters(select(self.table.c.id), filters)
+                .order_by(self.get_candidate_distance(query_embedding))
+                .limit(candidates)
+                .subquery()
+            )
+            stmt = self.select_documents().join(candidates_query, candidates_query.c.id == self.table.c.id)
+        stmt = stmt.order_by(distance).limit(limit=limit)
+
+        try:
+            with tracer.span(
+                "vector_search", limit=limit, exact=exact, quantization=mode, candidates=candidates
+            ), self.Session() as sess, sess.begin():
+                if exact:
+                    sess.execute(text("SET LOCAL enable_indexscan = off"))
+                elif isinstance(self.index, Ivfflat):
+                    sess.execute(text(f"SET LOCAL ivfflat.probes = {self.index.probes}"))
+                elif isinstance(self.index, HNSW):
+                    # An HNSW scan returns at most ef_search rows
+                    sess.execute(text(f"SET LOCAL hnsw.ef_search = {max(self.index.ef_search, min(candidates, 1000))}"))
+                neighbors = sess.execute(stmt).fetchall() or []
+        except Exception as e:
+            logger.error(f"Error searching for documents: {e}")
+            logger.error("Table might not exist, creating for future use")
+            self.create()
+            # Failed searches are not cached
+            return None
+
+        return self.get_documents(neighbors)
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return {
+            "query_cache": self.query_cache.stats() if self.query_cache is not None else None,
+            "results_cache": self.results_cache.stats() if self.results_cache is not None else None,
+            "embedding_cache": self.embedding_cache.stats() if self.embedding_cache is not None else None,
+        }
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip()